@@ -0,0 +1,131 @@
+"""Cold start time of the light ``python -m missing_record`` commands.
+
+Each command is run in a fresh interpreter, as it would be from a scheduled
+task, against throwaway html files and a local SMTP sink. Exits with an error
+if any of them takes longer than --budget seconds or loads one of the heavy
+libraries they shouldn't need. Run from the repository root::
+
+    python -m benchmarks.cold_start
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+from tests.smtp_sink import start_sink
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Libraries that only fetching, rendering and the database need
+HEAVY = ["pandas", "numpy", "matplotlib", "hydrobot", "hilltoppy", "sqlalchemy"]
+
+# Runs a command, then reports which heavy libraries it loaded
+CHILD = f"""
+import json, runpy, sys
+sys.argv = ["missing_record"] + sys.argv[1:]
+try:
+    runpy.run_module("missing_record", run_name="__main__")
+except SystemExit:
+    pass
+print(json.dumps([m for m in {HEAVY!r} if m in sys.modules]))
+"""
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="runs of each command, best is kept"
+    )
+    parser.add_argument(
+        "--budget", type=float, default=1.0, help="most seconds a command can take"
+    )
+    return parser.parse_args(argv)
+
+
+def time_command(argv, env, repeat):
+    """Best wall time of a command in a fresh interpreter, and what it loaded."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD, *argv],
+            cwd=REPO_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, json.loads(output.splitlines()[-1])
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with open(os.path.join(REPO_DIR, "config_files", "recipients.yaml")) as file:
+        recipients = yaml.safe_load(file)
+
+    server = start_sink()
+    env = dict(
+        os.environ,
+        EMAIL_SERVER="127.0.0.1",
+        EMAIL_PORT=str(server.port),
+        EMAIL_STARTTLS="false",
+        EMAIL_PASSWORD="",
+        EMAIL_ADDRESS="reports@example.com",
+        EMAIL_RATE_PER_MINUTE="1000000",
+        EMAIL_BURST="1000",
+        **{recipient: "someone@example.com" for recipient in recipients},
+    )
+    env.pop("EMAIL_SERVER_CONFIG_PATH", None)
+
+    failed = []
+    with tempfile.TemporaryDirectory() as html_dir, tempfile.TemporaryDirectory() as destination:
+        for recipient in recipients.values():
+            for suffix in recipient["file_suffix"]:
+                with open(os.path.join(html_dir, f"output{suffix}.html"), "w") as f:
+                    f.write("<table></table>")
+        commands = {
+            "--help": ["--help"],
+            "copy": ["copy", destination, "--html-dir", html_dir],
+            "send": ["send", "--title", "cold start", "--html-dir", html_dir],
+        }
+        for name, command in commands.items():
+            seconds, loaded = time_command(command, env, args.repeat)
+            flag = ""
+            if seconds > args.budget or loaded:
+                flag = "  TOO SLOW" if seconds > args.budget else ""
+                flag += f"  loaded {', '.join(loaded)}" if loaded else ""
+                failed.append(name)
+            print(f"  {name:<8}{seconds:8.3f}s{flag}")
+    server.shutdown()
+
+    # For comparison, what every command used to pay for
+    start = time.perf_counter()
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import missing_record.generate_missing_data_csvs,"
+            " missing_record.generate_html, missing_record.send_email",
+        ],
+        cwd=REPO_DIR,
+        env=env,
+        check=True,
+    )
+    print(f"  {'import all':<8}{time.perf_counter() - start:8.3f}s")
+
+    if failed:
+        print(f"Over budget or too heavy: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+"""End-to-end benchmark of a missing record run against a synthetic Hilltop.
+
+Run from the repository root, e.g.::
+
+    python -m benchmarks.run_benchmark --sites 60 --days 7 --save baseline.json
+    python -m benchmarks.run_benchmark --sites 60 --days 7 --compare baseline.json
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import urllib.request
+
+import pandas as pd
+import yaml
+
+import missing_record.generate_html as generate_html
+import missing_record.generate_missing_data_csvs as generate_missing_data_csvs
+from benchmarks.synthetic_hilltop import serve
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SITES_FIXTURE = os.path.join(REPO_DIR, "benchmarks", "sites.csv")
+
+# Metrics compared against a baseline, lower is better for all of them
+COMPARED = [
+    "total_wall",
+    "csv_wall",
+    "csv_cpu",
+    "html_wall",
+    "html_cpu",
+    "requests",
+    "bytes",
+]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sites", type=int, default=60, help="number of sites")
+    parser.add_argument("--days", type=int, default=7, help="length of the window")
+    parser.add_argument(
+        "--end",
+        default="2025-03-31 23:59:59",
+        help="end of the window (default %(default)s)",
+    )
+    parser.add_argument(
+        "--buckets",
+        default="",
+        help="comma separated buckets to include (default all of them)",
+    )
+    parser.add_argument(
+        "--sampling",
+        default="300,900",
+        help="comma separated sampling intervals in seconds (default %(default)s)",
+    )
+    parser.add_argument(
+        "--gap-density", type=float, default=0.05, help="fraction of hours missing"
+    )
+    parser.add_argument(
+        "--empty-fraction",
+        type=float,
+        default=0.6,
+        help="fraction of site/measurement pairs with no data",
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=5, help="delay added to each response"
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="override a config value (yaml), e.g. --set max_in_flight=16",
+    )
+    parser.add_argument("--save", help="save the results as a baseline json")
+    parser.add_argument("--compare", help="compare with a saved baseline json")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="relative slowdown that counts as a regression (default %(default)s)",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="show the output of the run"
+    )
+    return parser.parse_args(argv)
+
+
+def site_fixture(n_sites):
+    """The first n_sites of the fixture, repeated with new names if needed."""
+    fixture = pd.read_csv(SITES_FIXTURE)
+    repeats = [fixture]
+    while sum(len(f) for f in repeats) < n_sites:
+        copy = fixture.copy()
+        copy["SiteName"] = copy["SiteName"] + f" ({len(repeats) + 1})"
+        repeats.append(copy)
+    sites = pd.concat(repeats, ignore_index=True).head(n_sites)
+    sites["SiteID"] = range(1, len(sites) + 1)
+    return sites
+
+
+def active_measurements(buckets):
+    """Rows of Active_Measurements.csv, only those in buckets if given."""
+    with open(os.path.join(REPO_DIR, "config_files", "Active_Measurements.csv")) as f:
+        measurements = [row for row in csv.reader(f) if len(row) > 0]
+    if buckets:
+        measurements = [m for m in measurements if m[1] in buckets]
+    return measurements
+
+
+def write_workdir(workdir, args, base_url, measurements):
+    """Lay out a working directory for the run, returning the config path."""
+    os.makedirs(os.path.join(workdir, "config_files"))
+    os.makedirs(os.path.join(workdir, "output_csv"))
+    os.makedirs(os.path.join(workdir, "output_html"))
+    with open(
+        os.path.join(workdir, "config_files", "Active_Measurements.csv"),
+        "w",
+        newline="",
+    ) as f:
+        csv.writer(f).writerows(measurements)
+
+    site_fixture(args.sites).to_csv(os.path.join(workdir, "sites.csv"), index=False)
+    for name in ["site_starts.csv", "site_ends.csv"]:
+        with open(os.path.join(workdir, name), "w") as f:
+            f.write("Site,Measurement,Datetime\n")
+
+    with open(os.path.join(REPO_DIR, "config_files", "script_config.yaml")) as f:
+        config = yaml.safe_load(f)
+    end = pd.Timestamp(args.end)
+    start = (end - pd.Timedelta(days=args.days)).ceil("D")
+    config.update(
+        {
+            "base_url": base_url,
+            "start": start.strftime("%Y-%m-%d %H:%M"),
+            "end": end.strftime("%Y-%m-%d %H:%M:%S"),
+            "site_list_file": "sites.csv",
+            "site_starts_file": "site_starts.csv",
+            "site_ends_file": "site_ends.csv",
+            # A benchmark run shouldn't write to the dev database
+            "record_history": False,
+        }
+    )
+    for setting in args.set:
+        key, value = setting.split("=", 1)
+        config[key] = yaml.safe_load(value)
+    config_path = os.path.join(workdir, "config.yaml")
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f)
+    return config_path
+
+
+def server_stats(base_url):
+    with urllib.request.urlopen(base_url + "stats") as response:
+        return json.load(response)
+
+
+def timed(stages, name, func, *args):
+    """Run func, recording its wall and CPU time under stages[name]."""
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    result = func(*args)
+    stages[name] = {
+        "wall": time.perf_counter() - wall,
+        "cpu": time.process_time() - cpu,
+    }
+    return result
+
+
+def run(args):
+    """Run the csv and html stages once, returning the results as a dict."""
+    settings = {
+        "sampling_seconds": [int(s) for s in args.sampling.split(",")],
+        "gap_density": args.gap_density,
+        "empty_fraction": args.empty_fraction,
+        "latency_ms": args.latency_ms,
+    }
+    measurements = active_measurements([b for b in args.buckets.split(",") if b])
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=serve,
+        args=(settings, [m[0] for m in measurements], port_queue),
+        daemon=True,
+    )
+    server.start()
+    workdir = tempfile.mkdtemp(prefix="missing_record_benchmark_")
+    cwd = os.getcwd()
+    try:
+        base_url = f"http://127.0.0.1:{port_queue.get(timeout=30)}/"
+        config_path = write_workdir(workdir, args, base_url, measurements)
+
+        os.chdir(workdir)
+        stages = {}
+        output = io.StringIO()
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else output):
+            results = timed(
+                stages, "csv", generate_missing_data_csvs.generate, config_path
+            )
+            timed(stages, "html", generate_html.generate, config_path, results)
+        stats = server_stats(base_url)
+    finally:
+        os.chdir(cwd)
+        server.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    total_wall = sum(stage["wall"] for stage in stages.values())
+    report = {
+        "settings": {
+            "sites": args.sites,
+            "days": args.days,
+            "end": args.end,
+            "measurements": len(measurements),
+            "config": args.set,
+            **settings,
+        },
+        "total_wall": total_wall,
+        "sites_per_sec": args.sites / total_wall,
+        "requests": stats["requests"],
+        "bytes": stats["bytes"],
+    }
+    for name, stage in stages.items():
+        report[f"{name}_wall"] = stage["wall"]
+        report[f"{name}_cpu"] = stage["cpu"]
+    return report
+
+
+def print_report(report):
+    print(
+        f"{report['settings']['sites']} sites x"
+        f" {report['settings']['measurements']} measurements,"
+        f" {report['settings']['days']} days"
+    )
+    print(f"  sites/sec  {report['sites_per_sec']:10.2f}")
+    print(f"  requests   {report['requests']:10d}")
+    print(f"  bytes      {report['bytes']:10d}")
+    for stage in ["csv", "html"]:
+        print(
+            f"  {stage:<5} wall {report[f'{stage}_wall']:8.3f}s"
+            f"  cpu {report[f'{stage}_cpu']:8.3f}s"
+        )
+
+
+def compare(report, baseline, tolerance):
+    """Print the change from a baseline, returning the regressed metrics."""
+    if report["settings"] != baseline["settings"]:
+        print("Warning: the baseline was run with different settings")
+    regressed = []
+    print(f"  {'metric':<12}{'baseline':>14}{'now':>14}{'change':>10}")
+    for metric in COMPARED:
+        before = baseline[metric]
+        after = report[metric]
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > tolerance:
+            flag = "  REGRESSION"
+            regressed.append(metric)
+        number = "d" if isinstance(before, int) else ".3f"
+        print(
+            f"  {metric:<12}{before:>14{number}}{after:>14{number}}"
+            f"{change:>+10.1%}{flag}"
+        )
+    return regressed
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    print_report(report)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressed = compare(report, baseline, args.tolerance)
+        if regressed:
+            print(f"Regressed: {', '.join(regressed)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
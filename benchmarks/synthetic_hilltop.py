@@ -0,0 +1,177 @@
+"""A local stand-in for a Hilltop server, serving synthetic series."""
+
+import hashlib
+import json
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+# Synthetic data starts here, so series line up from run to run
+ORIGIN = pd.Timestamp("2020-01-01")
+
+
+class SyntheticHilltop:
+    """Deterministic synthetic series for every site/measurement pair.
+
+    Parameters
+    ----------
+    sampling_seconds : list of int
+        Sampling intervals, each series gets one of these.
+    gap_density : float
+        Fraction of hours with no samples.
+    empty_fraction : float
+        Fraction of site/measurement pairs with no data at all.
+    latency_ms : float
+        Delay added to every response.
+    """
+
+    def __init__(self, sampling_seconds, gap_density, empty_fraction, latency_ms):
+        self.sampling_seconds = list(sampling_seconds)
+        self.gap_density = gap_density
+        self.empty_fraction = empty_fraction
+        self.latency_ms = latency_ms
+        self.requests = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _hash(*parts):
+        digest = hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+        return int(digest[:12], 16)
+
+    def has_data(self, site, measurement):
+        """Whether a pair has any data."""
+        return (self._hash(site, measurement) % 10000) / 10000 >= self.empty_fraction
+
+    def samples(self, site, measurement, start, end):
+        """Sample times of a pair in [start, end], as int64 epoch seconds."""
+        key = self._hash(site, measurement)
+        step = self.sampling_seconds[key % len(self.sampling_seconds)]
+        origin = ORIGIN.value // 10**9
+        first = pd.Timestamp(start).value // 10**9
+        last = pd.Timestamp(end).value // 10**9
+        first = origin + max(0, -(-(first - origin) // step)) * step
+        times = np.arange(first, last + 1, step, dtype=np.int64)
+        # Gaps are whole hours, picked by a hash of the hour so they don't
+        # depend on the window that was asked for
+        hours = (times // 3600).astype(np.uint64)
+        mixed = (hours * np.uint64(2654435761) + np.uint64(key)) % np.uint64(10000)
+        return times[mixed >= self.gap_density * 10000]
+
+    def get_data(self, site, measurement, start, end, method=None, interval=None):
+        """A GetData response body."""
+        if not self.has_data(site, measurement):
+            return "<HilltopServer><Error>No data found</Error></HilltopServer>"
+        times = self.samples(site, measurement, start, end)
+        if method is not None:
+            amount, unit = interval.split()
+            step = int(amount) * {"day": 86400, "hour": 3600, "minute": 60}[unit]
+            first = pd.Timestamp(start).value // 10**9
+            last = pd.Timestamp(end).value // 10**9
+            starts = np.arange(first, last, step, dtype=np.int64)
+            counts = np.bincount((times - first) // step, minlength=len(starts))
+            counts = counts[: len(starts)]
+            # Interval statistics are stamped at the end of the interval
+            values = zip((starts + step).astype("datetime64[s]"), counts)
+        else:
+            values = zip(times.astype("datetime64[s]"), np.ones(len(times)))
+        elements = "".join(f"<E><T>{t}</T><I1>{v:g}</I1></E>" for (t, v) in values)
+        return (
+            f'<Hilltop><Agency>Synthetic</Agency><Measurement SiteName="{site}">'
+            f'<DataSource Name="{measurement}" NumItems="1"><TSType>StdSeries</TSType>'
+            "<DataType>SimpleTimeSeries</DataType><Interpolation>Instant</Interpolation>"
+            f'<ItemInfo ItemNumber="1"><ItemName>{measurement}</ItemName>'
+            "<ItemFormat>F</ItemFormat><Divisor>1</Divisor><Units></Units>"
+            "<Format>#.###</Format></ItemInfo></DataSource>"
+            f'<Data DateFormat="Calendar" NumItems="1">{elements}</Data>'
+            "</Measurement></Hilltop>"
+        )
+
+    def measurement_list(self, site, measurements):
+        """A MeasurementList response body listing the pairs with data."""
+        data_sources = []
+        for measurement in measurements:
+            if not self.has_data(site, measurement):
+                continue
+            name = measurement.split(" [")[0]
+            data_sources.append(
+                f'<DataSource Name="{name}" Site="{site}"><NumItems>1</NumItems>'
+                "<TSType>StdSeries</TSType><DataType>SimpleTimeSeries</DataType>"
+                f"<From>{ORIGIN.isoformat()}</From><To>2100-01-01T00:00:00</To>"
+                f'<Measurement Name="{name}"><RequestAs>{measurement}</RequestAs>'
+                "</Measurement></DataSource>"
+            )
+        return (
+            "<HilltopServer><Agency>Synthetic</Agency>"
+            f"{''.join(data_sources)}</HilltopServer>"
+        )
+
+
+def serve(settings, measurements, port_queue):
+    """Serve a SyntheticHilltop on a free local port until killed.
+
+    Meant to be run in its own process, so the server doesn't take CPU time
+    from the run being measured. The port is put on port_queue once the
+    server is listening. /stats returns the request and byte counts as json.
+
+    Parameters
+    ----------
+    settings : dict
+        Keyword arguments for SyntheticHilltop.
+    measurements : list of str
+        Measurements to list in MeasurementList responses.
+    port_queue : multiprocessing.Queue
+        Gets the port the server is listening on.
+    """
+    hilltop = SyntheticHilltop(**settings)
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            if url.path == "/stats":
+                self._send(
+                    json.dumps({"requests": hilltop.requests, "bytes": hilltop.bytes}),
+                    count=False,
+                )
+                return
+
+            query = dict(urllib.parse.parse_qsl(url.query))
+            if query.get("Request") == "MeasurementList":
+                body = hilltop.measurement_list(query["Site"], measurements)
+            elif query.get("Request") == "GetData":
+                start, end = query["TimeInterval"].split("/")
+                body = hilltop.get_data(
+                    query["Site"],
+                    query["Measurement"],
+                    start,
+                    end,
+                    query.get("Method"),
+                    query.get("Interval"),
+                )
+            else:
+                body = "<HilltopServer><Error>Unknown request</Error></HilltopServer>"
+            time.sleep(hilltop.latency_ms / 1000)
+            self._send(body)
+
+        def _send(self, body, count=True):
+            raw = body.encode("utf-8")
+            if count:
+                with hilltop._lock:
+                    hilltop.requests += 1
+                    hilltop.bytes += len(raw)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/xml")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    port_queue.put(server.server_port)
+    server.serve_forever()
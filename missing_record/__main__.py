@@ -0,0 +1,6 @@
+"""``python -m missing_record``, see missing_record.cli."""
+
+from missing_record.cli import main
+
+if __name__ == "__main__":
+    main()
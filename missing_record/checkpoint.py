@@ -0,0 +1,153 @@
+"""Journal of finished site/measurement results, so an interrupted run can resume."""
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future
+
+
+class CheckpointJournal:
+    """Append-only journal of the results of one run window.
+
+    Every finished pair is appended (and flushed) as one json line, so if the
+    run dies the next run with the same window only does the pairs that are
+    left. A pair that failed with a ValueError is journalled with its error
+    message, and fails with it again when it's picked up. A torn last line
+    from a crash is ignored.
+
+    Parameters
+    ----------
+    path : str
+        The journal file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    key = (entry["site"], entry["measurement"])
+                    if "error" in entry:
+                        self.done[key] = ValueError(entry["error"])
+                    else:
+                        self.done[key] = _as_tuples(entry["result"])
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    @classmethod
+    def from_config(
+        cls,
+        config,
+        windows,
+        coverage_views=(),
+        gap_index=False,
+        shard=None,
+        override_files=(),
+    ):
+        """Open the journal for a run's windows, or None if it's off.
+
+        windows is a dict of name -> (start, end), as in generate(). A run
+        with different resolutions or outputs, or each shard of a run, gets a
+        journal of its own. So does a run after one of the override_files
+        (the site open/close CSVs the results were worked out with) has
+        changed, going by its modification time and size.
+        """
+        if not config.get("checkpoint_dir"):
+            return None
+        key = "|".join(
+            [
+                config["base_url"],
+                config["hts"],
+                repr(sorted(windows.items(), key=str)),
+                repr(config.get("default_resolution")),
+                repr(sorted((config.get("bucket_resolutions") or {}).items())),
+                repr(list(coverage_views)),
+                repr(bool(gap_index)),
+                repr(sorted((config.get("bucket_aggregation") or {}).items())),
+                repr(shard),
+                repr([_file_stamp(path) for path in override_files]),
+            ]
+        ).encode("utf-8")
+        return cls(
+            os.path.join(
+                config["checkpoint_dir"], hashlib.sha1(key).hexdigest()[:20] + ".jsonl"
+            )
+        )
+
+    def finished(self, site, measurement):
+        """A completed Future of the journalled result, or None if not done.
+
+        A journalled error is raised again by the future's result().
+        """
+        if (site, measurement) not in self.done:
+            return None
+        future = Future()
+        done = self.done[(site, measurement)]
+        if isinstance(done, ValueError):
+            future.set_exception(done)
+        else:
+            future.set_result(done)
+        return future
+
+    def record(self, site, measurement, result, error=None):
+        """Append a pair's result, a tuple of (missing, total) or None per window.
+
+        Or the message of the error the pair failed with, if error is given.
+        """
+        entry = {"site": site, "measurement": measurement}
+        if error is None:
+            entry["result"] = result
+        else:
+            entry["error"] = error
+        line = json.dumps(entry, default=int)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def record_future(self, site, measurement, future):
+        """Done callback that journals a pair's future once it finishes.
+
+        A ValueError is journalled with its message, which the run reports
+        (and treats as no result) again when it resumes. Other errors and
+        cancelled pairs aren't journalled, so they're tried again next time.
+        """
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            self.record(site, measurement, future.result())
+        elif isinstance(error, ValueError):
+            self.record(site, measurement, None, error=str(error))
+
+    def close(self):
+        """Close the journal file, leaving it for the next run."""
+        with self._lock:
+            self._file.close()
+
+    def remove(self):
+        """Delete the journal once the run has finished."""
+        self.close()
+        os.remove(self.path)
+
+
+def _file_stamp(path):
+    """(path, mtime, size) of a file, or (path, None) if it can't be reached."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return (path, None)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+
+def _as_tuples(value):
+    """json lists back into the tuples they were written from."""
+    if isinstance(value, list):
+        return tuple(_as_tuples(v) for v in value)
+    return value
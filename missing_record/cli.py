@@ -0,0 +1,330 @@
+"""Command line entry point, ``python -m missing_record <command>``.
+
+Each command only imports the parts of the package it uses, so the light
+ones (send, copy) start without loading pandas, hydrobot or sqlalchemy, and
+the .env file is only read by the commands that need it.
+"""
+
+import argparse
+import os
+from datetime import datetime, timedelta
+
+SCRIPT_CONFIG = "config_files/script_config.yaml"
+WEEKLY_CONFIG = "config_files/weekly_config.yaml"
+MONTHLY_CONFIG = "config_files/monthly_config.yaml"
+
+# Where the full runs copy their html reports to
+REPORTS_FOLDER = r"\\ares\Hydrology\Hydrology Regions\Missing Record Reporting"
+
+
+def fetch(args, metrics=None, windows=None):
+    """Work out the missing record and write the csv/parquet outputs."""
+    import missing_record.generate_missing_data_csvs as generate_missing_data_csvs
+
+    return generate_missing_data_csvs.generate(
+        args.config,
+        debug=args.debug,
+        metrics=metrics,
+        windows=windows,
+        shard=args.shard,
+        record_history=args.record_history,
+    )
+
+
+def merge(args, metrics=None):
+    """Combine the outputs of a sharded run."""
+    import missing_record.merge_shards as merge_shards
+
+    return merge_shards.merge(
+        args.config, args.shards, metrics=metrics, record_history=args.record_history
+    )
+
+
+def render(args, results=None, metrics=None, window=None):
+    """Make the html reports from the results."""
+    import missing_record.generate_html as generate_html
+
+    generate_html.generate(args.config, results, metrics, window)
+
+
+def send(args, metrics=None):
+    """Email the html reports to every recipient group."""
+    import missing_record.send_email as send_email
+
+    send_email.send(args.message, args.title, metrics, args.html_dir)
+
+
+def copy(args, metrics=None):
+    """Copy the html reports to a folder."""
+    import missing_record.send_email as send_email
+
+    send_email.copy_files(args.destination, metrics, args.html_dir)
+
+
+def record_sql(args):
+    """Record the network wide totals of the results in the dev database."""
+    import missing_record.generate_html as generate_html
+    from missing_record.results import window_file
+
+    end = args.end
+    if end is None:
+        import yaml
+
+        with open(args.config) as file:
+            end = yaml.safe_load(file)["end"]
+    generate_html.record_sql(
+        window_file(generate_html.RESULTS_FILE, getattr(args, "window", None)), end
+    )
+
+
+def set_window(config_file_path, start, end):
+    """Rewrite the start and end of a config, keeping its comments and layout."""
+    import ruamel.yaml
+
+    yaml = ruamel.yaml.YAML()
+    with open(config_file_path) as fp:
+        data = yaml.load(fp)
+    data["start"] = start
+    data["end"] = end
+    with open(config_file_path, "w") as fp:
+        yaml.dump(data, fp)
+
+
+def deliver(config_file_path, name, destination, folder, results, metrics, window=None):
+    """Render, copy and send one report.
+
+    Parameters
+    ----------
+    config_file_path : str
+        The yaml config of the run.
+    name : str
+        The report's name in the email, e.g. "weekly".
+    destination : str
+        Where the html reports are copied to.
+    folder : str
+        Where the email says the reports can be viewed.
+    results : pd.DataFrame
+        The report's results, as returned by fetch.
+    metrics : RunMetrics
+        Where to record how long each step took.
+    window : tuple, optional
+        (name, start, end) of the report's window, if the run had several.
+        Its html reports go to (and are sent from) output_html/<name>.
+    """
+    html_dir = "output_html" if window is None else os.path.join("output_html", name)
+    render(argparse.Namespace(config=config_file_path), results, metrics, window)
+
+    os.makedirs(destination, exist_ok=True)
+    copy(argparse.Namespace(destination=destination, html_dir=html_dir), metrics)
+    send(
+        argparse.Namespace(
+            message=(
+                f"<p>{name.capitalize()} missing record report</p>"
+                "<p>This can be viewed with colours at:</p>"
+                f"<p>{folder}</p>"
+            ),
+            title=f"{name} missing record report",
+            html_dir=html_dir,
+        ),
+        metrics,
+    )
+
+
+def full_run(config_file_path, name, destination, folder, record_history=None):
+    """Fetch, render, copy and send one report.
+
+    Parameters
+    ----------
+    config_file_path : str
+        The yaml config of the run, with its window already set.
+    name : str
+        The report's name in the email, e.g. "weekly".
+    destination : str
+        Where the html reports are copied to.
+    folder : str
+        Where the email says the reports can be viewed.
+    record_history : bool, optional
+        Whether to record the results in the history table, defaults to the
+        config's record_history.
+    """
+    from missing_record.run_metrics import RunMetrics
+
+    args = argparse.Namespace(
+        config=config_file_path,
+        debug=False,
+        shard=None,
+        record_history=record_history,
+    )
+    metrics = RunMetrics()
+    results = fetch(args, metrics)
+    deliver(config_file_path, name, destination, folder, results, metrics)
+    metrics.write()
+
+
+def weekly_window(finish_date):
+    """The last 7 days up to the end of the day before finish_date."""
+    return (
+        (finish_date - timedelta(days=7)).strftime("%Y-%m-%d") + " 00:00:00",
+        (finish_date - timedelta(days=1)).strftime("%Y-%m-%d") + " 23:59:59",
+    )
+
+
+def monthly_window(finish_date):
+    """The month up to the end of the day before finish_date."""
+    import dateutil.relativedelta
+
+    start = finish_date + dateutil.relativedelta.relativedelta(months=-1)
+    return (
+        start.strftime("%Y-%m-%d") + " 00:00",
+        (finish_date - timedelta(days=1)).strftime("%Y-%m-%d") + " 23:59:59",
+    )
+
+
+def weekly(args):
+    """The last 7 days up to the end of yesterday."""
+    finish_date = datetime.today()
+    set_window(WEEKLY_CONFIG, *weekly_window(finish_date))
+    folder = REPORTS_FOLDER + r"\weekly_reports"
+    full_run(
+        WEEKLY_CONFIG,
+        "weekly",
+        folder + f"\\{finish_date.strftime('%Y-%m-%d')}",
+        folder,
+        record_history=True,
+    )
+
+
+def monthly(args):
+    """The last month up to the end of yesterday, also recorded in SQL."""
+    finish_date = datetime.today()
+    start, end = monthly_window(finish_date)
+    set_window(MONTHLY_CONFIG, start, end)
+    folder = REPORTS_FOLDER + r"\monthly_reports"
+    full_run(
+        MONTHLY_CONFIG,
+        "monthly",
+        folder + f"\\{finish_date.strftime('%Y-%m-%d')}",
+        folder,
+        record_history=True,
+    )
+    record_sql(argparse.Namespace(config=MONTHLY_CONFIG, end=end))
+
+
+def weekly_monthly(args):
+    """The weekly and monthly reports from one fetch, for days both are due."""
+    from missing_record.run_metrics import RunMetrics
+
+    finish_date = datetime.today()
+    windows = {
+        "weekly": weekly_window(finish_date),
+        "monthly": monthly_window(finish_date),
+    }
+    # Kept up to date for the commands that read the window from the config
+    set_window(WEEKLY_CONFIG, *windows["weekly"])
+    set_window(MONTHLY_CONFIG, *windows["monthly"])
+
+    metrics = RunMetrics()
+    results = fetch(
+        argparse.Namespace(
+            config=MONTHLY_CONFIG, debug=False, shard=None, record_history=True
+        ),
+        metrics,
+        windows,
+    )
+    for name, (start, end) in windows.items():
+        folder = REPORTS_FOLDER + f"\\{name}_reports"
+        deliver(
+            MONTHLY_CONFIG,
+            name,
+            folder + f"\\{finish_date.strftime('%Y-%m-%d')}",
+            folder,
+            results[name],
+            metrics,
+            (name, start, end),
+        )
+    metrics.write()
+    record_sql(
+        argparse.Namespace(
+            config=MONTHLY_CONFIG, end=windows["monthly"][1], window="monthly"
+        )
+    )
+
+
+def manual(args):
+    """The window already in the script config."""
+    full_run(
+        args.config,
+        "manual",
+        REPORTS_FOLDER + f"\\ {datetime.today().strftime('%Y-%m-%d')}",
+        REPORTS_FOLDER,
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m missing_record", description="Missing record reports."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("fetch", help=fetch.__doc__)
+    command.add_argument("--config", default=SCRIPT_CONFIG)
+    command.add_argument("--shard", help="only do shard i of N of the sites, e.g. 2/4")
+    command.add_argument(
+        "--debug", action="store_true", help="only do the debug sites/measurements"
+    )
+    command.add_argument(
+        "--record-history",
+        action="store_true",
+        default=None,
+        help="record the results in the history table, whatever the config says",
+    )
+    command.set_defaults(func=fetch)
+
+    command = commands.add_parser("merge", help=merge.__doc__)
+    command.add_argument("shards", type=int, help="how many shards the run had")
+    command.add_argument("--config", default=SCRIPT_CONFIG)
+    command.add_argument(
+        "--record-history",
+        action="store_true",
+        default=None,
+        help="record the results in the history table, whatever the config says",
+    )
+    command.set_defaults(func=merge)
+
+    command = commands.add_parser("render", help=render.__doc__)
+    command.add_argument("--config", default=SCRIPT_CONFIG)
+    command.set_defaults(func=render)
+
+    command = commands.add_parser("send", help=send.__doc__)
+    command.add_argument("--message", default="", help="html put before the reports")
+    command.add_argument("--title", default="missing record report")
+    command.add_argument("--html-dir", default="output_html")
+    command.set_defaults(func=send)
+
+    command = commands.add_parser("copy", help=copy.__doc__)
+    command.add_argument("destination")
+    command.add_argument("--html-dir", default="output_html")
+    command.set_defaults(func=copy)
+
+    command = commands.add_parser("record-sql", help=record_sql.__doc__)
+    command.add_argument("--config", default=MONTHLY_CONFIG)
+    command.add_argument("--end", help="end date to record, defaults to the config's")
+    command.add_argument("--window", help="the window's name, for a run with several")
+    command.set_defaults(func=record_sql)
+
+    command = commands.add_parser("weekly", help=weekly.__doc__)
+    command.set_defaults(func=weekly)
+    command = commands.add_parser("monthly", help=monthly.__doc__)
+    command.set_defaults(func=monthly)
+    command = commands.add_parser("weekly-monthly", help=weekly_monthly.__doc__)
+    command.set_defaults(func=weekly_monthly)
+    command = commands.add_parser("manual", help=manual.__doc__)
+    command.add_argument("--config", default=SCRIPT_CONFIG)
+    command.set_defaults(func=manual)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.func(args)
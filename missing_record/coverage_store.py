@@ -0,0 +1,195 @@
+"""Persistent per-bucket presence bitmaps for incremental missing record runs."""
+
+import hashlib
+import os
+import struct
+import threading
+
+import numpy as np
+import pandas as pd
+
+from missing_record.utils import epoch_seconds
+
+# origin bucket number, number of known buckets
+_HEADER = struct.Struct("<qq")
+
+
+class CoverageStore:
+    """One packed presence bit per bucket (hour, or day for rainfall) per series.
+
+    Each series keeps a contiguous span of buckets that have already been
+    fetched. A bit is set if Hilltop returned at least one sample in that
+    bucket. A report window only fetches the part of the window outside the
+    known span and answers the rest from the bitmap. Buckets newer than
+    ``refetch_days`` ago are never stored as known, so they're refetched
+    every run to pick up late-arriving data.
+
+    Parameters
+    ----------
+    store_dir : str
+        Directory to keep the bitmaps in.
+    refetch_days : int
+        Number of recent days that are always refetched.
+    chunk_seconds : int, optional
+        Fetch at most this many seconds of samples at a time, 0 for no limit.
+    """
+
+    def __init__(self, store_dir, refetch_days, chunk_seconds=0):
+        self.store_dir = store_dir
+        self.refetch_days = refetch_days
+        self.chunk_seconds = chunk_seconds
+        self.buckets_stored = 0
+        self.buckets_fetched = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a store from the yaml config, or None if the store is off."""
+        if not config.get("coverage_store_dir"):
+            return None
+        return cls(
+            config["coverage_store_dir"],
+            int(config.get("cache_refetch_days", 3)),
+            int(config.get("fetch_chunk_days") or 0) * 86400,
+        )
+
+    @staticmethod
+    def can_answer(start, end, freq):
+        """Whether a window lines up with whole buckets.
+
+        The store only knows about whole buckets, so the window has to start
+        on a bucket boundary and end on the last second of one.
+        """
+        step = pd.to_timedelta(freq)
+        start = pd.Timestamp(start)
+        stop = pd.Timestamp(end) + pd.Timedelta(seconds=1)
+        return start == start.floor(step) and stop == stop.floor(step)
+
+    def _path(self, base_url, hts, site, measurement, freq):
+        key = "|".join([base_url.rstrip("/"), hts, site, measurement, freq])
+        return os.path.join(
+            self.store_dir, hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + ".bits"
+        )
+
+    def presence(self, fetch, base_url, hts, site, measurement, start, end, freq):
+        """Whether each bucket in a window has data.
+
+        Parameters
+        ----------
+        fetch : callable
+            fetch(base_url, hts, site, measurement, start, end) returning a
+            DatetimeIndex of sample times, or None for an empty response.
+        base_url, hts, site, measurement : str
+            Which series to count.
+        start, end : str or pd.Timestamp
+            The window, which must pass can_answer().
+        freq : str
+            The bucket size, e.g. "1h".
+
+        Returns
+        -------
+        np.ndarray
+            bool, one per bucket of the window.
+        """
+        step = int(pd.to_timedelta(freq).total_seconds())
+        first = epoch_seconds(pd.Timestamp(start)) // step
+        stop = (epoch_seconds(pd.Timestamp(end)) + 1) // step
+        horizon = (
+            epoch_seconds(
+                pd.Timestamp.now().normalize() - pd.Timedelta(days=self.refetch_days)
+            )
+            // step
+        )
+        path = self._path(base_url, hts, site, measurement, freq)
+        origin, bits = _read_bitmap(path)
+
+        # Start again if the window doesn't touch what we already know,
+        # rather than fetching everything in between
+        if origin is None or first > origin + len(bits) or stop < origin:
+            origin, bits = first, np.zeros(0, dtype=bool)
+
+        fetched = 0
+        if first < origin:
+            head = self._fetch_presence(
+                fetch, base_url, hts, site, measurement, first, origin, step
+            )
+            bits = np.concatenate([head, bits])
+            fetched += len(head)
+            origin = first
+        known_stop = origin + len(bits)
+        if stop > known_stop:
+            tail = self._fetch_presence(
+                fetch, base_url, hts, site, measurement, known_stop, stop, step
+            )
+            bits = np.concatenate([bits, tail])
+            fetched += len(tail)
+
+        window = bits[first - origin : stop - origin]
+
+        # Only buckets older than the refetch horizon count as known
+        keep = max(0, min(len(bits), horizon - origin))
+        if fetched > 0:
+            _write_bitmap(path, origin, bits[:keep])
+        with self._lock:
+            self.buckets_fetched += fetched
+            self.buckets_stored += len(window) - fetched
+        return window
+
+    def _fetch_presence(
+        self, fetch, base_url, hts, site, measurement, first, stop, step
+    ):
+        """Presence of data in buckets [first, stop) fetched from Hilltop.
+
+        Fetched in chunks of chunk_seconds (whole buckets), if that's set.
+        """
+        presence = np.zeros(stop - first, dtype=bool)
+        chunk = max(1, len(presence))
+        if self.chunk_seconds > 0:
+            chunk = max(1, self.chunk_seconds // step)
+        for chunk_first in range(first, stop, chunk):
+            chunk_stop = min(chunk_first + chunk, stop)
+            index = fetch(
+                base_url,
+                hts,
+                site,
+                measurement,
+                pd.Timestamp(chunk_first * step, unit="s"),
+                pd.Timestamp(chunk_stop * step, unit="s"),
+            )
+            if index is not None and len(index) > 0:
+                buckets = epoch_seconds(index) // step - first
+                buckets = buckets[
+                    (buckets >= chunk_first - first) & (buckets < chunk_stop - first)
+                ]
+                presence[buckets] = True
+        return presence
+
+    def report(self, metrics):
+        """Add how much of the run came out of the store to a run's RunMetrics."""
+        metrics.increment("store_buckets_stored", self.buckets_stored)
+        metrics.increment("store_buckets_fetched", self.buckets_fetched)
+
+
+def _read_bitmap(path):
+    """Read a bitmap file, returning (origin bucket, bool array)."""
+    if not os.path.exists(path):
+        return None, None
+    with open(path, "rb") as f:
+        raw = f.read()
+    origin, nbits = _HEADER.unpack_from(raw)
+    bits = np.unpackbits(
+        np.frombuffer(raw, dtype=np.uint8, offset=_HEADER.size),
+        count=nbits,
+        bitorder="little",
+    ).astype(bool)
+    return origin, bits
+
+
+def _write_bitmap(path, origin, bits):
+    """Write a bitmap file atomically."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(origin, len(bits)))
+        f.write(np.packbits(bits, bitorder="little").tobytes())
+    os.replace(tmp_path, path)
@@ -0,0 +1,125 @@
+"""Gap intervals of a run, kept in a sorted file that can be queried offline."""
+
+import numpy as np
+import pandas as pd
+
+# Gap intervals of a run, written by generate_missing_data_csvs
+GAPS_FILE = "output_csv/gaps.parquet"
+
+GAP_COLUMNS = ["site", "measurement", "bucket", "region", "start", "end"]
+
+
+def write_gaps(path, gaps):
+    """Write gap intervals sorted by start, as a compact parquet file.
+
+    Parameters
+    ----------
+    path : str
+        Where to write them.
+    gaps : pd.DataFrame
+        One row per gap with site, measurement, bucket, region and the gap's
+        start and (exclusive) end as int64 seconds since the epoch.
+    """
+    gaps = gaps.sort_values(["start", "site", "measurement"], kind="stable")
+    frame = pd.DataFrame(
+        {
+            column: pd.Categorical(gaps[column])
+            for column in ["site", "measurement", "bucket", "region"]
+        }
+    )
+    for column in ["start", "end"]:
+        frame[column] = gaps[column].to_numpy(dtype=np.int64).astype("datetime64[s]")
+    frame.to_parquet(path, index=False)
+
+
+class GapIndex:
+    """Gap intervals sorted by start, for finding outages without Hilltop.
+
+    No gap is longer than the longest one, so the gaps overlapping a time
+    range all start within that much of it, and are found with a binary
+    search on the starts instead of a scan of the whole file.
+
+    Parameters
+    ----------
+    gaps : pd.DataFrame
+        As written by write_gaps, sorted by start.
+    """
+
+    def __init__(self, gaps):
+        self.gaps = gaps.reset_index(drop=True)
+        self._starts = self.gaps["start"].to_numpy()
+        self._longest = (self.gaps["end"] - self.gaps["start"]).max()
+        if pd.isna(self._longest):
+            self._longest = pd.Timedelta(0)
+
+    @classmethod
+    def load(cls, path=GAPS_FILE):
+        """Read a gaps file."""
+        return cls(pd.read_parquet(path))
+
+    def query(
+        self,
+        start=None,
+        end=None,
+        min_duration=None,
+        site=None,
+        measurement=None,
+        bucket=None,
+        region=None,
+    ):
+        """Gaps overlapping [start, end) that match every filter given.
+
+        e.g. ``query("2025-06-01", "2025-07-01", "6h", region="Northern")``
+        for the gaps longer than 6 hours in Northern in June.
+
+        Parameters
+        ----------
+        start, end : str or pd.Timestamp, optional
+            Only gaps overlapping this range.
+        min_duration : str or pd.Timedelta, optional
+            Only gaps at least this long.
+        site, measurement, bucket, region : str or list of str, optional
+            Only gaps of these.
+
+        Returns
+        -------
+        pd.DataFrame
+            The matching gaps in order of start, with their duration.
+        """
+        lo, hi = 0, len(self.gaps)
+        if end is not None:
+            hi = np.searchsorted(
+                self._starts, pd.Timestamp(end).to_datetime64(), side="left"
+            )
+        if start is not None:
+            earliest = pd.Timestamp(start) - self._longest
+            lo = np.searchsorted(self._starts, earliest.to_datetime64(), side="right")
+        gaps = self.gaps.iloc[lo : max(lo, hi)]
+
+        keep = np.ones(len(gaps), dtype=bool)
+        if start is not None:
+            keep &= (gaps["end"] > pd.Timestamp(start)).to_numpy()
+        if min_duration is not None:
+            duration = gaps["end"] - gaps["start"]
+            keep &= (duration >= pd.Timedelta(min_duration)).to_numpy()
+        for column, values in [
+            ("site", site),
+            ("measurement", measurement),
+            ("bucket", bucket),
+            ("region", region),
+        ]:
+            if values is not None:
+                values = [values] if isinstance(values, str) else values
+                keep &= gaps[column].isin(values).to_numpy()
+
+        gaps = gaps[keep].copy()
+        gaps["duration"] = gaps["end"] - gaps["start"]
+        return gaps.reset_index(drop=True)
+
+    def down_at(self, time, **filters):
+        """Gaps covering a moment in time, i.e. what was down then.
+
+        Takes the same filters as query().
+        """
+        time = pd.Timestamp(time)
+        return self.query(time, time + pd.Timedelta(nanoseconds=1), **filters)
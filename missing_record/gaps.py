@@ -0,0 +1,275 @@
+"""Vectorised gap counting on int64 epoch-second timestamps."""
+
+import numpy as np
+
+
+def missing_seconds(timestamps, start, end, step):
+    """Seconds of missing record for one series.
+
+    The window is split into buckets ``start + i * step`` up to and including
+    ``end``. A bucket has data if a sample floors (from the epoch) onto it.
+    This matches flooring the series index, dropping duplicates and
+    reindexing onto ``pd.date_range(start, end, freq)``.
+
+    Parameters
+    ----------
+    timestamps : np.ndarray
+        Sample times as int64 seconds since the epoch, in any order.
+    start : int
+        Start of the window, seconds since the epoch.
+    end : int
+        End of the window (inclusive), seconds since the epoch.
+    step : int
+        Bucket size in seconds.
+
+    Returns
+    -------
+    int
+        Number of seconds in buckets with no samples.
+    """
+    return int(missing_seconds_batch([timestamps], [start], [end], [step])[0])
+
+
+def missing_seconds_batch(timestamps_list, starts, ends, steps):
+    """Seconds of missing record for several series in one pass.
+
+    Parameters
+    ----------
+    timestamps_list : list of np.ndarray
+        Sample times of each series as int64 seconds since the epoch.
+    starts, ends, steps : array-like of int
+        Window start, inclusive window end and bucket size (all in seconds)
+        for each series.
+
+    Returns
+    -------
+    np.ndarray
+        int64 seconds of missing record for each series.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    steps = np.asarray(steps, dtype=np.int64)
+    n_buckets = np.maximum((ends - starts) // steps + 1, 0)
+    offsets = np.concatenate([[0], np.cumsum(n_buckets)])
+
+    lengths = np.array([len(t) for t in timestamps_list], dtype=np.int64)
+    if lengths.sum() == 0:
+        return n_buckets * steps
+    series = np.repeat(np.arange(len(timestamps_list)), lengths)
+    timestamps = np.concatenate(timestamps_list).astype(np.int64)
+
+    series_start = starts[series]
+    series_step = steps[series]
+    floored = timestamps - timestamps % series_step
+    relative = floored - series_start
+    # Buckets floor onto the epoch, so a window that doesn't start on a
+    # bucket boundary never lines up with the samples
+    in_window = (
+        (relative >= 0) & (floored <= ends[series]) & (relative % series_step == 0)
+    )
+    bucket = offsets[series[in_window]] + relative[in_window] // series_step[in_window]
+
+    present = np.bincount(bucket, minlength=offsets[-1]) > 0
+    present_per_series = np.add.reduceat(
+        np.append(present, False).astype(np.int64), offsets[:-1]
+    )
+    # reduceat gives the single element at an empty segment instead of 0
+    present_per_series[n_buckets == 0] = 0
+    return (n_buckets - present_per_series) * steps
+
+
+def missing_seconds_levels(timestamps, start, end, steps):
+    """Seconds of missing record for one series at several bucket sizes.
+
+    Presence is worked out once at the finest level that every step is a
+    whole number of (the gcd of the steps) and each step is rolled up from
+    that, so e.g. 15 minute, hourly and daily figures cost one pass over the
+    samples. Each step gives the same answer as ``missing_seconds``.
+
+    Parameters
+    ----------
+    timestamps : np.ndarray
+        Sample times as int64 seconds since the epoch, in any order.
+    start : int
+        Start of the window, seconds since the epoch.
+    end : int
+        End of the window (inclusive), seconds since the epoch.
+    steps : list of int
+        Bucket sizes in seconds.
+
+    Returns
+    -------
+    np.ndarray
+        int64 seconds of missing record at each step.
+    """
+    steps = np.asarray(steps, dtype=np.int64)
+    n_buckets = np.maximum((end - start) // steps + 1, 0)
+    base = np.gcd.reduce(steps)
+    factors = steps // base
+    missing = n_buckets * steps
+    if start % base != 0:
+        # No step lines up with the samples (see missing_seconds_batch)
+        return missing
+
+    # Base buckets covering the last bucket of every step
+    n_base = int((n_buckets * factors).max())
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    relative = (timestamps - timestamps % base - start) // base
+    relative = relative[(relative >= 0) & (relative < n_base)]
+    present = np.zeros(n_base, dtype=bool)
+    present[relative] = True
+
+    for i, (n, factor) in enumerate(zip(n_buckets, factors)):
+        if n == 0 or start % steps[i] != 0:
+            continue
+        rolled = present[: n * factor].reshape(n, factor).any(axis=1)
+        missing[i] = (n - np.count_nonzero(rolled)) * steps[i]
+    return missing
+
+
+def presence(timestamps, start, end, step):
+    """Whether each bucket of a window has data.
+
+    Buckets are as in ``missing_seconds``, which is the number of False
+    buckets times step.
+
+    Parameters
+    ----------
+    timestamps : np.ndarray
+        Sample times as int64 seconds since the epoch, in any order.
+    start : int
+        Start of the window, seconds since the epoch.
+    end : int
+        End of the window (inclusive), seconds since the epoch.
+    step : int
+        Bucket size in seconds.
+
+    Returns
+    -------
+    np.ndarray
+        bool, one per bucket.
+    """
+    n_buckets = max((end - start) // step + 1, 0)
+    present = np.zeros(n_buckets, dtype=bool)
+    if start % step != 0:
+        return present
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    relative = (timestamps - timestamps % step - start) // step
+    present[relative[(relative >= 0) & (relative < n_buckets)]] = True
+    return present
+
+
+def gap_intervals(present, start, step):
+    """Run-length encode the missing buckets of a window into gap intervals.
+
+    Parameters
+    ----------
+    present : np.ndarray
+        bool per bucket, as from ``presence``.
+    start : int
+        Start of the first bucket, seconds since the epoch.
+    step : int
+        Bucket size in seconds.
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        int64 start and (exclusive) end of each gap in seconds since the
+        epoch, in order.
+    """
+    missing = np.concatenate([[False], ~np.asarray(present, dtype=bool), [False]])
+    edges = np.flatnonzero(missing[1:] != missing[:-1]).astype(np.int64)
+    return start + edges[0::2] * step, start + edges[1::2] * step
+
+
+def union_missing(sources):
+    """Missing record of several series counted as one, e.g. the sensors of a bucket.
+
+    A bucket is only missing if every series that covers it is missing
+    there. The total is the time covered by any of the series' windows.
+
+    Parameters
+    ----------
+    sources : list of tuple
+        (start, end, step, gaps) of each series: its window as in
+        ``presence``, its bucket size and its gap intervals as from
+        ``gap_intervals``. All with the same step.
+
+    Returns
+    -------
+    (int, int)
+        Seconds of missing record and total seconds.
+    """
+    missing, total = union_missing_groups(sources, np.zeros(len(sources), np.int64), 1)
+    return int(missing[0]), int(total[0])
+
+
+def union_missing_groups(sources, groups, n_groups):
+    """union_missing of many groups of series in one pass, e.g. every site's sensors.
+
+    Every series is put on one grid of buckets, and each group's count of
+    series covering a bucket and of series in a gap there are built from
+    +1/-1 edges with a single cumsum. A bucket is missing for a group if
+    it's covered and every series covering it is in a gap.
+
+    Parameters
+    ----------
+    sources : list of tuple
+        (start, end, step, gaps) of each series, as in ``union_missing``.
+        All with the same step.
+    groups : array-like of int
+        The group of each series, from 0 to n_groups - 1.
+    n_groups : int
+        Number of groups.
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        int64 seconds of missing record and total seconds of each group,
+        both 0 for a group with no series.
+    """
+    missing = np.zeros(n_groups, dtype=np.int64)
+    total = np.zeros(n_groups, dtype=np.int64)
+    if len(sources) == 0:
+        return missing, total
+    groups = np.asarray(groups, dtype=np.int64)
+    starts = np.array([source[0] for source in sources], dtype=np.int64)
+    ends = np.array([source[1] for source in sources], dtype=np.int64)
+    step = sources[0][2]
+
+    # Buckets of each series on a grid starting at the earliest one
+    origin = (starts // step).min() * step
+    first = (starts - origin) // step
+    last = first + np.maximum((ends - starts) // step + 1, 0)
+    width = int(last.max()) + 1
+
+    # Edges of every window and gap, at the start and end of their buckets
+    n_gaps = np.array([len(source[3]) for source in sources], dtype=np.int64)
+    gap_edges = np.array(
+        [edge for source in sources for gap in source[3] for edge in gap],
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    gap_edges = (gap_edges - origin) // step
+    gap_groups = np.repeat(groups, n_gaps)
+    covering = np.zeros(n_groups * width, dtype=np.int64)
+    np.add.at(covering, groups * width + first, 1)
+    np.add.at(covering, groups * width + last, -1)
+    in_gap = np.zeros(n_groups * width, dtype=np.int64)
+    np.add.at(in_gap, gap_groups * width + gap_edges[:, 0], 1)
+    np.add.at(in_gap, gap_groups * width + gap_edges[:, 1], -1)
+    covering = np.cumsum(covering.reshape(n_groups, width), axis=1)
+    in_gap = np.cumsum(in_gap.reshape(n_groups, width), axis=1)
+    missing = np.count_nonzero((covering > 0) & (covering == in_gap), axis=1) * step
+
+    # Length of the union of each group's windows, with the groups laid out
+    # one after another so a running max doesn't carry over between them
+    spacing = ends.max() - starts.min() + 1
+    order = np.lexsort((starts, groups))
+    shifted_starts = starts[order] - starts.min() + groups[order] * spacing
+    shifted_ends = ends[order] - starts.min() + groups[order] * spacing
+    reach = np.maximum.accumulate(shifted_ends)
+    new_run = np.concatenate([[True], shifted_starts[1:] > reach[:-1]])
+    runs = np.flatnonzero(new_run)
+    run_lengths = np.maximum.reduceat(shifted_ends, runs) - shifted_starts[runs]
+    np.add.at(total, groups[order][runs], run_lengths)
+    return missing.astype(np.int64), total
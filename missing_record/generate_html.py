@@ -1,23 +1,48 @@
 """Tools for displaying the missing record report in HTML format."""
 
+import os
+from concurrent.futures import ProcessPoolExecutor
+from uuid import uuid4
+
 import pandas as pd
 import numpy as np
 import yaml
-from matplotlib import colors
 
-from missing_record.utils import get_hex_colour, invert_colour
+from missing_record.utils import hex_colour_lut
 import missing_record.site_list_merge as slm
+from missing_record.results import RESULTS_FILE, window_file
+from missing_record.run_metrics import RunMetrics
+
+# (view, location in the title, output file suffix) of every report
+REPORTS = [("all", "all regions", "")] + [
+    (view, view, f"_{view}")
+    for view in [
+        "Central",
+        "Eastern",
+        "Northern",
+        "Special",
+        "annex1",
+        "annex2",
+        "annex3",
+    ]
+]
 
 
 def generate_html(
-    csv_file, output_filepath, title_info="", bad_hours=744, cmap="autumn_r"
+    missing_records,
+    output_filepath,
+    title_info="",
+    bad_hours=744,
+    cmap="autumn_r",
+    compact=False,
 ):
-    """Generate an HTML report of the missing records in the CSV file.
+    """Generate an HTML report of the missing records.
 
     Parameters
     ----------
-    csv_file : str
-        The path to the CSV file containing the missing records.
+    missing_records : str or pd.DataFrame
+        The path to a CSV file containing the missing records, or missing
+        hours as returned by parse_csv/missing_hours.
     output_filepath : str
         The path to save the generated HTML report.
     title_info : str, optional
@@ -31,6 +56,8 @@ def generate_html(
     cmap : str, optional
         The name of the matplotlib colourmap to use for the background colour
         of the cells. Default is 'autumn_r'.
+    compact : bool, optional
+        Write the much smaller table of render_compact_table instead.
 
     Returns
     ------
@@ -38,70 +65,207 @@ def generate_html(
         The HTML report will be saved to the output_filepath.
     """
     # Read the CSV file and generate the HTML report
-    # Return the HTML report as a pandas dataframe
-    missing_records = parse_csv(csv_file)
+    if isinstance(missing_records, str):
+        missing_records = parse_csv(missing_records)
     if not missing_records.empty:
-        normfunc = colors.Normalize(vmin=0, vmax=bad_hours)
+        render = render_compact_table if compact else render_table
+        html_report = render(missing_records, bad_hours=bad_hours, cmap=cmap)
 
-        def style_cell_colour(val):
-            """Return a pandas cell_color spec."""
-            hex_colour = get_hex_colour(normfunc(val), cmap=cmap)
-            return f"background-color: {hex_colour};"
+        # Output the html report to a file
+        with open(output_filepath, "w") as output_file:
+            output_file.write(title_info)
+            output_file.write(html_report)
 
-        def style_font_colour(val):
-            """Return a pandas font_color spec."""
-            inv_hex_colour = invert_colour(
-                get_hex_colour(normfunc(val), cmap=cmap), hsv=True
-            )
-            return f"color: {inv_hex_colour};"
 
-        # Style the cell background colour of the dataframe by passing the style function
-        missing_records.index.name = None
-        styled_df = missing_records.style.map(
-            style_cell_colour, subset=missing_records.columns
-        )
+# Table-wide styles: left aligned headers, a gorgeous monospace font, thin
+# lightgrey borders around the cells, and collapsed cell borders
+TABLE_STYLE = (
+    "#T_{uuid} th {{\n  text-align: left;\n}}\n"
+    "#T_{uuid}  thead {{\n  text-align: left;\n}}\n"
+    "#T_{uuid} td {{\n  font-family: monospace;\n}}\n"
+    "#T_{uuid}  th {{\n  font-family: monospace;\n}}\n"
+    "#T_{uuid}  {{\n  border: 1px solid #d3d3d3;\n}}\n"
+    "#T_{uuid}  td {{\n  border: 1px solid #d3d3d3;\n}}\n"
+    "#T_{uuid}  th {{\n  border: 1px solid #d3d3d3;\n}}\n"
+    "#T_{uuid}  {{\n  border-collapse: collapse;\n}}\n"
+)
 
-        # Format the missing hour values to 2 decimal places unless they are NaN
-        styled_df = styled_df.format(
-            {
-                col: lambda x: f"{x:.2f}h" if not pd.isna(x) else "-"
-                for col in missing_records.columns
-            }
-        )
 
-        # Remove the index column and left align the first column
-        styled_df = styled_df.set_properties(**{"text-align": "left"})
-
-        # Some more detailed styling
-        styled_df.set_table_styles(
-            [
-                # Left align all the table headers
-                {"selector": "th, thead", "props": [("text-align", "left")]},
-                # Set all fonts to a gorgeous monospace font
-                {"selector": "td, th", "props": [("font-family", "monospace")]},
-                # Add a thin lightgrey border around the cells
-                {"selector": ", td, th", "props": [("border", "1px solid #d3d3d3")]},
-                # Collapse the cell borders into single lines
-                {"selector": "", "props": [("border-collapse", "collapse")]},
-            ]
-        )
+def cell_colours(missing_hours, bad_hours=744, cmap="autumn_r"):
+    """Background colour of each cell, from a lookup table of the colourmap.
 
-        # Trying again to collapse the borders (still only successful sometimes)
-        styled_df.set_properties(**{"border-collapse": "collapse"})
+    Parameters
+    ----------
+    missing_hours : np.ndarray
+        Missing hours, NaN where there's no result.
+    bad_hours : int, optional
+        The number of hours that gets the most extreme colour.
+    cmap : str, optional
+        The name of the matplotlib colourmap.
 
-        html_report = styled_df.to_html(
-            escape=False,
-            classes=(
-                "table table-striped table-bordered table-hover table-sm border-collapse"
-            ),
-            table_id="missing-records-table",
-            justify="left",
+    Returns
+    -------
+    np.ndarray
+        Hex colour strings, white for NaN or no missing hours.
+    """
+    lut = hex_colour_lut(cmap)
+    normed = missing_hours / bad_hours
+    has_missing = normed > 0
+    # Same binning as evaluating the colourmap, anything past 1 gets the top colour
+    index = np.minimum(
+        (np.where(has_missing, normed, 0) * len(lut)).astype(int), len(lut) - 1
+    )
+    return np.where(has_missing, lut[index], "#ffffff")
+
+
+def render_table(missing_records, bad_hours=744, cmap="autumn_r"):
+    """Render missing hours as a colour coded HTML table.
+
+    Parameters
+    ----------
+    missing_records : pd.DataFrame
+        Missing hours, indexed by site, with a column per bucket.
+    bad_hours : int, optional
+        The number of hours that gets the most extreme colour.
+    cmap : str, optional
+        The name of the matplotlib colourmap.
+
+    Returns
+    -------
+    str
+        The table, with its stylesheet.
+    """
+    uuid = uuid4().hex[:5]
+    values = missing_records.to_numpy(dtype=float)
+    colours = cell_colours(values, bad_hours=bad_hours, cmap=cmap)
+    # Format the missing hour values to 2 decimal places unless they are NaN
+    text = np.where(np.isnan(values), "-", np.char.mod("%.2fh", values))
+    n_rows, n_cols = values.shape
+
+    # One rule per colour listing every cell with that colour, in the order
+    # the colours first show up
+    flat_colours = colours.ravel()
+    unique_colours, first_seen, group = np.unique(
+        flat_colours, return_index=True, return_inverse=True
+    )
+    html = ['<style type="text/css">\n', TABLE_STYLE.format(uuid=uuid)]
+    for g in np.argsort(first_seen):
+        cells = np.flatnonzero(group == g)
+        selectors = ", ".join(
+            f"#T_{uuid}_row{cell // n_cols}_col{cell % n_cols}" for cell in cells
         )
+        html.append(
+            f"{selectors} {{\n  background-color: {unique_colours[g]};\n"
+            "  text-align: left;\n  border-collapse: collapse;\n}\n"
+        )
+    html.append(f'</style>\n<table id="T_{uuid}">\n  <thead>\n    <tr>\n')
+    html.append('      <th class="blank level0" >&nbsp;</th>\n')
+    for j, column in enumerate(missing_records.columns):
+        html.append(
+            f'      <th id="T_{uuid}_level0_col{j}" class="col_heading level0'
+            f' col{j}" >{column}</th>\n'
+        )
+    html.append("    </tr>\n  </thead>\n  <tbody>\n")
+    for i, site in enumerate(missing_records.index):
+        html.append(
+            f'    <tr>\n      <th id="T_{uuid}_level0_row{i}" class="row_heading'
+            f' level0 row{i}" >{site}</th>\n'
+        )
+        for j in range(n_cols):
+            html.append(
+                f'      <td id="T_{uuid}_row{i}_col{j}" class="data row{i} col{j}"'
+                f" >{text[i, j]}</td>\n"
+            )
+        html.append("    </tr>\n")
+    html.append("  </tbody>\n</table>\n")
+    return "".join(html)
 
-        # Output the html report to a file
-        with open(output_filepath, "w") as output_file:
-            output_file.write(title_info)
-            output_file.write(html_report)
+
+# Colours of the compact tables, and their table-wide styles (the same as
+# TABLE_STYLE) which only go in once however many cells there are
+COMPACT_LEVELS = 16
+COMPACT_STYLE = (
+    "table.mr{border:1px solid #d3d3d3;border-collapse:collapse}"
+    ".mr th,.mr td{border:1px solid #d3d3d3;font-family:monospace;text-align:left}"
+)
+
+
+def quantised_colours(missing_hours, bad_hours=744, cmap="autumn_r"):
+    """Colour level of each cell, out of COMPACT_LEVELS steps of the colourmap.
+
+    Parameters
+    ----------
+    missing_hours : np.ndarray
+        Missing hours, NaN where there's no result.
+    bad_hours : int, optional
+        The number of hours that gets the most extreme colour.
+    cmap : str, optional
+        The name of the matplotlib colourmap.
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        The level of each cell, -1 (white) for NaN or no missing hours, and
+        the hex colour of each level, from the middle of its part of the
+        colourmap.
+    """
+    lut = hex_colour_lut(cmap)
+    normed = missing_hours / bad_hours
+    has_missing = normed > 0
+    level = np.minimum(
+        (np.where(has_missing, normed, 0) * COMPACT_LEVELS).astype(int),
+        COMPACT_LEVELS - 1,
+    )
+    middles = ((np.arange(COMPACT_LEVELS) + 0.5) / COMPACT_LEVELS * len(lut)).astype(
+        int
+    )
+    return np.where(has_missing, level, -1), lut[middles]
+
+
+def render_compact_table(missing_records, bad_hours=744, cmap="autumn_r"):
+    """Render missing hours as a small colour coded HTML table.
+
+    The same table as render_table, but each cell gets one of a few colour
+    classes defined once in the stylesheet instead of an id and a rule of its
+    own, and there's no whitespace between tags. Emails made of several
+    reports stay small, and the same classes can be shared between them.
+
+    Parameters
+    ----------
+    missing_records : pd.DataFrame
+        Missing hours, indexed by site, with a column per bucket.
+    bad_hours : int, optional
+        The number of hours that gets the most extreme colour.
+    cmap : str, optional
+        The name of the matplotlib colourmap.
+
+    Returns
+    -------
+    str
+        The table, with its stylesheet.
+    """
+    values = missing_records.to_numpy(dtype=float)
+    levels, palette = quantised_colours(values, bad_hours=bad_hours, cmap=cmap)
+    text = np.where(np.isnan(values), "-", np.char.mod("%.2fh", values))
+    # White cells have no class, and only the levels in use are defined
+    opening = np.where(
+        levels < 0,
+        "<td>",
+        np.char.add(np.char.add('<td class="c', levels.astype(str)), '">'),
+    )
+
+    html = ['<style type="text/css">', COMPACT_STYLE]
+    for level in np.unique(levels[levels >= 0]):
+        html.append(f".mr .c{level}{{background-color:{palette[level]}}}")
+    html.append('</style><table class="mr"><thead><tr><th></th>')
+    html.extend(f"<th>{column}</th>" for column in missing_records.columns)
+    html.append("</tr></thead><tbody>")
+    for i, site in enumerate(missing_records.index):
+        html.append(f"<tr><th>{site}</th>")
+        html.extend(f"{cell}{value}</td>" for (cell, value) in zip(opening[i], text[i]))
+        html.append("</tr>")
+    html.append("</tbody></table>")
+    return "".join(html)
 
 
 def parse_csv(csv_file):
@@ -126,8 +290,89 @@ def parse_csv(csv_file):
     return missing_records
 
 
-def record_sql(missing_file, totals_file, end_date):
-    missing_records = parse_csv(missing_file)
+def missing_hours(missing_seconds):
+    """Convert a site x bucket frame of missing seconds into hours.
+
+    Sites with no results at all are dropped and a TOTAL row is added, the
+    same as parse_csv.
+    """
+    missing_records = missing_seconds.dropna(how="all")
+
+    if not missing_records.empty:
+        missing_records = missing_records / 3600
+        missing_records.loc["TOTAL"] = missing_records.fillna(0).sum(axis=0)
+
+    return missing_records
+
+
+def load_results(results_file):
+    """Read the results written by generate_missing_data_csvs."""
+    return pd.read_parquet(results_file)
+
+
+def build_views(results, annex_3_sites=(), views=None):
+    """Get the missing and total seconds for each report.
+
+    The results are pivoted once, and every view is a slice of that.
+
+    Parameters
+    ----------
+    results : pd.DataFrame
+        Long format results, as from load_results.
+    annex_3_sites : list of str, optional
+        The Annex 3 sites, which the annex3 report is ordered by.
+    views : list of str, optional
+        "all", regions (e.g. "Central") and/or annexes (e.g. "annex1").
+        Defaults to every report in REPORTS.
+
+    Returns
+    -------
+    dict
+        Maps each view to a (missing, total) pair of site x bucket frames of
+        seconds, with NaN missing seconds where there's no result.
+    """
+    if views is None:
+        views = [view for (view, _, _) in REPORTS]
+    sites = pd.unique(results["site"])
+    buckets = pd.unique(results["bucket"])
+    wide = []
+    for values in ["missing_seconds", "total_seconds"]:
+        frame = (
+            results.pivot(index="site", columns="bucket", values=values)
+            .reindex(index=sites, columns=buckets)
+            .astype(float)
+        )
+        frame.index.name = "Sites"
+        frame.columns.name = None
+        wide.append(frame)
+
+    frames = {}
+    for view in views:
+        if view == "all":
+            rows = results
+        elif view.startswith("annex"):
+            rows = results[results["annex"] == view]
+        else:
+            rows = results[results["region"] == view]
+        view_sites = pd.unique(rows["site"])
+        if view == "annex3":
+            view_sites = [s for s in annex_3_sites if s in set(view_sites)]
+        view_buckets = pd.unique(rows["bucket"])
+        frames[view] = tuple(
+            frame.loc[list(view_sites), list(view_buckets)] for frame in wide
+        )
+    return frames
+
+
+def results_view(results, view, annex_3_sites=()):
+    """Get the missing and total seconds for one report, see build_views."""
+    return build_views(results, annex_3_sites, [view])[view]
+
+
+def record_sql(results_file, end_date):
+    missing_seconds, total_seconds = results_view(load_results(results_file), "all")
+
+    missing_records = missing_hours(missing_seconds)
     missing_dict = missing_records.loc["TOTAL"].to_dict()
     missing_dict = {
         k.replace(" ", "_"): v
@@ -136,7 +381,7 @@ def record_sql(missing_file, totals_file, end_date):
     missing_dict["end_date"] = end_date
     slm.insert_missing_totals(missing_dict, slm.connect_to_dev_db())
 
-    missing_records = parse_csv(totals_file)
+    missing_records = missing_hours(total_seconds)
     totals_dict = missing_records.loc["TOTAL"].to_dict()
     totals_dict = {
         k.replace(" ", "_"): v
@@ -153,16 +398,16 @@ def generate_title(location, start_date, end_date):
     return title
 
 
-def generate_highlights(csv_input: str, csv_totals: str):
+def generate_highlights(csv_input, csv_totals):
     """
     Select important parts from the report.
 
     Parameters
     ----------
-    csv_input : str
-        path to input csv file
-    csv_totals : str
-        path to totals csv file
+    csv_input : str or pd.DataFrame
+        path to input csv file, or site x bucket frame of missing seconds
+    csv_totals : str or pd.DataFrame
+        path to totals csv file, or site x bucket frame of total seconds
     Returns
     -------
     str
@@ -170,8 +415,12 @@ def generate_highlights(csv_input: str, csv_totals: str):
     """
     output = ""
 
-    data = pd.read_csv(csv_input).set_index("Sites")
-    totals = pd.read_csv(csv_totals).set_index("Sites")
+    if isinstance(csv_input, str):
+        data = pd.read_csv(csv_input).set_index("Sites")
+        totals = pd.read_csv(csv_totals).set_index("Sites")
+    else:
+        data = csv_input.apply(pd.to_timedelta, unit="s")
+        totals = csv_totals.apply(pd.to_timedelta, unit="s")
     if not data.empty:
 
         percentages_total = pd.DataFrame()
@@ -221,36 +470,69 @@ def generate_highlights(csv_input: str, csv_totals: str):
     return output
 
 
-def generate(file_path):
-    with open(file_path) as file:
-        config = yaml.safe_load(file)
+def write_report(
+    output_filepath, title_info, missing_seconds, total_seconds, compact=False
+):
+    """Write one HTML report, with its highlights under the title."""
     generate_html(
-        "./output_csv/output.csv",
-        "./output_html/output.html",
-        title_info=generate_title("all regions", config["start"], config["end"])
-        + generate_highlights(
-            f"./output_csv/output.csv",
-            f"./output_csv/output_totals.csv",
-        ),
+        missing_hours(missing_seconds),
+        output_filepath,
+        title_info=title_info + generate_highlights(missing_seconds, total_seconds),
+        compact=compact,
     )
-    for region in [
-        "Central",
-        "Eastern",
-        "Northern",
-        "Special",
-        "annex1",
-        "annex2",
-        "annex3",
-    ]:
-        generate_html(
-            f"./output_csv/output_{region}.csv",
-            f"./output_html/output_{region}.html",
-            title_info=generate_title(region, config["start"], config["end"])
-            + generate_highlights(
-                f"./output_csv/output_" f"{region}.csv",
-                f"./output_csv/output_" f"{region}_totals.csv",
-            ),
-        )
+
+
+def generate(file_path, results=None, metrics=None, window=None):
+    """Write every HTML report from the results of a run.
+
+    Parameters
+    ----------
+    file_path : str
+        The yaml config of the run. If html_processes is more than 1 the
+        reports are written in that many processes, so the script this is
+        run from needs an ``if __name__ == "__main__":`` guard (the workers
+        import it again on Windows). If compact_html is true they're written
+        as compact tables.
+    results : pd.DataFrame, optional
+        Long format results, as returned by generate_missing_data_csvs.
+        Read from RESULTS_FILE if not given.
+    metrics : RunMetrics, optional
+        Where to record how long the reports took.
+    window : tuple, optional
+        (name, start, end) of one of the windows of a run with several. Its
+        results are read from (and its reports written to) the window's own
+        directory, and its dates are used in the titles.
+    """
+    if metrics is None:
+        metrics = RunMetrics()
+    with metrics.stage("html"):
+        with open(file_path) as file:
+            config = yaml.safe_load(file)
+        name, start, end = (None, config["start"], config["end"])
+        if window is not None:
+            name, start, end = window
+            os.makedirs(os.path.join("./output_html", name), exist_ok=True)
+        if results is None:
+            results = load_results(window_file(RESULTS_FILE, name))
+        views = build_views(results, config["Annex_3_sites"])
+        reports = [
+            (
+                window_file(f"./output_html/output{suffix}.html", name),
+                generate_title(location, start, end),
+                *views[view],
+                config.get("compact_html", False),
+            )
+            for (view, location, suffix) in REPORTS
+        ]
+
+        processes = config.get("html_processes", 1)
+        if processes > 1:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                for future in [executor.submit(write_report, *r) for r in reports]:
+                    future.result()
+        else:
+            for report in reports:
+                write_report(*report)
     print("HTML reports generated successfully!")
 
 
@@ -1,14 +1,38 @@
 """Missing record script."""
 
+import argparse
 import csv
+import functools
+import os
 import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 import yaml
-from hydrobot.data_acquisition import get_data
+from hilltoppy.utils import build_url, get_hilltop_xml
+from hydrobot.data_structure import parse_xml
 from pandas.tseries.frequencies import to_offset
+import missing_record.gaps as gaps
+import missing_record.measurement_catalog as measurement_catalog
 import missing_record.site_list_merge as site_list_merge
+from missing_record.checkpoint import CheckpointJournal
+from missing_record.coverage_store import CoverageStore
+from missing_record.gap_index import GAP_COLUMNS, GAPS_FILE, write_gaps
+from missing_record.hilltop_aggregate import AggregateFetcher
+from missing_record.hilltop_cache import HilltopCache
+from missing_record.results import (
+    RESULTS_FILE,
+    ResultMatrix,
+    parse_shard,
+    shard_file,
+    view_results_file,
+    window_file,
+    write_annex_totals,
+)
+from missing_record.run_metrics import RunMetrics
+from missing_record.site_overrides import OverrideIndex
+from missing_record.utils import epoch_seconds
 
 debug_site_list = [
     "Lake Wiritoa",
@@ -17,13 +41,317 @@ debug_meas_list = [
     "Water Temperature",
 ]
 
+# Report regions, and the site list regions that are in each of them
+REGIONS = {
+    "Northern": ["NORTHERN"],
+    "Eastern": ["EASTERN"],
+    "Central": ["CENTRAL"],
+    "Special": ["LAKES AND WQ", "Arawhata Piezometers"],
+}
+
+
+def fetch_timestamps(base_url, hts, site, measurement, start, end, metrics=None):
+    """Fetch the sample times of a series from Hilltop.
+
+    The same request as hydrobot's get_data, with the request and the parsing
+    timed separately if metrics (a RunMetrics) is given.
+
+    Returns
+    -------
+    pd.DatetimeIndex or None
+        Times of the non-null samples, or None if Hilltop had no data.
+    """
+    if metrics is None:
+        metrics = RunMetrics()
+    url = build_url(
+        base_url,
+        hts,
+        "GetData",
+        site=site,
+        measurement=measurement,
+        from_date=start,
+        to_date=end,
+        tstype="Standard",
+    )
+    with metrics.timer("fetch_seconds"):
+        hilltop_xml = get_hilltop_xml(url, hooks=metrics.request_hooks())
+    with metrics.timer("parse_seconds"):
+        blob = parse_xml(hilltop_xml)
+
+    if blob is None or len(blob) == 0:
+        return None
+
+    series = blob[0].data.timeseries[blob[0].data.timeseries.columns[0]]
+    return pd.DatetimeIndex(series.index[series.notna()])
+
+
+def fetch_missing_seconds(
+    fetch, base_url, hts, site, measurement, start, end, steps, chunk_seconds
+):
+    """Seconds of missing record, fetching the window one chunk at a time.
+
+    Only the missing count and bucket presence of each chunk are kept, so
+    memory depends on the chunk size rather than the length of the window.
+    Chunks are a whole number of buckets of every step, so no bucket is
+    split between two requests.
+
+    Parameters
+    ----------
+    fetch : callable
+        fetch(base_url, hts, site, measurement, start, end) returning a
+        DatetimeIndex of sample times, or None for an empty response.
+    base_url, hts, site, measurement : str
+        Which series to count.
+    start, end : str or pd.Timestamp
+        The window (end inclusive).
+    steps : list of int
+        Bucket sizes in seconds.
+    chunk_seconds : int
+        Length of the window to fetch at a time, rounded down to whole buckets.
+
+    Returns
+    -------
+    (np.ndarray, list of np.ndarray) or None
+        Seconds of missing record at each step, and whether each bucket of
+        each step has data. None if there were no samples at all.
+    """
+    first = epoch_seconds(pd.Timestamp(start))
+    last = epoch_seconds(pd.Timestamp(end))
+    step = int(np.lcm.reduce(steps))
+    chunk = max(1, chunk_seconds // step) * step
+
+    missing = np.zeros(len(steps), dtype=np.int64)
+    present = [[] for _ in steps]
+    samples = 0
+    for chunk_start in range(first, last + 1, chunk):
+        chunk_end = min(chunk_start + chunk - 1, last)
+        timestamps = fetch(
+            base_url,
+            hts,
+            site,
+            measurement,
+            pd.Timestamp(chunk_start, unit="s"),
+            pd.Timestamp(chunk_end, unit="s"),
+        )
+        if timestamps is None or len(timestamps) == 0:
+            seconds = np.array([], dtype=np.int64)
+        else:
+            seconds = epoch_seconds(timestamps)
+            seconds = seconds[(seconds >= chunk_start) & (seconds <= chunk_end)]
+        samples += len(seconds)
+        missing += gaps.missing_seconds_levels(seconds, chunk_start, chunk_end, steps)
+        for level, level_step in zip(present, steps):
+            level.append(gaps.presence(seconds, chunk_start, chunk_end, level_step))
+
+    if samples == 0:
+        return None
+    return missing, [np.concatenate(level) for level in present]
+
+
+class UnionFetch:
+    """A fetch that gets each series once over the union of several windows.
+
+    Requests inside the union are answered by slicing the samples of one
+    request over the whole union, which is kept until a different series is
+    asked for. Requests outside the union go straight to fetch. Meant to be
+    made for each site/measurement pair, so the samples are let go once the
+    pair is done.
+
+    Parameters
+    ----------
+    fetch : callable
+        fetch(base_url, hts, site, measurement, start, end) returning a
+        DatetimeIndex of sample times, or None for an empty response.
+    start, end : str or pd.Timestamp
+        The union of the windows (end inclusive).
+    """
+
+    def __init__(self, fetch, start, end):
+        self.fetch = fetch
+        self.start = pd.Timestamp(start)
+        # One second over, so the coverage store's half open requests fit
+        self.end = pd.Timestamp(end) + pd.Timedelta(seconds=1)
+        self._series = None
+        self._timestamps = None
+
+    def __call__(self, base_url, hts, site, measurement, start, end):
+        start = pd.Timestamp(start)
+        end = pd.Timestamp(end)
+        if start < self.start or end > self.end:
+            return self.fetch(base_url, hts, site, measurement, start, end)
+        series = (base_url, hts, site, measurement)
+        if series != self._series:
+            self._timestamps = self.fetch(
+                base_url, hts, site, measurement, self.start, self.end
+            )
+            self._series = series
+        if self._timestamps is None:
+            return None
+        return self._timestamps[(self._timestamps >= start) & (self._timestamps <= end)]
+
+
+def results_frame(config, bucket_results, site_region):
+    """Long format results with each site's region and each row's annex."""
+    frame = bucket_results.to_frame()
+    frame["region"] = frame["site"].map(site_region)
+    frame["annex"] = np.select(
+        [
+            frame["site"].isin(config["Annex_3_sites"]),
+            frame["bucket"].isin(config["Annex_1_buckets"]),
+            frame["bucket"].isin(config["Annex_2_buckets"]),
+        ],
+        ["annex3", "annex1", "annex2"],
+        default=None,
+    )
+    return frame
+
+
+def write_results(
+    config,
+    bucket_results,
+    site_region,
+    view_results=None,
+    gaps=None,
+    window=None,
+    shard=None,
+):
+    """Write the outputs of one report window.
+
+    Parameters
+    ----------
+    config : dict
+        The run's config.
+    bucket_results : ResultMatrix
+        [site x bucket] results at the report resolution.
+    site_region : dict
+        The region of each site, sites without one aren't in any region csv.
+    view_results : dict, optional
+        [site x bucket] results at each coverage view's resolution, by view.
+    gaps : pd.DataFrame, optional
+        The gaps of the window, as taken by write_gaps.
+    window : str, optional
+        The window's name, whose outputs go to a directory of their own.
+    shard : tuple of int, optional
+        (i, N) if these are only the results of one shard, in which case only
+        the parquet files are written, to the shard's directory.
+
+    Returns
+    -------
+    pd.DataFrame
+        The long format results.
+    """
+    results_path = window_file(shard_file(RESULTS_FILE, shard), window)
+    os.makedirs(os.path.dirname(results_path), exist_ok=True)
+
+    # All results in one typed file, which the html reports are made from
+    frame = results_frame(config, bucket_results, site_region)
+    frame.to_parquet(results_path, index=False)
+    # The same results at each coverage view's resolution
+    for view, results in (view_results or {}).items():
+        results_frame(config, results, site_region).to_parquet(
+            window_file(shard_file(view_results_file(view), shard), window),
+            index=False,
+        )
+    if gaps is not None:
+        write_gaps(window_file(shard_file(GAPS_FILE, shard), window), gaps)
+
+    if shard is not None or not config.get("csv_export", True):
+        return frame
+
+    # Annex splitting
+    site_names = bucket_results.sites
+    buckets = bucket_results.columns
+    rivers = [s for s in site_names if s not in config["Annex_3_sites"]]
+    annex_1 = bucket_results.select(
+        sites=rivers,
+        columns=[b for b in buckets if b in config["Annex_1_buckets"]],
+    )
+    annex_2 = bucket_results.select(
+        sites=rivers,
+        columns=[b for b in buckets if b in config["Annex_2_buckets"]],
+    )
+    annex_3 = bucket_results.select(sites=config["Annex_3_sites"])
 
-def generate(config_file_path, debug=False):
+    bucket_results.write_csv(window_file("output_csv/output.csv", window))
+    bucket_results.write_csv(
+        window_file("output_csv/output_percent.csv", window),
+        output_as_percent=True,
+    )
+    for region in REGIONS:
+        bucket_results.select(
+            sites=[s for s in site_names if site_region.get(s) == region]
+        ).write_csv(window_file(f"output_csv/output_{region}.csv", window))
+
+    annex_1.write_csv(window_file("output_csv/output_annex1.csv", window))
+    annex_2.write_csv(window_file("output_csv/output_annex2.csv", window))
+    annex_3.write_csv(window_file("output_csv/output_annex3.csv", window))
+
+    write_annex_totals(
+        window_file("output_csv/totals.csv", window),
+        [annex_1, annex_2, annex_3],
+    )
+    return frame
+
+
+def generate(
+    config_file_path,
+    debug=False,
+    metrics=None,
+    windows=None,
+    shard=None,
+    record_history=None,
+):
+    """Work out the missing record of every site/measurement pair.
+
+    Parameters
+    ----------
+    config_file_path : str
+        The yaml config of the run.
+    debug : bool, optional
+        Only do the sites and measurements in the debug lists.
+    metrics : RunMetrics, optional
+        Where to record how long the run took.
+    windows : dict, optional
+        Named report windows, name -> (start, end). Each series is fetched
+        once over the union of the windows, and each window's outputs are
+        written to a directory of its own (e.g. output_csv/weekly). Defaults
+        to the config's start and end, written straight to output_csv.
+    shard : str, optional
+        "i/N" to only do the i-th of N shards of the sorted site list. The
+        shard's results are written to output_csv/shards/i-of-N, and
+        merge_shards combines the shards into the usual outputs.
+    record_history : bool, optional
+        Whether to upsert the results into the history table of the dev
+        database. Defaults to the config's record_history.
+
+    Returns
+    -------
+    pd.DataFrame or dict
+        The long format results, or a dict of them by name if windows is given.
+    """
     warnings.filterwarnings("ignore", message=".*Empty hilltop response:.*")
+    if metrics is None:
+        metrics = RunMetrics()
 
     with open(config_file_path) as file:
         config = yaml.safe_load(file)
-    sites = site_list_merge.get_sites(site_list_merge.connect_to_db())
+    # The config's own window has no name, so its outputs aren't moved
+    if windows is None:
+        windows = {None: (config["start"], config["end"])}
+        single_window = True
+    else:
+        windows = dict(windows)
+        single_window = False
+    with metrics.stage("site_list"):
+        if config.get("site_list_file"):
+            # A fixed site list instead of the SQL query, e.g. for benchmarks
+            sites = pd.read_csv(config["site_list_file"])
+        else:
+            sites = site_list_merge.get_sites(
+                site_list_merge.connect_to_db(),
+                config.get("site_list_cache_dir"),
+                config.get("site_list_ttl_hours", 0),
+            )
 
     # This gets rid of sites that are assigned to multiple regions
     # Currently it just picks out the last region alphabetically
@@ -38,6 +366,12 @@ def generate(config_file_path, debug=False):
     if debug:
         sites = sites[sites["SiteName"].isin(debug_site_list)]
 
+    # Every N-th site from the i-th, so each shard gets a similar mix
+    if shard is not None:
+        shard = parse_shard(shard)
+        sites = sites.iloc[shard[0] - 1 :: shard[1]]
+        metrics.progress(f"Shard {shard[0]}/{shard[1]}: {len(sites)} sites")
+
     with open("config_files/Active_Measurements.csv", newline="") as f:
         reader = csv.reader(f)
         measurements = [(row[0], row[1]) for row in reader if len(row) > 0]
@@ -51,370 +385,412 @@ def generate(config_file_path, debug=False):
     measurement_buckets = list(dict.fromkeys([m[1] for m in measurements]))
 
     # Sort sites into regions
-    region_stats_dict = {
-        "Northern": [],
-        "Eastern": [],
-        "Central": [],
-        "Special": [],
-    }
-    regions_dict = {
-        "Northern": ["NORTHERN"],
-        "Eastern": ["EASTERN"],
-        "Central": ["CENTRAL"],
-        "Special": ["LAKES AND WQ", "Arawhata Piezometers"],
-    }
+    region_stats_dict = {region: [] for region in REGIONS}
     for _, site in sites.iterrows():
-        for region in regions_dict:
-            if site.RegionName in regions_dict[region]:
+        for region in REGIONS:
+            if site.RegionName in REGIONS[region]:
                 region_stats_dict[region].append(site.SiteName)
 
     # manual start/end date for sites
-    starting_sites_path = "//tqm/Hydrology/Reports/Report CSVs/MR_Sites_Open.csv"
-    ending_sites_path = "//tqm/Hydrology/Reports/Report CSVs/MR_Sites_Closed.csv"
-    site_start_frame = pd.read_csv(starting_sites_path)
-    site_start_frame["Datetime"] = pd.to_datetime(
-        site_start_frame["Datetime"], format="%d/%m/%Y %H:%M"
+    starting_sites_path = config.get(
+        "site_starts_file", "//tqm/Hydrology/Reports/Report CSVs/MR_Sites_Open.csv"
     )
-    site_end_frame = pd.read_csv(ending_sites_path)
-    site_end_frame["Datetime"] = pd.to_datetime(
-        site_end_frame["Datetime"], format="%d/%m/%Y %H:%M"
+    ending_sites_path = config.get(
+        "site_ends_file", "//tqm/Hydrology/Reports/Report CSVs/MR_Sites_Closed.csv"
     )
-
-    def report_missing_record(site, measurement, start, end):
-        """Reports minutes missing for a given site/measurement pair."""
-        start_of_site = site_start_frame[
-            (site_start_frame["Site"] == site)
-            & (site_start_frame["Measurement"] == measurement[0])
-            & (site_start_frame["Datetime"] < pd.to_datetime(end))
-            & (site_start_frame["Datetime"] > pd.to_datetime(start))
-        ]
-        end_of_site = site_end_frame[
-            (site_end_frame["Site"] == site)
-            & (site_end_frame["Measurement"] == measurement[0])
-            & (site_end_frame["Datetime"] < pd.to_datetime(end))
-            & (site_end_frame["Datetime"] > pd.to_datetime(start))
-        ]
-        if len(start_of_site) > 1:
-            raise Exception(
-                f"Multiple start dates in config for site={site}, meas={measurement} between {start} and"
-                f" {end}, should be max 1."
-            )
-        elif len(start_of_site) == 1:
-            start = str(start_of_site["Datetime"].iloc[0])
-        if len(end_of_site) > 1:
-            raise Exception(
-                f"Multiple end dates in config for site={site}, meas={measurement} between {start} and"
-                f" {end}, should be max 1."
-            )
-        elif len(end_of_site) == 1:
-            end = end_of_site["Datetime"].iloc[0]
-
-        _, blob = get_data(
-            config["base_url"],
-            config["hts"],
-            site,
-            measurement[0],
-            start,
-            end,
+    with metrics.stage("overrides"):
+        site_starts = OverrideIndex.load(
+            starting_sites_path, config.get("override_cache_dir")
         )
-
-        if blob is None or len(blob) == 0:
-            return (np.nan, np.nan)
-
-        series = blob[0].data.timeseries[blob[0].data.timeseries.columns[0]]
-        series.index = pd.DatetimeIndex(series.index)
-
-        freq = "24h" if measurement[1] in ["Rainfall", "Rainfall Backup"] else "1h"
-        # Another option for if frequency is consistent:
-        # freq = infer_frequency(series.index, method="mode")
-
-        # Sample data at frequency
-        series.index = series.index.floor(freq)
-        series = series[~series.index.duplicated(keep="first")]
-
-        series = series.reindex(pd.date_range(start, end, freq=freq))
-        missing_points = series.asfreq(freq).isna().sum()
-        return (
-            str(missing_points * pd.to_timedelta(to_offset(freq))),
-            str(pd.Timestamp(end) - pd.Timestamp(start)),
+        site_ends = OverrideIndex.load(
+            ending_sites_path, config.get("override_cache_dir")
         )
+    # Check these now rather than hours into the run
+    for start, end in windows.values():
+        site_starts.check_unique(start, end, "start")
+        site_ends.check_unique(start, end, "end")
+
+    # Report resolution of each bucket, and extra resolutions worked out
+    # from the same samples
+    bucket_resolutions = config.get(
+        "bucket_resolutions", {"Rainfall": "24h", "Rainfall Backup": "24h"}
+    )
+    default_resolution = config.get("default_resolution", "1h")
+    coverage_views = config.get("coverage_views") or []
+    view_steps = [
+        int(pd.to_timedelta(to_offset(view)).total_seconds()) for view in coverage_views
+    ]
 
-    all_stats_dict = {}
-    all_sites_totals = {}
-    start_timer = time.time()
-    for _, site in sites.iterrows():
-        site_stats_list = []
-        site_totals_list = []
-        for meas in measurements:
-            try:
-                (missing, total) = report_missing_record(
-                    site["SiteName"], meas, config["start"], config["end"]
-                )
-                site_stats_list.append(missing)
-                site_totals_list.append(total)
-            except ValueError as e:
-                print(
-                    f"Site '{site['SiteName']}' with meas '{meas[0]}' doesn't work: {e}"
+    # Write the [start, end) of every gap as well as the totals
+    gap_index = config.get("gap_index", False)
+
+    # How the measurements of each bucket are combined
+    bucket_aggregation = config.get("bucket_aggregation") or {}
+    for bucket, method in bucket_aggregation.items():
+        if method not in ("sum", "max", "union"):
+            raise ValueError(f"Unknown aggregation '{method}' for {bucket}")
+
+    # Long windows are fetched in chunks of this many days, if set
+    chunk_seconds = int(config.get("fetch_chunk_days") or 0) * 86400
+    cache = HilltopCache.from_config(config)
+    store = CoverageStore.from_config(config)
+    raw_fetch = functools.partial(fetch_timestamps, metrics=metrics)
+    fetch = (
+        raw_fetch
+        if cache is None
+        else functools.partial(cache.get_timestamps, raw_fetch)
+    )
+    # Windows that line up with the buckets can be counted by the server
+    aggregator = AggregateFetcher.from_config(config, raw_fetch, metrics)
+    aggregate_fetch = {}
+    if aggregator is not None:
+        for freq in {default_resolution, *bucket_resolutions.values()}:
+            step = int(pd.to_timedelta(to_offset(freq)).total_seconds())
+            aggregate_fetch[step] = functools.partial(aggregator.fetch, step)
+            if cache is not None:
+                # Bucket starts aren't samples, so they're cached apart from
+                # them (and from other bucket sizes)
+                aggregate_fetch[step] = functools.partial(
+                    cache.get_timestamps,
+                    aggregate_fetch[step],
+                    variant=f"{aggregator.method}/{step}",
                 )
-                site_stats_list.append(np.nan)
-                site_totals_list.append(np.nan)
-
-        all_stats_dict[site["SiteName"]] = site_stats_list
-        all_sites_totals[site["SiteName"]] = site_totals_list
-        print(site.SiteName, time.time() - start_timer)
-
-    bucket_stats_dict = {}
-    bucket_totals_dict = {}
-    diff = pd.to_datetime(config["end"]) - pd.to_datetime(config["start"])
-    for site in all_stats_dict:
-        site_bucket_dict = dict([(m, []) for m in measurement_buckets])
-        site_totals_dict = dict([(m, []) for m in measurement_buckets])
-        for i in zip(
-            measurements, all_stats_dict[site], all_sites_totals[site], strict=True
+    # Several windows are worked out from one fetch of each series over
+    # their union. Chunked runs and the coverage store already only fetch
+    # what each window needs, so they're left to do that.
+    union = None
+    if len(windows) > 1 and chunk_seconds == 0 and store is None:
+        union = (
+            min(pd.Timestamp(start) for (start, _) in windows.values()),
+            max(pd.Timestamp(end) for (_, end) in windows.values()),
+        )
+
+    def report_missing_record(
+        site, measurement, start, end, fetch=fetch, aggregate_fetch=aggregate_fetch
+    ):
+        """Reports seconds missing for a given site/measurement pair.
+
+        Returns (missing seconds, total seconds, missing seconds of each
+        coverage view), followed by the (start, end) seconds of each gap if
+        gap_index is on, and the pair's coverage at each resolution if its
+        bucket is a union. None if there's no data.
+        """
+        start_of_site = site_starts.between(site, measurement[0], start, end)
+        end_of_site = site_ends.between(site, measurement[0], start, end)
+        if len(start_of_site) == 1:
+            start = str(start_of_site[0])
+        if len(end_of_site) == 1:
+            end = end_of_site[0]
+
+        freq = bucket_resolutions.get(measurement[1], default_resolution)
+        step = int(pd.to_timedelta(to_offset(freq)).total_seconds())
+        # Coverage is worked out once at the finest level these need, and
+        # rolled up to each of them
+        steps = [step] + view_steps
+        pair_fetch = fetch
+        # Bucket counts from the server can only be rolled up, not split
+        if (
+            step in aggregate_fetch
+            and CoverageStore.can_answer(start, end, freq)
+            and all(view_step % step == 0 for view_step in view_steps)
+        ):
+            pair_fetch = aggregate_fetch[step]
+        site_catalog = catalog.get(site)
+        span = None if site_catalog is None else site_catalog.get(measurement[0])
+        if site_catalog is not None and (span is None or span[0] > pd.Timestamp(end)):
+            # The server doesn't have this pair (in this window), so asking
+            # would only get an empty response
+            return None
+
+        first = epoch_seconds(pd.Timestamp(start))
+        last = epoch_seconds(pd.Timestamp(end))
+        # Whether each bucket at each resolution has data, for the gap
+        # intervals and union buckets
+        union = bucket_aggregation.get(measurement[1]) == "union"
+        level_present = None
+        if span is not None and span[1] < pd.Timestamp(start):
+            # The series stopped before the window, so it's all missing
+            no_samples = np.array([], dtype=np.int64)
+            missing = gaps.missing_seconds_levels(no_samples, first, last, steps)
+            level_present = [
+                gaps.presence(no_samples, first, last, level_step)
+                for level_step in steps
+            ]
+        elif (
+            store is not None
+            and len(view_steps) == 0
+            and store.can_answer(start, end, freq)
         ):
-            site_bucket_dict[i[0][1]].append(i[1])
-            site_totals_dict[i[0][1]].append(i[2])
-        for bucket in site_bucket_dict:
-            site_totals_dict[bucket] = sum(
-                [
-                    pd.to_timedelta(n) if n is not np.nan else pd.to_timedelta("0")
-                    for n in site_totals_dict[bucket]
-                ],
-                pd.to_timedelta("0"),
+            # The store only keeps the report resolution, so views need the
+            # samples
+            present = store.presence(
+                pair_fetch,
+                config["base_url"],
+                config["hts"],
+                site,
+                measurement[0],
+                start,
+                end,
+                freq,
+            )
+            if not present.any():
+                return None
+            missing = [np.count_nonzero(~present) * step]
+            level_present = [present]
+        elif chunk_seconds > 0:
+            counted = fetch_missing_seconds(
+                pair_fetch,
+                config["base_url"],
+                config["hts"],
+                site,
+                measurement[0],
+                start,
+                end,
+                steps,
+                chunk_seconds,
+            )
+            if counted is None:
+                return None
+            missing, level_present = counted
+        else:
+            timestamps = pair_fetch(
+                config["base_url"], config["hts"], site, measurement[0], start, end
             )
-            nanless = [m for m in site_bucket_dict[bucket] if m is not np.nan]
-            if len(nanless) == 0:
-                site_bucket_dict[bucket] = np.nan
-            elif len(nanless) == 1:
-                site_bucket_dict[bucket] = nanless[0]
-            else:
-                print("Multiple data sources in one bucket")
-                print(site, bucket, nanless)
-                # sum
-                site_bucket_dict[bucket] = sum(
-                    [pd.to_timedelta(n) for n in nanless], pd.to_timedelta("0")
-                )
-                # or max?
-                # site_bucket_dict[bucket] = max([pd.to_timedelta(n) for n in nanless])
-
-        bucket_stats_dict[site] = [site_bucket_dict[m] for m in measurement_buckets]
-        bucket_totals_dict[site] = [site_totals_dict[m] for m in measurement_buckets]
 
-    def write_dict_to_file(
-        output_file, input_dict, input_totals, title_list, output_as_percent
-    ):
-        """Writes a dict into csv."""
-        with open(output_file, "w", newline="", encoding="utf-8") as output:
-            wr = csv.writer(output)
-            wr.writerow(["Sites"] + title_list)
-            for site in input_dict:
-                if output_as_percent:
-                    wr.writerow(
-                        [site]
-                        + [
-                            (missing / total) * 100 if missing is not np.nan else np.nan
-                            for (missing, total) in zip(
-                                input_dict[site], input_totals[site], strict=True
-                            )
-                        ]
-                    )
-                else:
-                    wr.writerow([site] + input_dict[site])
-        with open(
-            output_file[:-4] + "_totals" + output_file[-4:],
-            "w",
-            newline="",
-            encoding="utf-8",
-        ) as output:
-            wr = csv.writer(output)
-            wr.writerow(["Sites"] + title_list)
-            for site in input_totals:
-                wr.writerow([site] + input_totals[site])
-
-    write_dict_to_file(
-        "output_csv/output.csv",
-        bucket_stats_dict,
-        bucket_totals_dict,
-        measurement_buckets,
-        False,
-    )
-    write_dict_to_file(
-        "output_csv/output_percent.csv",
-        bucket_stats_dict,
-        bucket_totals_dict,
-        measurement_buckets,
-        True,
+            if timestamps is None or len(timestamps) == 0:
+                return None
+
+            seconds = epoch_seconds(timestamps)
+            missing = gaps.missing_seconds_levels(seconds, first, last, steps)
+            if gap_index or union:
+                level_present = [
+                    gaps.presence(seconds, first, last, level_step)
+                    for level_step in steps
+                ]
+        result = (
+            int(missing[0]),
+            last - first,
+            *(int(view_missing) for view_missing in missing[1:]),
+        )
+        level_gaps = []
+        if gap_index or union:
+            for level, level_step in zip(level_present, steps):
+                gap_starts, gap_ends = gaps.gap_intervals(level, first, level_step)
+                level_gaps.append(tuple(zip(gap_starts.tolist(), gap_ends.tolist())))
+        if gap_index:
+            result += (level_gaps[0],)
+        if union:
+            result += (
+                tuple(
+                    (first, last, level_step, level)
+                    for (level_step, level) in zip(steps, level_gaps)
+                ),
+            )
+        return result
+
+    def measure_pair(site, measurement):
+        """report_missing_record for every window, with the pair's metrics recorded.
+
+        Returns a tuple of the results of each window.
+        """
+        pair_fetch = fetch
+        pair_aggregate_fetch = aggregate_fetch
+        if union is not None:
+            pair_fetch = UnionFetch(fetch, *union)
+            pair_aggregate_fetch = {
+                step: UnionFetch(step_fetch, *union)
+                for (step, step_fetch) in aggregate_fetch.items()
+            }
+        with metrics.pair(site, measurement[0]) as record:
+            result = tuple(
+                report_missing_record(
+                    site, measurement, start, end, pair_fetch, pair_aggregate_fetch
+                )
+                for (start, end) in windows.values()
+            )
+            empty = all(window_result is None for window_result in result)
+            record["outcome"] = "empty" if empty else "data"
+        return result
+
+    # Results that an interrupted run with the same windows already got
+    journal = CheckpointJournal.from_config(
+        config,
+        windows,
+        coverage_views,
+        gap_index,
+        shard,
+        override_files=[starting_sites_path, ending_sites_path],
     )
-    for region in regions_dict:
-        write_dict_to_file(
-            f"output_csv/output_{region}.csv",
-            {
-                k: bucket_stats_dict[k]
-                for k in bucket_stats_dict
-                if k in region_stats_dict[region]
-            },
-            {
-                k: bucket_totals_dict[k]
-                for k in bucket_stats_dict
-                if k in region_stats_dict[region]
-            },
-            measurement_buckets,
-            False,
+    if journal is not None and len(journal.done) > 0:
+        metrics.progress(
+            f"Resuming from {journal.path}, {len(journal.done)} pairs already done"
         )
 
-    # Annex splitting
-    def filter_list(unfiltered, filter):
-        return [p[0] for p in zip(unfiltered, filter) if p[1]]
-
-    annex_1_filter = [
-        True if m in config["Annex_1_buckets"] else False for m in measurement_buckets
-    ]
-    annex_2_filter = [
-        True if m in config["Annex_2_buckets"] else False for m in measurement_buckets
-    ]
-    annex_3_dict = {
-        k: bucket_stats_dict[k]
-        for k in config["Annex_3_sites"]
-        if k in bucket_stats_dict
-    }
-    annex_3_totals = {
-        k: bucket_totals_dict[k]
-        for k in config["Annex_3_sites"]
-        if k in bucket_totals_dict
-    }
+    def submit_pair(site, measurement):
+        """Start a pair, or pick up its result from the checkpoint journal."""
+        if journal is not None:
+            future = journal.finished(site, measurement[0])
+            if future is not None:
+                return future
+        future = executor.submit(measure_pair, site, measurement)
+        if journal is not None:
+            future.add_done_callback(
+                functools.partial(journal.record_future, site, measurement[0])
+            )
+        return future
 
-    rivers_dict = {
-        k: bucket_stats_dict[k]
-        for k in bucket_stats_dict
-        if k not in config["Annex_3_sites"]
-    }
-    rivers_totals = {
-        k: bucket_totals_dict[k]
-        for k in bucket_totals_dict
-        if k not in config["Annex_3_sites"]
+    site_names = list(sites["SiteName"])
+    window_results = {
+        name: ResultMatrix.empty(site_names, [m[0] for m in measurements])
+        for name in windows
     }
-    annex_1_dict = {k: filter_list(rivers_dict[k], annex_1_filter) for k in rivers_dict}
-    annex_2_dict = {k: filter_list(rivers_dict[k], annex_2_filter) for k in rivers_dict}
-    annex_1_totals = {
-        k: filter_list(rivers_totals[k], annex_1_filter) for k in rivers_totals
+    view_results = {
+        name: [
+            ResultMatrix.empty(site_names, [m[0] for m in measurements])
+            for _ in coverage_views
+        ]
+        for name in windows
     }
-    annex_2_totals = {
-        k: filter_list(rivers_totals[k], annex_2_filter) for k in rivers_totals
+    # (site index, measurement index, gaps) of each pair with a result
+    window_gaps = {name: [] for name in windows}
+    # (start, end, step, gaps) of each union pair with a result, at the report
+    # resolution and each coverage view
+    window_coverage = {
+        name: [{} for _ in range(1 + len(view_steps))] for name in windows
     }
+    start_timer = time.perf_counter()
+
+    # Fire off every site/measurement pair at once, capped at max_in_flight
+    # concurrent Hilltop requests. Results are collected back in site order
+    # so the output is identical to a serial run.
+    executor = ThreadPoolExecutor(max_workers=config.get("max_in_flight", 1))
+    try:
+        # Look up which measurements each site has up front, so pairs that
+        # don't exist never cost a GetData round trip
+        with metrics.stage("catalog"):
+            if config.get("measurement_catalog", False):
+                catalog = measurement_catalog.build_catalog(
+                    executor, config["base_url"], config["hts"], site_names, metrics
+                )
+            else:
+                catalog = {}
 
-    write_dict_to_file(
-        "output_csv/output_annex1.csv",
-        annex_1_dict,
-        annex_1_totals,
-        filter_list(measurement_buckets, annex_1_filter),
-        False,
-    )
-    write_dict_to_file(
-        "output_csv/output_annex2.csv",
-        annex_2_dict,
-        annex_2_totals,
-        filter_list(measurement_buckets, annex_2_filter),
-        False,
-    )
-    write_dict_to_file(
-        "output_csv/output_annex3.csv",
-        annex_3_dict,
-        annex_3_totals,
-        measurement_buckets,
-        False,
-    )
-    """    write_dict_to_file(
-        "output_csv/output_totals.csv", bucket_totals_dict, measurement_buckets, False
-    )"""
-
-    # totals
-    rivers_totals = {
-        k: bucket_totals_dict[k]
-        for k in bucket_totals_dict
-        if k not in config["Annex_3_sites"]
-    }
-    annex_1_totals = {
-        k: filter_list(rivers_totals[k], annex_1_filter) for k in rivers_totals
-    }
-    annex_2_totals = {
-        k: filter_list(rivers_totals[k], annex_2_filter) for k in rivers_totals
-    }
-    annex_3_totals = {
-        k: bucket_totals_dict[k]
-        for k in config["Annex_3_sites"]
-        if k in bucket_stats_dict
+        with metrics.stage("pairs"):
+            site_futures = [
+                [submit_pair(site, meas) for meas in measurements]
+                for site in site_names
+            ]
+            for i, (site, futures) in enumerate(zip(site_names, site_futures)):
+                for j, (meas, future) in enumerate(zip(measurements, futures)):
+                    try:
+                        result = future.result()
+                    except ValueError as e:
+                        metrics.failed("pairs", site, meas[0], e)
+                        result = None
+                    if result is None:
+                        continue
+                    for name, window_result in zip(windows, result):
+                        if window_result is None:
+                            continue
+                        # The report resolution, then each coverage view
+                        for results, missing in zip(
+                            [window_results[name], *view_results[name]],
+                            [window_result[0], *window_result[2 : 2 + len(view_steps)]],
+                        ):
+                            results.missing[i, j] = missing
+                            results.total[i, j] = window_result[1]
+                            results.valid[i, j] = True
+                        if gap_index:
+                            window_gaps[name].append(
+                                (i, j, window_result[2 + len(view_steps)])
+                            )
+                        if bucket_aggregation.get(meas[1]) == "union":
+                            for coverage, level in zip(
+                                window_coverage[name], window_result[-1]
+                            ):
+                                coverage[(i, j)] = level
+                metrics.site_done(site, time.perf_counter() - start_timer)
+    finally:
+        # Don't sit through the rest of the queue if something blew up
+        executor.shutdown(cancel_futures=True)
+        if journal is not None:
+            journal.close()
+        if cache is not None:
+            cache.evict()
+            cache.report(metrics)
+        if store is not None:
+            store.report(metrics)
+        metrics.progress(metrics.summary())
+
+    site_region = {
+        site: region for region in REGIONS for site in region_stats_dict[region]
     }
+    with metrics.stage("export"):
+        frames = {}
+        for name, results in window_results.items():
+            gaps_frame = None
+            if gap_index:
+                gaps_frame = pd.DataFrame(
+                    [
+                        (
+                            site_names[i],
+                            measurements[j][0],
+                            measurements[j][1],
+                            site_region.get(site_names[i]),
+                            gap_start,
+                            gap_end,
+                        )
+                        for (i, j, pair_gaps) in window_gaps[name]
+                        for (gap_start, gap_end) in pair_gaps
+                    ],
+                    columns=GAP_COLUMNS,
+                )
+            frames[name] = write_results(
+                config,
+                results.by_bucket(
+                    [m[1] for m in measurements],
+                    measurement_buckets,
+                    bucket_aggregation,
+                    window_coverage[name][0],
+                ),
+                site_region,
+                {
+                    view: results.by_bucket(
+                        [m[1] for m in measurements],
+                        measurement_buckets,
+                        bucket_aggregation,
+                        coverage,
+                    )
+                    for view, results, coverage in zip(
+                        coverage_views, view_results[name], window_coverage[name][1:]
+                    )
+                },
+                gaps_frame,
+                window=name,
+                shard=shard,
+            )
 
-    totals_dict = {
-        k: pd.to_timedelta(0)
-        for k in [
-            "total_1_numerator",
-            "total_2_numerator",
-            "total_3_numerator",
-            "total_1_denominator",
-            "total_2_denominator",
-            "total_3_denominator",
-        ]
-    }
+    # Keep every run's full results, for trends by site. Shards are only
+    # part of a run, so their results are recorded by the merge
+    if record_history is None:
+        record_history = config.get("record_history", False)
+    if record_history and shard is None:
+        with metrics.stage("history"):
+            engine = site_list_merge.connect_to_dev_db()
+            for name, (start, end) in windows.items():
+                site_list_merge.insert_history(frames[name], start, end, engine)
 
-    for pair in [
-        ["total_1_numerator", annex_1_dict],
-        ["total_2_numerator", annex_2_dict],
-        ["total_3_numerator", annex_3_dict],
-        ["total_1_denominator", annex_1_totals],
-        ["total_2_denominator", annex_2_totals],
-        ["total_3_denominator", annex_3_totals],
-    ]:
-        for site in pair[1]:
-            for i in [pd.to_timedelta(a) for a in pair[1][site] if a is not np.nan]:
-                totals_dict[pair[0]] += i
-
-    with open("output_csv/totals.csv", "w", newline="", encoding="utf-8") as output:
-        wr = csv.writer(output)
-        wr.writerow(["\\", "annex_1", "annex_2", "annex_3"])
-        wr.writerow(
-            [
-                "Total",
-                totals_dict["total_1_numerator"],
-                totals_dict["total_2_numerator"],
-                totals_dict["total_3_numerator"],
-            ]
-        )
-        wr.writerow(
-            [
-                "Percentage",
-                (
-                    totals_dict["total_1_numerator"]
-                    / totals_dict["total_1_denominator"]
-                    * 100
-                    if totals_dict["total_1_denominator"] > pd.to_timedelta(0)
-                    else "None"
-                ),
-                (
-                    totals_dict["total_2_numerator"]
-                    / totals_dict["total_2_denominator"]
-                    * 100
-                    if totals_dict["total_2_denominator"] > pd.to_timedelta(0)
-                    else "None"
-                ),
-                (
-                    totals_dict["total_3_numerator"]
-                    / totals_dict["total_3_denominator"]
-                    * 100
-                    if totals_dict["total_3_denominator"] > pd.to_timedelta(0)
-                    else "None"
-                ),
-            ]
-        )
-        wr.writerow(
-            [
-                "Length of record",
-                totals_dict["total_1_denominator"],
-                totals_dict["total_2_denominator"],
-                totals_dict["total_3_denominator"],
-            ]
-        )
+    # Finished, so a rerun of this window should start from scratch
+    if journal is not None:
+        journal.remove()
+    if single_window:
+        return frames[None]
+    return frames
 
 
 if __name__ == "__main__":
-    generate("config_files/script_config.yaml", debug=False)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("config", nargs="?", default="config_files/script_config.yaml")
+    parser.add_argument("--shard", help="only do shard i of N of the sites, e.g. 2/4")
+    args = parser.parse_args()
+    generate(args.config, debug=False, shard=args.shard)
@@ -0,0 +1,158 @@
+"""Bucket presence from Hilltop interval statistics instead of raw samples."""
+
+import threading
+
+import pandas as pd
+from hilltoppy.utils import build_url, get_hilltop_xml
+
+from missing_record.run_metrics import RunMetrics
+from missing_record.utils import epoch_seconds
+
+
+def interval_name(step):
+    """A bucket size in seconds as a Hilltop interval, e.g. "1 hour"."""
+    for unit, seconds in [("day", 86400), ("hour", 3600), ("minute", 60)]:
+        if step % seconds == 0:
+            return f"{step // seconds} {unit}"
+    return f"{step} second"
+
+
+def get_bucket_starts(
+    base_url, hts, site, measurement, start, end, step, method, metrics=None
+):
+    """Get the buckets of a window that have samples, as counted by Hilltop.
+
+    Asks for an interval statistic instead of the raw samples, so the
+    response is one value per bucket however often the series is sampled.
+    Hilltop stamps interval statistics at the end of the interval.
+
+    Parameters
+    ----------
+    base_url : str
+        The base URL of the Hilltop server.
+    hts : str
+        The Hilltop Time Series (HTS) file.
+    site, measurement : str
+        Which series to count.
+    start, end : str or pd.Timestamp
+        The window, which should start on a bucket boundary.
+    step : int
+        Bucket size in seconds.
+    method : str
+        The Hilltop aggregation method, which must give the number of samples
+        in each interval (e.g. "Count").
+    metrics : RunMetrics, optional
+        Where to record the request.
+
+    Returns
+    -------
+    pd.DatetimeIndex or None
+        Start of each bucket with at least one sample, or None if Hilltop had
+        no data.
+
+    Raises
+    ------
+    ValueError
+        If the server returns an error, e.g. it can't aggregate the series.
+    """
+    first = epoch_seconds(pd.Timestamp(start))
+    last = epoch_seconds(pd.Timestamp(end))
+    if metrics is None:
+        metrics = RunMetrics()
+    # Ask up to the end of the last bucket, so its statistic is included
+    url = build_url(
+        base_url,
+        hts,
+        "GetData",
+        site=site,
+        measurement=measurement,
+        from_date=str(pd.Timestamp(first - first % step, unit="s")),
+        to_date=str(pd.Timestamp(last - last % step + step, unit="s")),
+        agg_method=method,
+        agg_interval=interval_name(step),
+        alignment="00:00",
+    )
+    with metrics.timer("fetch_seconds"):
+        root = get_hilltop_xml(url, hooks=metrics.request_hooks())
+    error = root.findtext("Error")
+    if error is not None:
+        if "no data" in error.lower():
+            return None
+        raise ValueError(error)
+
+    stamps = []
+    counts = []
+    for element in root.iter("E"):
+        stamps.append(element.findtext("T"))
+        counts.append(element.findtext("I1"))
+    if len(stamps) == 0:
+        return None
+
+    bucket_starts = epoch_seconds(pd.DatetimeIndex(stamps)) - step
+    counts = pd.to_numeric(pd.Series(counts), errors="coerce").to_numpy()
+    present = (counts > 0) & (bucket_starts >= first) & (bucket_starts <= last)
+    return pd.DatetimeIndex(bucket_starts[present].astype("datetime64[s]"))
+
+
+class AggregateFetcher:
+    """Fetch bucket presence with get_bucket_starts, falling back to raw samples.
+
+    A measurement that the server fails to aggregate is fetched raw for the
+    rest of the run.
+
+    Parameters
+    ----------
+    method : str
+        The Hilltop aggregation method, see get_bucket_starts.
+    fallback : callable
+        fallback(base_url, hts, site, measurement, start, end) returning a
+        DatetimeIndex of raw sample times, or None for an empty response.
+    metrics : RunMetrics, optional
+        Where to record the requests, and the measurements that couldn't be
+        aggregated.
+    """
+
+    def __init__(self, method, fallback, metrics=None):
+        self.method = method
+        self.fallback = fallback
+        self.metrics = metrics
+        self.unsupported = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, fallback, metrics=None):
+        """Build a fetcher from the yaml config, or None if aggregation is off."""
+        if not config.get("aggregate_method"):
+            return None
+        return cls(config["aggregate_method"], fallback, metrics)
+
+    def fetch(self, step, base_url, hts, site, measurement, start, end):
+        """Times in each bucket with samples (or the raw samples), or None.
+
+        Either way, flooring the times onto the buckets gives the same
+        buckets as the raw samples would.
+        """
+        if measurement not in self.unsupported:
+            try:
+                return get_bucket_starts(
+                    base_url,
+                    hts,
+                    site,
+                    measurement,
+                    start,
+                    end,
+                    step,
+                    self.method,
+                    self.metrics,
+                )
+            except ValueError as e:
+                # Errors for the pair itself (e.g. it doesn't exist) come
+                # straight back out of the fallback
+                timestamps = self.fallback(base_url, hts, site, measurement, start, end)
+                with self._lock:
+                    first = measurement not in self.unsupported
+                    if first and self.metrics is not None:
+                        self.metrics.failed("aggregate", None, measurement, e)
+                    self.unsupported.add(measurement)
+                return timestamps
+        return self.fallback(base_url, hts, site, measurement, start, end)
@@ -0,0 +1,183 @@
+"""On-disk cache of Hilltop sample timestamps, split into day-sized chunks."""
+
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from missing_record.utils import epoch_seconds
+
+SECONDS_PER_DAY = 86400
+
+
+class HilltopCache:
+    """Cache of the timestamps Hilltop returned for a series, one file per day.
+
+    Each day is stored as a flat array of little-endian uint32 seconds since
+    midnight, under ``cache_dir/<hash of server, hts, site, measurement>/``
+    (and the variant, for responses that aren't the raw samples).
+    An empty file means Hilltop had no data for that day. Days newer than
+    ``refetch_days`` ago are never served from (or written to) the cache, so
+    late-arriving data is still picked up.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory to keep the cache in.
+    max_bytes : int
+        Size the cache is trimmed back to by evict(), oldest files first.
+    refetch_days : int
+        Number of recent days that are always refetched.
+    """
+
+    def __init__(self, cache_dir, max_bytes, refetch_days):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.refetch_days = refetch_days
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a cache from the yaml config, or None if caching is off."""
+        if not config.get("cache_dir"):
+            return None
+        return cls(
+            config["cache_dir"],
+            int(config.get("cache_max_mb", 1024)) * 1024 * 1024,
+            int(config.get("cache_refetch_days", 3)),
+        )
+
+    def _series_dir(self, base_url, hts, site, measurement, variant=None):
+        parts = [base_url.rstrip("/"), hts, site, measurement]
+        if variant is not None:
+            parts.append(variant)
+        key = "|".join(parts)
+        return os.path.join(
+            self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+        )
+
+    def get_timestamps(
+        self, fetch, base_url, hts, site, measurement, start, end, variant=None
+    ):
+        """Timestamps of a series between start and end (inclusive).
+
+        Parameters
+        ----------
+        fetch : callable
+            fetch(base_url, hts, site, measurement, start, end) returning a
+            DatetimeIndex of sample times, or None for an empty response.
+        base_url, hts, site, measurement : str
+            Which series to get.
+        start, end : str or pd.Timestamp
+            The window to get.
+        variant : str, optional
+            What fetch returns if it isn't the raw samples, e.g. "Count/3600"
+            for the start of each hour the server counted samples in. Each
+            variant is cached apart from the raw samples and the others.
+
+        Returns
+        -------
+        pd.DatetimeIndex
+            Sorted sample times within the window, possibly empty.
+        """
+        start = pd.Timestamp(start)
+        end = pd.Timestamp(end)
+        first_day = start.normalize()
+        last_day = end.normalize()
+        horizon = pd.Timestamp.now().normalize() - pd.Timedelta(days=self.refetch_days)
+        series_dir = self._series_dir(base_url, hts, site, measurement, variant)
+
+        chunks = []
+        missing_days = []
+        for day in pd.date_range(first_day, last_day, freq="D"):
+            path = os.path.join(series_dir, day.strftime("%Y-%m-%d") + ".bin")
+            if day < horizon and os.path.exists(path):
+                with open(path, "rb") as f:
+                    offsets = np.frombuffer(f.read(), dtype="<u4")
+                # Bump the mtime so eviction drops the least recently used days
+                os.utime(path)
+                chunks.append(epoch_seconds(day) + offsets.astype(np.int64))
+            else:
+                missing_days.append(day)
+
+        with self._lock:
+            self.hits += (last_day - first_day).days + 1 - len(missing_days)
+            self.misses += len(missing_days)
+
+        # Fetch runs of consecutive missing days in a single request each
+        for run_start, run_end in _consecutive_runs(missing_days):
+            run_stop = run_end + pd.Timedelta(days=1)
+            index = fetch(base_url, hts, site, measurement, run_start, run_stop)
+            seconds = (
+                np.array([], dtype=np.int64) if index is None else epoch_seconds(index)
+            )
+            seconds = np.sort(seconds)
+            seconds = seconds[seconds < epoch_seconds(run_stop)]
+            chunks.append(seconds)
+            for day in pd.date_range(run_start, run_end, freq="D"):
+                if day >= horizon:
+                    continue
+                day_start = epoch_seconds(day)
+                lo, hi = np.searchsorted(
+                    seconds, [day_start, day_start + SECONDS_PER_DAY]
+                )
+                self._write_day(
+                    series_dir, day, (seconds[lo:hi] - day_start).astype("<u4")
+                )
+
+        if len(chunks) == 0:
+            return pd.DatetimeIndex([])
+        seconds = np.unique(np.concatenate(chunks))
+        seconds = seconds[
+            (seconds >= epoch_seconds(start)) & (seconds <= epoch_seconds(end))
+        ]
+        return pd.DatetimeIndex(seconds.astype("datetime64[s]"))
+
+    def _write_day(self, series_dir, day, offsets):
+        """Write one day atomically so concurrent runs never see half a file."""
+        os.makedirs(series_dir, exist_ok=True)
+        path = os.path.join(series_dir, day.strftime("%Y-%m-%d") + ".bin")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(offsets.tobytes())
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        """Delete least recently used day files until under max_bytes."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        files = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir():
+                continue
+            for day_file in os.scandir(entry.path):
+                stat = day_file.stat()
+                files.append((stat.st_mtime, stat.st_size, day_file.path))
+                total += stat.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def report(self, metrics):
+        """Add the day hit/miss counters to a run's RunMetrics."""
+        metrics.increment("cache_day_hits", self.hits)
+        metrics.increment("cache_day_misses", self.misses)
+
+
+def _consecutive_runs(days):
+    """Group a sorted list of days into (first, last) runs of consecutive days."""
+    runs = []
+    for day in days:
+        if runs and day - runs[-1][1] == pd.Timedelta(days=1):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return [tuple(run) for run in runs]
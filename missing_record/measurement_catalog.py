@@ -0,0 +1,86 @@
+"""Index of which measurements each site actually has on the Hilltop server."""
+
+import pandas as pd
+from hilltoppy.utils import build_url, get_hilltop_xml
+
+
+def get_site_catalog(base_url, hts, site):
+    """Get the measurements a site has, with the span of their data.
+
+    Parameters
+    ----------
+    base_url : str
+        The base URL of the Hilltop server.
+    hts : str
+        The Hilltop Time Series (HTS) file.
+    site : str
+        The site name.
+
+    Returns
+    -------
+    dict
+        Maps "Measurement [DataSource]" names (as used in
+        Active_Measurements.csv) to (first, last) timestamps of the data.
+
+    Raises
+    ------
+    ValueError
+        If the server returns an error instead of a measurement list.
+    """
+    root = get_hilltop_xml(build_url(base_url, hts, "MeasurementList", site=site))
+    if root.find("Error") is not None:
+        raise ValueError(root.findtext("Error"))
+
+    catalog = {}
+    for data_source in root.findall("DataSource"):
+        # Only standard series are looked at by get_data
+        if data_source.findtext("TSType", "StdSeries") != "StdSeries":
+            continue
+        first = pd.Timestamp(data_source.findtext("From"))
+        last = pd.Timestamp(data_source.findtext("To"))
+        for measurement in data_source.findall("Measurement"):
+            request_as = measurement.findtext("RequestAs")
+            if request_as is not None:
+                catalog[request_as] = (first, last)
+    return catalog
+
+
+def build_catalog(executor, base_url, hts, site_names, metrics=None):
+    """Get the measurement catalog of every site, one request per site.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        Executor to run the requests on.
+    base_url : str
+        The base URL of the Hilltop server.
+    hts : str
+        The Hilltop Time Series (HTS) file.
+    site_names : list of str
+        The sites to look up.
+    metrics : RunMetrics, optional
+        Where to record the sites whose catalog couldn't be fetched.
+
+    Returns
+    -------
+    dict
+        Maps site names to their catalog (see get_site_catalog), or to None
+        if the catalog couldn't be fetched (an error from the server, or the
+        request failing), in which case every measurement should be tried
+        for that site.
+    """
+    futures = {
+        site: executor.submit(get_site_catalog, base_url, hts, site)
+        for site in site_names
+    }
+    catalog = {}
+    for site, future in futures.items():
+        # An error from the server, or a connection error or timeout (requests'
+        # errors are OSErrors), only costs that site its catalog
+        try:
+            catalog[site] = future.result()
+        except (ValueError, OSError) as e:
+            if metrics is not None:
+                metrics.failed("catalog", site, None, e)
+            catalog[site] = None
+    return catalog
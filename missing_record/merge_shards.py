@@ -0,0 +1,153 @@
+"""Combine the results of a sharded run into the outputs of a whole run.
+
+e.g. after ``generate(config, shard="1/4")`` to ``shard="4/4"`` have all
+finished, on one box or several sharing output_csv::
+
+    python -m missing_record.merge_shards config_files/script_config.yaml 4
+"""
+
+import argparse
+import os
+
+import pandas as pd
+import yaml
+
+import missing_record.site_list_merge as site_list_merge
+from missing_record.gap_index import GAPS_FILE
+from missing_record.generate_missing_data_csvs import write_results
+from missing_record.results import (
+    RESULTS_FILE,
+    ResultMatrix,
+    shard_file,
+    view_results_file,
+    window_file,
+)
+from missing_record.run_metrics import RunMetrics
+
+
+def read_shards(path, n_shards, window=None):
+    """Read a parquet output of every shard of a run.
+
+    Raises a ValueError naming the shards that haven't finished, so they can
+    be rerun on their own.
+    """
+    paths = [
+        window_file(shard_file(path, (i, n_shards)), window)
+        for i in range(1, n_shards + 1)
+    ]
+    missing = [
+        f"{i}/{n_shards}" for i, p in enumerate(paths, 1) if not os.path.exists(p)
+    ]
+    if missing:
+        raise ValueError(f"No results for shard {', '.join(missing)}, rerun them first")
+    return [pd.read_parquet(p) for p in paths]
+
+
+def shard_site_order(shard_frames):
+    """The whole run's site order, undoing generate()'s round robin split.
+
+    The i-th of N shards has every N-th site of the sorted list, starting
+    from the i-th.
+    """
+    shard_sites = [frame["site"].unique() for frame in shard_frames]
+    n_shards = len(shard_sites)
+    n_sites = sum(len(sites) for sites in shard_sites)
+    for i, sites in enumerate(shard_sites):
+        if len(sites) != len(range(i, n_sites, n_shards)):
+            raise ValueError(
+                f"Shard {i + 1}/{n_shards} has {len(sites)} sites, so the shards "
+                "aren't from the same site list"
+            )
+    return [shard_sites[p % n_shards][p // n_shards] for p in range(n_sites)]
+
+
+def merge(config_file_path, n_shards, windows=None, metrics=None, record_history=None):
+    """Combine the shards of a run into the same outputs as an unsharded run.
+
+    Parameters
+    ----------
+    config_file_path : str
+        The yaml config the shards were run with.
+    n_shards : int
+        How many shards the run was split into.
+    windows : dict, optional
+        The named report windows the shards were run with, as in generate().
+    metrics : RunMetrics, optional
+        Where to record how long the merge took.
+    record_history : bool, optional
+        Whether to upsert the results into the history table of the dev
+        database. Defaults to the config's record_history.
+
+    Returns
+    -------
+    pd.DataFrame or dict
+        The long format results, or a dict of them by name if windows is given,
+        as returned by generate().
+    """
+    if metrics is None:
+        metrics = RunMetrics()
+    with open(config_file_path) as file:
+        config = yaml.safe_load(file)
+    if windows is None:
+        windows = {None: (config["start"], config["end"])}
+        single_window = True
+    else:
+        windows = dict(windows)
+        single_window = False
+    coverage_views = config.get("coverage_views") or []
+
+    with metrics.stage("export"):
+        frames = {}
+        for name in windows:
+            shard_frames = read_shards(RESULTS_FILE, n_shards, name)
+            sites = shard_site_order(shard_frames)
+            results = pd.concat(shard_frames, ignore_index=True)
+            site_region = (
+                results.dropna(subset=["region"])
+                .drop_duplicates("site")
+                .set_index("site")["region"]
+                .to_dict()
+            )
+            view_results = {
+                view: ResultMatrix.from_frame(
+                    pd.concat(
+                        read_shards(view_results_file(view), n_shards, name),
+                        ignore_index=True,
+                    ),
+                    sites,
+                )
+                for view in coverage_views
+            }
+            gaps = None
+            if config.get("gap_index", False):
+                gaps = pd.concat(read_shards(GAPS_FILE, n_shards, name))
+                for column in ["start", "end"]:
+                    gaps[column] = gaps[column].astype("datetime64[s]").astype("int64")
+            frames[name] = write_results(
+                config,
+                ResultMatrix.from_frame(results, sites),
+                site_region,
+                view_results,
+                gaps,
+                window=name,
+            )
+
+    if record_history is None:
+        record_history = config.get("record_history", False)
+    if record_history:
+        with metrics.stage("history"):
+            engine = site_list_merge.connect_to_dev_db()
+            for name, (start, end) in windows.items():
+                site_list_merge.insert_history(frames[name], start, end, engine)
+
+    if single_window:
+        return frames[None]
+    return frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("config", help="the yaml config the shards were run with")
+    parser.add_argument("shards", type=int, help="how many shards the run had")
+    args = parser.parse_args()
+    merge(args.config, args.shards)
@@ -0,0 +1,323 @@
+"""Missing record results as dense site x column matrices of seconds."""
+
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+
+import missing_record.gaps as gaps
+
+# All results of a run, written by generate_missing_data_csvs and read by
+# generate_html
+RESULTS_FILE = "output_csv/results.parquet"
+
+
+def view_results_file(view):
+    """Where the results at a coverage view's resolution go, e.g. "15min"."""
+    root, extension = os.path.splitext(RESULTS_FILE)
+    return f"{root}_{view}{extension}"
+
+
+def window_file(path, window=None):
+    """An output path, moved into a directory of its own for a named window.
+
+    e.g. ``window_file("output_csv/output.csv", "weekly")`` is
+    ``output_csv/weekly/output.csv``. Paths are unchanged if window is None.
+    """
+    if window is None:
+        return path
+    directory, name = os.path.split(path)
+    return os.path.join(directory, window, name)
+
+
+def parse_shard(spec):
+    """A shard spec "i/N" as (i, N), i.e. the i-th of N shards, 1-based."""
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard should be i/N, e.g. 2/4, not '{spec}'") from None
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"Shard {spec} isn't one of 1/N to N/N")
+    return index, count
+
+
+def shard_file(path, shard=None):
+    """An output path, moved into the partial results of one shard of a run.
+
+    e.g. ``shard_file("output_csv/results.parquet", (2, 4))`` is
+    ``output_csv/shards/2-of-4/results.parquet``. Paths are unchanged if shard
+    is None.
+    """
+    if shard is None:
+        return path
+    directory, name = os.path.split(path)
+    return os.path.join(directory, "shards", f"{shard[0]}-of-{shard[1]}", name)
+
+
+class ResultMatrix:
+    """Missing and total seconds for every site and column (measurement/bucket).
+
+    Parameters
+    ----------
+    sites : list of str
+        Row labels.
+    columns : list of str
+        Column labels.
+    missing : np.ndarray
+        int64 [site x column] seconds of missing record.
+    total : np.ndarray
+        int64 [site x column] seconds of record that was asked for.
+    valid : np.ndarray
+        bool [site x column], False where there's no result (NaN).
+    """
+
+    def __init__(self, sites, columns, missing, total, valid):
+        self.sites = list(sites)
+        self.columns = list(columns)
+        self.missing = missing
+        self.total = total
+        self.valid = valid
+
+    @classmethod
+    def empty(cls, sites, columns):
+        """A matrix with no results in it yet."""
+        shape = (len(sites), len(columns))
+        return cls(
+            sites,
+            columns,
+            np.zeros(shape, dtype=np.int64),
+            np.zeros(shape, dtype=np.int64),
+            np.zeros(shape, dtype=bool),
+        )
+
+    @classmethod
+    def from_frame(cls, frame, sites=None):
+        """A matrix back from the long format frame of to_frame().
+
+        Parameters
+        ----------
+        frame : pd.DataFrame
+            With site, bucket, missing_seconds and total_seconds columns.
+        sites : list of str, optional
+            Row order, defaults to the order the sites first appear in.
+
+        Returns
+        -------
+        ResultMatrix
+        """
+        if sites is None:
+            sites = frame["site"].unique()
+        columns = frame["bucket"].unique()
+        result = cls.empty(sites, columns)
+        rows = pd.Index(result.sites).get_indexer(frame["site"])
+        cols = pd.Index(result.columns).get_indexer(frame["bucket"])
+        if (rows < 0).any():
+            raise ValueError("Results have sites that aren't in the site list")
+        missing = frame["missing_seconds"]
+        result.missing[rows, cols] = missing.fillna(0).to_numpy(dtype=np.int64)
+        result.total[rows, cols] = frame["total_seconds"].to_numpy(dtype=np.int64)
+        result.valid[rows, cols] = missing.notna().to_numpy()
+        return result
+
+    def by_bucket(self, column_buckets, buckets, methods=None, coverage=None):
+        """Combine measurement columns into their buckets.
+
+        Each bucket's measurements are combined by its method:
+
+        - "sum" (the default) adds up the missing time of the valid
+          measurements, and their total time.
+        - "max" takes the most missing time of any of them, and the longest
+          total time.
+        - "union" counts a bucket of time as missing only if every
+          measurement is missing there, from their coverage.
+
+        Missing time is NaN if none of a bucket's measurements are valid, and
+        total time is zero.
+
+        Parameters
+        ----------
+        column_buckets : list of str
+            The bucket of each column.
+        buckets : list of str
+            The bucket names, in output order.
+        methods : dict, optional
+            The method of each bucket, buckets not in it are summed.
+        coverage : dict, optional
+            (start, end, step, gaps) of each valid (site index, column index)
+            as taken by gaps.union_missing_groups, needed by "union" buckets.
+
+        Returns
+        -------
+        ResultMatrix
+            A [site x bucket] matrix.
+        """
+        methods = methods or {}
+        # One-hot [column x bucket] so the grouping is a matrix product
+        one_hot = (
+            np.array(column_buckets)[:, None] == np.array(buckets)[None, :]
+        ).astype(np.int64)
+        sources = self.valid.astype(np.int64) @ one_hot
+        missing = np.where(self.valid, self.missing, 0) @ one_hot
+        total = np.where(self.valid, self.total, 0) @ one_hot
+
+        for j, bucket in enumerate(buckets):
+            method = methods.get(bucket, "sum")
+            columns = np.flatnonzero(one_hot[:, j])
+            if method == "max" and len(columns) > 0:
+                missing[:, j] = np.where(
+                    self.valid[:, columns], self.missing[:, columns], 0
+                ).max(axis=1)
+                total[:, j] = np.where(
+                    self.valid[:, columns], self.total[:, columns], 0
+                ).max(axis=1)
+            elif method == "union":
+                # Every site's measurements at once, grouped by site
+                rows, cols = np.nonzero(self.valid[:, columns])
+                union_missing, union_total = gaps.union_missing_groups(
+                    [
+                        coverage[(i, c)]
+                        for (i, c) in zip(rows.tolist(), columns[cols].tolist())
+                    ],
+                    rows,
+                    len(self.sites),
+                )
+                has_sources = sources[:, j] > 0
+                missing[has_sources, j] = union_missing[has_sources]
+                total[has_sources, j] = union_total[has_sources]
+            elif method != "sum":
+                raise ValueError(f"Unknown aggregation '{method}' for {bucket}")
+
+        for i, j in zip(*np.nonzero(sources > 1), strict=True):
+            if methods.get(buckets[j], "sum") != "sum":
+                continue
+            in_bucket = self.valid[i] & (one_hot[:, j] == 1)
+            print("Multiple data sources in one bucket")
+            print(
+                self.sites[i],
+                buckets[j],
+                [_format_seconds(s) for s in self.missing[i, in_bucket]],
+            )
+
+        return ResultMatrix(self.sites, buckets, missing, total, sources > 0)
+
+    def select(self, sites=None, columns=None):
+        """A sub-matrix of the given sites/columns, in the order given.
+
+        Labels that aren't in the matrix are skipped.
+        """
+        site_index = (
+            list(range(len(self.sites)))
+            if sites is None
+            else [self.sites.index(s) for s in sites if s in self.sites]
+        )
+        column_index = (
+            list(range(len(self.columns)))
+            if columns is None
+            else [self.columns.index(c) for c in columns if c in self.columns]
+        )
+        rows = np.array(site_index, dtype=np.intp)[:, None]
+        cols = np.array(column_index, dtype=np.intp)[None, :]
+        return ResultMatrix(
+            [self.sites[i] for i in site_index],
+            [self.columns[j] for j in column_index],
+            self.missing[rows, cols],
+            self.total[rows, cols],
+            self.valid[rows, cols],
+        )
+
+    def to_frame(self):
+        """Long format (site, bucket, missing_seconds, total_seconds) frame.
+
+        Rows are in site order then column order. missing_seconds is a
+        nullable Int64, <NA> where there's no result.
+        """
+        return pd.DataFrame(
+            {
+                "site": np.repeat(self.sites, len(self.columns)),
+                "bucket": np.tile(self.columns, len(self.sites)),
+                "missing_seconds": pd.arrays.IntegerArray(
+                    self.missing.ravel().copy(), ~self.valid.ravel()
+                ),
+                "total_seconds": self.total.ravel(),
+            }
+        )
+
+    def missing_sum(self):
+        """Total missing seconds over all valid cells."""
+        return int(np.where(self.valid, self.missing, 0).sum())
+
+    def total_sum(self):
+        """Total seconds of record over all cells."""
+        return int(self.total.sum())
+
+    def write_csv(self, output_file, output_as_percent=False):
+        """Write the matrix and its totals twin (*_totals.csv) as CSVs.
+
+        Values are written as timedelta strings (e.g. "0 days 05:00:00"), or
+        as percentages of the total if output_as_percent. NaN cells are
+        written as "nan".
+        """
+        with open(output_file, "w", newline="", encoding="utf-8") as output:
+            wr = csv.writer(output)
+            wr.writerow(["Sites"] + self.columns)
+            for i, site in enumerate(self.sites):
+                if output_as_percent:
+                    row = [
+                        (missing / total) * 100 if valid else np.nan
+                        for (missing, total, valid) in zip(
+                            self.missing[i].tolist(),
+                            self.total[i].tolist(),
+                            self.valid[i],
+                            strict=True,
+                        )
+                    ]
+                else:
+                    row = [
+                        _format_seconds(missing) if valid else np.nan
+                        for (missing, valid) in zip(
+                            self.missing[i].tolist(), self.valid[i], strict=True
+                        )
+                    ]
+                wr.writerow([site] + row)
+        with open(
+            output_file[:-4] + "_totals" + output_file[-4:],
+            "w",
+            newline="",
+            encoding="utf-8",
+        ) as output:
+            wr = csv.writer(output)
+            wr.writerow(["Sites"] + self.columns)
+            for i, site in enumerate(self.sites):
+                wr.writerow([site] + [_format_seconds(t) for t in self.total[i]])
+
+
+def write_annex_totals(output_file, annexes):
+    """Write the network-wide missing totals for each annex.
+
+    Parameters
+    ----------
+    output_file : str
+        The CSV to write.
+    annexes : list of ResultMatrix
+        Annex 1, 2 and 3, in that order.
+    """
+    numerators = [annex.missing_sum() for annex in annexes]
+    denominators = [annex.total_sum() for annex in annexes]
+    with open(output_file, "w", newline="", encoding="utf-8") as output:
+        wr = csv.writer(output)
+        wr.writerow(["\\", "annex_1", "annex_2", "annex_3"])
+        wr.writerow(["Total"] + [_format_seconds(n) for n in numerators])
+        wr.writerow(
+            ["Percentage"]
+            + [
+                n / d * 100 if d > 0 else "None"
+                for (n, d) in zip(numerators, denominators, strict=True)
+            ]
+        )
+        wr.writerow(["Length of record"] + [_format_seconds(d) for d in denominators])
+
+
+def _format_seconds(seconds):
+    """Seconds as a pandas timedelta string, e.g. "1 days 02:00:00"."""
+    return str(pd.Timedelta(seconds=int(seconds)))
@@ -0,0 +1,317 @@
+"""Timings and counters of a run, written as a json report and a Prometheus textfile."""
+
+import contextlib
+import datetime
+import json
+import os
+import threading
+import time
+
+REPORT_FILE = "output_csv/run_report.json"
+PROMETHEUS_FILE = "output_csv/missing_record.prom"
+
+# Per-pair values that are added up over every request the pair makes
+PAIR_TOTALS = ["requests", "response_bytes", "fetch_seconds", "parse_seconds"]
+
+
+class RunMetrics:
+    """Collects stage timings, per site/measurement pair metrics and counters.
+
+    Everything done inside pair() on a thread is put down to that pair, so
+    the fetch functions only need to call add() and don't have to know which
+    pair they're working for.
+
+    Parameters
+    ----------
+    progress : callable, optional
+        Called with each progress message of the run, e.g. as each site
+        finishes. Defaults to print, None for a quiet run.
+    """
+
+    def __init__(self, progress=print):
+        self.started = datetime.datetime.now()
+        self._start_wall = time.perf_counter()
+        self.stages = {}
+        self.pairs = []
+        self.counters = {}
+        self.failures = []
+        self.sites = []
+        self.progress_hook = progress
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a stage of the run (wall and CPU time).
+
+        A stage that's done more than once, e.g. the html of each window of a
+        run, gets the total of its times.
+        """
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                stage = self.stages.setdefault(
+                    name, {"wall_seconds": 0.0, "cpu_seconds": 0.0}
+                )
+                stage["wall_seconds"] += time.perf_counter() - wall
+                stage["cpu_seconds"] += time.process_time() - cpu
+
+    @contextlib.contextmanager
+    def pair(self, site, measurement):
+        """Record the work done for one site/measurement pair on this thread.
+
+        Yields the pair's record, whose "outcome" should be set to "data" or
+        "empty". It is set to "error" if an exception escapes.
+        """
+        record = {"site": site, "measurement": measurement, "outcome": None}
+        record.update({key: 0 for key in PAIR_TOTALS})
+        self._local.record = record
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception:
+            record["outcome"] = "error"
+            raise
+        finally:
+            self._local.record = None
+            record["total_seconds"] = time.perf_counter() - start
+            # Everything that isn't a request or parsing xml: counting gaps
+            # and reading/writing the cache and coverage store
+            record["compute_seconds"] = max(
+                0.0,
+                record["total_seconds"]
+                - record["fetch_seconds"]
+                - record["parse_seconds"],
+            )
+            with self._lock:
+                self.pairs.append(record)
+
+    def add(self, **values):
+        """Add values (e.g. fetch_seconds=0.2) to the pair this thread is on."""
+        record = getattr(self._local, "record", None)
+        if record is None:
+            return
+        for key, value in values.items():
+            record[key] += value
+
+    @contextlib.contextmanager
+    def timer(self, key):
+        """Add the time taken inside the block to the current pair's key."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(**{key: time.perf_counter() - start})
+
+    def request_hooks(self):
+        """requests hooks that count each response against the current pair."""
+
+        def count_response(response, *args, **kwargs):
+            self.add(requests=1, response_bytes=len(response.content))
+
+        return {"response": count_response}
+
+    def progress(self, message):
+        """Pass a progress message to the progress hook."""
+        if self.progress_hook is not None:
+            self.progress_hook(message)
+
+    def site_done(self, site, seconds):
+        """Record that every pair of a site is in, seconds into the pairs stage."""
+        with self._lock:
+            self.sites.append({"site": site, "done_seconds": seconds})
+        self.progress(f"{site} {seconds:.2f}s")
+
+    def failed(self, stage, site, measurement, error):
+        """Record an error the run carried on from, e.g. a pair that doesn't work.
+
+        Parameters
+        ----------
+        stage : str
+            Where it happened, e.g. "pairs" or "catalog".
+        site, measurement : str or None
+            What it happened to, None if it wasn't down to one.
+        error : Exception
+            The error, counted by its type.
+        """
+        with self._lock:
+            self.failures.append(
+                {
+                    "stage": stage,
+                    "site": site,
+                    "measurement": measurement,
+                    "error": type(error).__name__,
+                    "message": str(error),
+                }
+            )
+
+    def failure_counts(self):
+        """Number of failures by (stage, error type)."""
+        counts = {}
+        with self._lock:
+            for failure in self.failures:
+                key = (failure["stage"], failure["error"])
+                counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def summary(self):
+        """One line summing up the run so far, for the console."""
+        outcomes = {}
+        with self._lock:
+            for record in self.pairs:
+                outcomes[record["outcome"]] = outcomes.get(record["outcome"], 0) + 1
+            counters = dict(self.counters)
+        parts = [
+            f"{len(self.pairs)} pairs in"
+            f" {time.perf_counter() - self._start_wall:.1f}s"
+            + "".join(f", {n} {outcome}" for (outcome, n) in sorted(outcomes.items()))
+        ]
+        failures = self.failure_counts()
+        if failures:
+            parts.append(
+                "failed: "
+                + ", ".join(
+                    f"{n} {stage} {error}"
+                    for ((stage, error), n) in sorted(failures.items())
+                )
+            )
+        if counters:
+            parts.append(
+                ", ".join(f"{name} {value}" for (name, value) in counters.items())
+            )
+        return "; ".join(parts)
+
+    def increment(self, name, amount=1):
+        """Add to a run-wide counter, e.g. emails sent."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def _slowest(self, frame, by, n=10):
+        if frame.empty:
+            return []
+        totals = frame.groupby(by)["total_seconds"].sum().nlargest(n)
+        return [{by: key, "total_seconds": value} for (key, value) in totals.items()]
+
+    def report(self):
+        """The whole run as a json-able dict."""
+        # Only needed here, so runs that never report don't pay for the import
+        import pandas as pd
+
+        pairs = pd.DataFrame(
+            self.pairs,
+            columns=["site", "measurement", "outcome", "total_seconds"]
+            + PAIR_TOTALS
+            + ["compute_seconds"],
+        )
+        return {
+            "started": self.started.isoformat(),
+            "duration_seconds": time.perf_counter() - self._start_wall,
+            "stages": self.stages,
+            "counters": self.counters,
+            "failure_counts": [
+                {"stage": stage, "error": error, "count": n}
+                for ((stage, error), n) in self.failure_counts().items()
+            ],
+            "failures": self.failures,
+            "outcomes": {
+                outcome: int(n)
+                for (outcome, n) in pairs["outcome"].value_counts().items()
+            },
+            "totals": {key: pairs[key].sum().item() for key in PAIR_TOTALS},
+            "slowest_sites": self._slowest(pairs, "site"),
+            "slowest_measurements": self._slowest(pairs, "measurement"),
+            "slowest_pairs": pairs.nlargest(10, "total_seconds")[
+                ["site", "measurement", "total_seconds"]
+            ].to_dict("records"),
+            "sites": self.sites,
+            "pairs": pairs.to_dict("records"),
+        }
+
+    def write(self, report_file=REPORT_FILE, prometheus_file=PROMETHEUS_FILE):
+        """Write the json run report and the Prometheus textfile."""
+        report = self.report()
+        with open(report_file, "w") as f:
+            json.dump(report, f, indent=2)
+        _write_atomic(prometheus_file, _prometheus_text(report))
+
+
+def _prometheus_text(report):
+    """The run report in the Prometheus text exposition format."""
+    lines = []
+
+    def metric(name, help_text, samples):
+        lines.append(f"# HELP missing_record_{name} {help_text}")
+        lines.append(f"# TYPE missing_record_{name} gauge")
+        for labels, value in samples:
+            label_text = ",".join(
+                f'{key}="{_escape(value)}"' for (key, value) in labels.items()
+            )
+            label_text = f"{{{label_text}}}" if label_text else ""
+            lines.append(f"missing_record_{name}{label_text} {float(value)}")
+
+    metric(
+        "last_run_timestamp_seconds",
+        "When the run started.",
+        [({}, datetime.datetime.fromisoformat(report["started"]).timestamp())],
+    )
+    metric(
+        "run_duration_seconds",
+        "Wall time of the whole run.",
+        [({}, report["duration_seconds"])],
+    )
+    metric(
+        "stage_duration_seconds",
+        "Wall time of each stage.",
+        [({"stage": s}, v["wall_seconds"]) for (s, v) in report["stages"].items()],
+    )
+    metric(
+        "stage_cpu_seconds",
+        "CPU time of each stage.",
+        [({"stage": s}, v["cpu_seconds"]) for (s, v) in report["stages"].items()],
+    )
+    metric(
+        "pairs",
+        "Site/measurement pairs by outcome.",
+        [({"outcome": o}, n) for (o, n) in report["outcomes"].items()],
+    )
+    metric(
+        "failures",
+        "Errors the run carried on from, by stage and error type.",
+        [
+            ({"stage": f["stage"], "error": f["error"]}, f["count"])
+            for f in report["failure_counts"]
+        ],
+    )
+    for key, value in report["totals"].items():
+        metric(key, f"Total {key.replace('_', ' ')} over every pair.", [({}, value)])
+    for key, value in report["counters"].items():
+        metric(key, f"Number of {key.replace('_', ' ')}.", [({}, value)])
+    metric(
+        "site_seconds",
+        "Time spent on the slowest sites.",
+        [({"site": s["site"]}, s["total_seconds"]) for s in report["slowest_sites"]],
+    )
+    metric(
+        "measurement_seconds",
+        "Time spent on the slowest measurements.",
+        [
+            ({"measurement": m["measurement"]}, m["total_seconds"])
+            for m in report["slowest_measurements"]
+        ],
+    )
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _write_atomic(path, text):
+    """Write a file atomically, so the textfile collector never reads half of it."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -1,7 +1,12 @@
 """Send an email with the given html content."""
 
+import email.policy
+import functools
 import os
+import queue
 import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import time
@@ -10,66 +15,226 @@ import shutil
 import yaml
 from dotenv import load_dotenv
 
-# Load the environment variables
-load_dotenv()
-
-# Get the email credentials
-EMAIL_SERVER = os.getenv("EMAIL_SERVER")
-EMAIL_ADDRESS = os.getenv("EMAIL_ADDRESS")
-try:
-    path = os.getenv("EMAIL_SERVER_CONFIG_PATH")
-    with open(path) as file:
-        lines = [line.rstrip() for line in file]
-    EMAIL_PASSWORD = lines[1]
-except FileNotFoundError:
-    EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
-EMAIL_RECIPIENT = os.getenv("EMAIL_RECIPIENT")
-
-
-def send_email(recipient, subject, html_content):
-    """Send an email with the given html content."""
-    # Create a multipart message
-    msg = MIMEMultipart("alternative")
-    # Set the sender and recipient
-    msg["From"] = EMAIL_ADDRESS
+from missing_record.run_metrics import RunMetrics
+
+
+@functools.lru_cache
+def email_settings():
+    """The email server and credentials from the environment (and .env file).
+
+    Read on first use rather than on import, so the commands that don't send
+    anything don't need them.
+    """
+    load_dotenv()
+    try:
+        path = os.getenv("EMAIL_SERVER_CONFIG_PATH")
+        with open(path) as file:
+            lines = [line.rstrip() for line in file]
+        password = lines[1]
+    except (TypeError, FileNotFoundError):
+        # No password file set, or it isn't there
+        password = os.getenv("EMAIL_PASSWORD")
+    return {
+        "server": os.getenv("EMAIL_SERVER"),
+        "address": os.getenv("EMAIL_ADDRESS"),
+        "password": password,
+        "port": int(os.getenv("EMAIL_PORT") or 587),
+        # Set to false for a local test server that doesn't do TLS
+        "starttls": (os.getenv("EMAIL_STARTTLS") or "true").lower() != "false",
+        # Number of emails per minute, and how many can go out back to back
+        "rate_per_minute": float(os.getenv("EMAIL_RATE_PER_MINUTE") or 2),
+        "burst": int(os.getenv("EMAIL_BURST") or 1),
+        # Number of SMTP sessions sending at once
+        "connections": int(os.getenv("EMAIL_CONNECTIONS") or 1),
+    }
+
+
+class TokenBucket:
+    """Rate limiter allowing bursts of ``capacity`` calls, refilled at ``rate``.
+
+    Parameters
+    ----------
+    rate : float
+        Tokens added per second.
+    capacity : int
+        Most tokens that can be saved up.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting for one if there are none left."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.last) * self.rate
+            )
+            self.last = now
+            self.tokens -= 1
+            # Reserve the token now, and wait out the debt outside the lock
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class SMTPPool:
+    """Authenticated SMTP sessions that are reused for every email.
+
+    Sessions are opened when first needed, reopened if the server drops
+    them, and all closed by close().
+
+    Parameters
+    ----------
+    size : int
+        Number of sessions.
+    host : str
+        The SMTP server.
+    port : int
+        The SMTP port.
+    starttls : bool
+        Whether to upgrade the sessions with STARTTLS.
+    user, password : str
+        Login credentials, no login if password is empty.
+    """
+
+    def __init__(self, size, host, port, starttls, user, password):
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.user = user
+        self.password = password
+        self._idle = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(None)
+        self._sessions = []
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port)
+        if self.starttls:
+            smtp.starttls()
+        if self.password:
+            smtp.login(self.user, self.password)
+        self._sessions.append(smtp)
+        return smtp
+
+    def sendmail(self, sender, recipient, message):
+        """Send one message on the next free session."""
+        smtp = self._idle.get()
+        try:
+            if smtp is None:
+                smtp = self._connect()
+            try:
+                smtp.sendmail(sender, recipient, message)
+            except smtplib.SMTPServerDisconnected:
+                smtp = self._connect()
+                smtp.sendmail(sender, recipient, message)
+        finally:
+            self._idle.put(smtp)
+
+    def close(self):
+        """Log out of every session that was opened."""
+        for smtp in self._sessions:
+            try:
+                smtp.quit()
+            except smtplib.SMTPException:
+                smtp.close()
+        self._sessions = []
+
+
+def build_message(subject, html_content):
+    """Render a message to everyone in a recipient group.
+
+    Returns
+    -------
+    (str, MIMEText)
+        The subject and the html part, which is encoded once and shared by
+        the message send_email makes for each address.
+    """
+    return subject, MIMEText(html_content, "html")
+
+
+def address_message(subject, body, recipient):
+    """The message to one address, with the html part of build_message."""
+    # The SMTP policy encodes the headers and ends every line with CRLF
+    msg = MIMEMultipart("alternative", policy=email.policy.SMTP)
+    msg["From"] = email_settings()["address"]
     msg["To"] = recipient
     msg["Subject"] = subject
-    # Read the html file
+    msg.attach(body)
+    return msg.as_string()
 
-    msg.attach(MIMEText(html_content, "html"))
 
-    # Connect to the SMTP server using STARTTLS
-    with smtplib.SMTP(EMAIL_SERVER, 587) as smtp:
-        smtp.starttls()
-        smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-        smtp.sendmail(EMAIL_ADDRESS, recipient, msg.as_string())
-    print(f"Sent to {recipient}, next email sending in 30 seconds...")
-    time.sleep(30)
+def send_email(pool, limiter, recipient, message, metrics=None):
+    """Send a message built by build_message to one address."""
+    message = address_message(*message, recipient)
+    limiter.acquire()
+    pool.sendmail(email_settings()["address"], recipient, message)
+    if metrics is not None:
+        metrics.increment("emails_sent")
+        metrics.increment("email_bytes", len(message))
+    print(f"Sent to {recipient}")
 
 
-def send(message="", title=""):
+def send(message="", title="", metrics=None, html_dir="output_html"):
     with open("config_files/recipients.yaml") as file:
         sending_list = yaml.safe_load(file)
 
-    for recipient in sending_list:
-        html_content = message
-        for suffix in sending_list[recipient]["file_suffix"]:
-            with open(f"output_html/output{suffix}.html") as html_file:
-                html_content += html_file.read()
-        for address in os.getenv(recipient).split(","):
-            print(address)
-            send_email(
-                address, sending_list[recipient]["title_prefix"] + title, html_content
-            )
+    if metrics is None:
+        metrics = RunMetrics()
+    settings = email_settings()
+    pool = SMTPPool(
+        settings["connections"],
+        settings["server"],
+        settings["port"],
+        settings["starttls"],
+        settings["address"],
+        settings["password"],
+    )
+    limiter = TokenBucket(settings["rate_per_minute"] / 60, settings["burst"])
+    with metrics.stage("email"):
+        try:
+            with ThreadPoolExecutor(max_workers=settings["connections"]) as executor:
+                futures = []
+                for recipient in sending_list:
+                    html_content = message
+                    for suffix in sending_list[recipient]["file_suffix"]:
+                        with open(f"{html_dir}/output{suffix}.html") as html_file:
+                            html_content += html_file.read()
+                    group_message = build_message(
+                        sending_list[recipient]["title_prefix"] + title, html_content
+                    )
+                    for address in os.getenv(recipient).split(","):
+                        futures.append(
+                            executor.submit(
+                                send_email,
+                                pool,
+                                limiter,
+                                address.strip(),
+                                group_message,
+                                metrics,
+                            )
+                        )
+                for future in futures:
+                    future.result()
+        finally:
+            pool.close()
     print("Email(s) sent successfully!")
 
 
-def copy_files(destination):
-    with open("config_files/recipients.yaml") as file:
-        sending_list = yaml.safe_load(file)
-    for recipient in sending_list:
-        for suffix in sending_list[recipient]["file_suffix"]:
-            shutil.copy(f"output_html/output{suffix}.html", destination)
+def copy_files(destination, metrics=None, html_dir="output_html"):
+    if metrics is None:
+        metrics = RunMetrics()
+    with metrics.stage("copy"):
+        with open("config_files/recipients.yaml") as file:
+            sending_list = yaml.safe_load(file)
+        for recipient in sending_list:
+            for suffix in sending_list[recipient]["file_suffix"]:
+                shutil.copy(f"{html_dir}/output{suffix}.html", destination)
 
     print("Files copied!")
 
@@ -1,22 +1,74 @@
 """Script for merging site list from SQL query with that from Hilltop Server."""
 
+import functools
+import hashlib
 import platform
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 import pandas as pd
 import sqlalchemy as db
-from sqlalchemy.engine import URL
+from sqlalchemy.engine import URL, make_url
 
-# Load the environment variables
-load_dotenv()
 
-# Get the database details
-DB_HOST_WIN = os.getenv("DB_HOST_WIN")
-DB_HOST_LIN = os.getenv("DB_HOST_LIN")
-DB_NAME = os.getenv("DB_NAME")
-DB_DRIVER = os.getenv("DB_DRIVER")
-DB_DEV_HOST = os.getenv("DB_DEV_HOST")
+@functools.lru_cache
+def db_settings():
+    """The database details from the environment (and .env file), read on first use."""
+    load_dotenv()
+    return {
+        "host_win": os.getenv("DB_HOST_WIN"),
+        "host_lin": os.getenv("DB_HOST_LIN"),
+        "name": os.getenv("DB_NAME"),
+        "driver": os.getenv("DB_DRIVER"),
+        "dev_host": os.getenv("DB_DEV_HOST"),
+        # Full SQLAlchemy URLs to use instead, e.g. sqlite:///test.db for testing
+        "url": os.getenv("DB_URL"),
+        "dev_url": os.getenv("DB_DEV_URL"),
+    }
+
+
+# Engines by URL, shared by every caller so their connections are pooled
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(url):
+    """The engine for a database URL, made on first use and shared after that.
+
+    Connections are pooled by the engine and pinged before they're handed
+    out, so one the server has dropped is replaced rather than failing.
+    pyodbc engines send executemany parameters in bulk (fast_executemany).
+
+    Parameters
+    ----------
+    url : str or sqlalchemy.engine.URL
+        Which database, e.g. "sqlite:///test.db".
+
+    Returns
+    -------
+    sqlalchemy.engine.base.Engine
+    """
+    if isinstance(url, URL):
+        key = url.render_as_string(hide_password=False)
+    else:
+        key = str(url)
+    options = {"pool_pre_ping": True}
+    if make_url(url).get_driver_name() == "pyodbc":
+        options["fast_executemany"] = True
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = db.create_engine(url, **options)
+        return _engines[key]
+
+
+def dispose_engines():
+    """Close every pooled connection and forget the engines."""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
 
 
 def connect_to_db():
@@ -26,20 +78,22 @@ def connect_to_db():
     sqlalchemy.engine.base.Connection
         A connection to the Hilltop database.
     """
+    settings = db_settings()
+    if settings["url"]:
+        return get_engine(settings["url"])
     if platform.system() == "Windows":
-        hostname = DB_HOST_WIN
+        hostname = settings["host_win"]
     elif platform.system() == "Linux":
-        hostname = DB_HOST_LIN
+        hostname = settings["host_lin"]
     else:
         raise OSError("What is this, a mac? We don't do that here.")
     connection_url = URL.create(
         "mssql+pyodbc",
         host=hostname,
-        database=DB_NAME,
-        query={"driver": DB_DRIVER},
+        database=settings["name"],
+        query={"driver": settings["driver"]},
     )
-    engine = db.create_engine(connection_url)
-    return engine
+    return get_engine(connection_url)
 
 
 def connect_to_dev_db():
@@ -49,46 +103,112 @@ def connect_to_dev_db():
     sqlalchemy.engine.base.Engine
         A connection to the Hilltop database.
     """
+    settings = db_settings()
+    if settings["dev_url"]:
+        return get_engine(settings["dev_url"])
     if platform.system() == "Windows":
-        hostname = DB_DEV_HOST
+        hostname = settings["dev_host"]
     else:
         raise OSError("What is this, a mac? We don't do that here.")
     connection_url = URL.create(
         "mssql+pyodbc",
         host=hostname,
         database="Piri",
-        query={"driver": DB_DRIVER},
+        query={"driver": settings["driver"]},
+    )
+    return get_engine(connection_url)
+
+
+@functools.lru_cache
+def read_query(query_file):
+    """The text of a .sql file, read once."""
+    with open(query_file) as f:
+        return f.read()
+
+
+def read_sql_cached(query_file, engine, cache_dir=None, ttl_hours=0):
+    """Run a query file, keeping the result in cache_dir for ttl_hours.
+
+    Repeated (and sharded) runs inside the ttl read the local copy instead
+    of querying the database. The copy is keyed on the database and the
+    query, so changing either gets a fresh result.
+
+    Parameters
+    ----------
+    query_file : str
+        The .sql file to run.
+    engine : sqlalchemy.engine.base.Engine
+        Where to run it.
+    cache_dir : str, optional
+        Where to keep results, no caching if not given.
+    ttl_hours : float, optional
+        How long a result is good for, no caching if 0.
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    query = read_query(query_file)
+    if not cache_dir or not ttl_hours:
+        return pd.read_sql(query, engine)
+    key = "|".join([engine.url.render_as_string(hide_password=True), query])
+    path = os.path.join(
+        cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + ".parquet"
     )
-    engine = db.create_engine(connection_url)
-    return engine
+    if os.path.exists(path) and time.time() - os.path.getmtime(path) < (
+        ttl_hours * 3600
+    ):
+        return pd.read_parquet(path)
+    result = pd.read_sql(query, engine)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    result.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return result
 
 
-def get_sites(engine):
+def get_sites(engine, cache_dir=None, ttl_hours=0):
     """
     Gives sites to check for missing data.
 
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.base.Engine
+        The Hilltop database.
+    cache_dir : str, optional
+        Where to keep a local copy of the site list.
+    ttl_hours : float, optional
+        How long the local copy is used for before querying again.
+
     Returns
     -------
     pd.Dataframe
         All relevant sites + id + region
     """
-    with open("sql_queries/get_sites.sql") as f:
-        query = f.read()
-        return pd.read_sql(query, engine)
+    return read_sql_cached("sql_queries/get_sites.sql", engine, cache_dir, ttl_hours)
 
 
-def get_measurements(engine):
+def get_measurements(engine, cache_dir=None, ttl_hours=0):
     """
     Gives measurements to check for missing data.
 
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.base.Engine
+        The Hilltop database.
+    cache_dir : str, optional
+        Where to keep a local copy of the measurement list.
+    ttl_hours : float, optional
+        How long the local copy is used for before querying again.
+
     Returns
     -------
     pd.Dataframe
         All measurements with data sources
     """
-    with open("sql_queries/get_measurements.sql") as f:
-        query = f.read()
-        measurement_list = pd.read_sql(query, engine)
+    measurement_list = read_sql_cached(
+        "sql_queries/get_measurements.sql", engine, cache_dir, ttl_hours
+    )
     measurement_list["MeasurementFullName"] = (
         measurement_list["MeasurementName"]
         + " ["
@@ -99,14 +219,63 @@ def get_measurements(engine):
 
 
 def insert_missing_totals(missing_dict, engine):
-    with open("sql_queries/insert_missing.sql") as f:
-        query = f.read()
+    query = read_query("sql_queries/insert_missing.sql")
     with engine.begin() as conn:
         conn.execute(db.text(query), missing_dict)
 
 
 def insert_recorded_totals(totals_dict, engine):
-    with open("sql_queries/insert_total.sql") as f:
-        query = f.read()
+    query = read_query("sql_queries/insert_total.sql")
     with engine.begin() as conn:
         conn.execute(db.text(query), totals_dict)
+
+
+def insert_history(results, window_start, window_end, engine, batch_size=1000):
+    """Upsert the per site/bucket results of a run into the history table.
+
+    Rows are keyed on (site, bucket, window), and a rerun of a window
+    replaces its rows. Every row is written in one transaction, in batched
+    executemany calls.
+
+    Parameters
+    ----------
+    results : pd.DataFrame
+        Long format results, as returned by generate_missing_data_csvs.
+    window_start, window_end : str or pd.Timestamp
+        The window the results are for.
+    engine : sqlalchemy.engine.base.Engine
+        The database with the Missing_record_history table.
+    batch_size : int, optional
+        Rows per executemany call.
+    """
+    delete_query = db.text(read_query("sql_queries/delete_history.sql"))
+    insert_query = db.text(read_query("sql_queries/insert_history.sql"))
+    window_start = pd.Timestamp(window_start).to_pydatetime()
+    window_end = pd.Timestamp(window_end).to_pydatetime()
+    recorded_at = pd.Timestamp.now().floor("s").to_pydatetime()
+    rows = [
+        {
+            "site": str(site),
+            "bucket": str(bucket),
+            "region": None if pd.isna(region) else str(region),
+            "window_start": window_start,
+            "window_end": window_end,
+            # No result is a NULL
+            "missing_seconds": None if pd.isna(missing) else int(missing),
+            "total_seconds": None if pd.isna(total) else int(total),
+            "recorded_at": recorded_at,
+        }
+        for (site, bucket, region, missing, total) in zip(
+            results["site"],
+            results["bucket"],
+            results["region"],
+            results["missing_seconds"],
+            results["total_seconds"],
+        )
+    ]
+    keys = ["site", "bucket", "window_start", "window_end"]
+    with engine.begin() as conn:
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i : i + batch_size]
+            conn.execute(delete_query, [{k: row[k] for k in keys} for row in batch])
+            conn.execute(insert_query, batch)
@@ -0,0 +1,122 @@
+"""Manual site open/close dates, indexed by site and measurement."""
+
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+
+class OverrideIndex:
+    """Sorted override datetimes for each (site, measurement) pair.
+
+    Parameters
+    ----------
+    frame : pd.DataFrame
+        Overrides with "Site", "Measurement" and parsed "Datetime" columns.
+    """
+
+    def __init__(self, frame):
+        self.index = {
+            key: np.sort(group["Datetime"].to_numpy(dtype="datetime64[ns]"))
+            for key, group in frame.groupby(["Site", "Measurement"], sort=False)
+        }
+
+    @classmethod
+    def load(cls, path, cache_dir=None):
+        """Load an override CSV, going through a local copy if possible.
+
+        The local copy is keyed on the modification time and size of the
+        file, so the (slow) share is only read when the file has changed.
+        If the share can't be reached at all the local copy is used as is.
+
+        Parameters
+        ----------
+        path : str
+            The override CSV, with Site, Measurement and Datetime columns
+            (Datetime as dd/mm/yyyy HH:MM).
+        cache_dir : str, optional
+            Directory to keep the local copy in. No local copy if None.
+
+        Returns
+        -------
+        OverrideIndex
+        """
+        if cache_dir is None:
+            return cls(_read_override_csv(path))
+
+        cache_path = os.path.join(cache_dir, os.path.basename(path) + ".pkl")
+        try:
+            stat = os.stat(path)
+        except OSError:
+            if os.path.exists(cache_path):
+                print(f"Can't reach {path}, using the local copy")
+                with open(cache_path, "rb") as f:
+                    return pickle.load(f)["overrides"]
+            raise
+        key = (stat.st_mtime_ns, stat.st_size)
+
+        if os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                cached = pickle.load(f)
+            if cached["key"] == key:
+                return cached["overrides"]
+
+        overrides = cls(_read_override_csv(path))
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path, "wb") as f:
+            pickle.dump({"key": key, "overrides": overrides}, f)
+        return overrides
+
+    def between(self, site, measurement, start, end):
+        """Override datetimes strictly between start and end.
+
+        Parameters
+        ----------
+        site, measurement : str
+            The pair to look up.
+        start, end : str or pd.Timestamp
+            The window.
+
+        Returns
+        -------
+        list of pd.Timestamp
+        """
+        datetimes = self.index.get((site, measurement))
+        if datetimes is None:
+            return []
+        lo = np.searchsorted(datetimes, np.datetime64(pd.Timestamp(start)), "right")
+        hi = np.searchsorted(datetimes, np.datetime64(pd.Timestamp(end)), "left")
+        return [pd.Timestamp(d) for d in datetimes[lo:hi]]
+
+    def check_unique(self, start, end, kind):
+        """Raise if any pair has more than one override in the window.
+
+        Parameters
+        ----------
+        start, end : str or pd.Timestamp
+            The window of the run.
+        kind : str
+            What the overrides are ("start" or "end"), for the error message.
+
+        Raises
+        ------
+        Exception
+            Listing every pair with more than one override in the window.
+        """
+        duplicated = [
+            f"site={site}, meas={measurement}"
+            for (site, measurement) in self.index
+            if len(self.between(site, measurement, start, end)) > 1
+        ]
+        if len(duplicated) > 0:
+            raise Exception(
+                f"Multiple {kind} dates in config between {start} and {end}, should"
+                f" be max 1, for: {'; '.join(duplicated)}."
+            )
+
+
+def _read_override_csv(path):
+    frame = pd.read_csv(path)
+    frame["Datetime"] = pd.to_datetime(frame["Datetime"], format="%d/%m/%Y %H:%M")
+    return frame
@@ -1,6 +1,9 @@
 """General utilities."""
 
+import functools
+
 import matplotlib
+import numpy as np
 import pandas as pd
 
 
@@ -37,6 +40,26 @@ def get_hex_colour(normval, cmap="jet", invert=False, baw=False):
         hex_color = invert_colour(hex_color, baw=baw)
     return hex_color
 
+
+@functools.lru_cache
+def hex_colour_lut(cmap="jet"):
+    """Return every colour of a matplotlib named cmap as hex.
+
+    Parameters
+    ----------
+    cmap : str, optional
+        The name of the matplotlib colormap to use, by default "jet".
+
+    Returns
+    -------
+    np.ndarray
+        The colormap.N hex colour strings, from the bottom of the colormap
+        to the top.
+    """
+    colormap = matplotlib.colormaps.get(cmap)
+    return np.array([matplotlib.colors.rgb2hex(colormap(i)) for i in range(colormap.N)])
+
+
 def invert_colour(hex_color, hsv=False, baw=False):
     """Invert a color from its hex code.
 
@@ -102,3 +125,21 @@ def invert_colour(hex_color, hsv=False, baw=False):
     i_b = hex(255 - b)[2:].zfill(2)
 
     return f"#{i_r}{i_g}{i_b}"
+
+
+def epoch_seconds(timestamps):
+    """Convert naive datetime(s) to int64 seconds since the epoch.
+
+    Parameters
+    ----------
+    timestamps : pd.Timestamp or array-like of datetimes
+        The time(s) to convert.
+
+    Returns
+    -------
+    int or np.ndarray
+        Seconds since 1970-01-01, an int for a single Timestamp.
+    """
+    if isinstance(timestamps, pd.Timestamp):
+        return int(timestamps.value // 10**9)
+    return np.asarray(timestamps, dtype="datetime64[s]").astype(np.int64)
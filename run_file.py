@@ -1,20 +1,4 @@
-import missing_record.generate_html
-import missing_record.generate_missing_data_csvs
-import missing_record.send_email
-from datetime import datetime
+from missing_record.cli import main
 
-config_file_path = "config_files/script_config.yaml"
-
-missing_record.generate_missing_data_csvs.generate(config_file_path)
-missing_record.generate_html.generate(config_file_path)
-
-missing_record.send_email.copy_files(
-    r"\\ares\Hydrology\Hydrology Regions\Missing Record Reporting"
-    + f"\\ {datetime.today().strftime('%Y-%m-%d')}"
-)
-missing_record.send_email.send(
-    "<p>Manual missing record report</p>"
-    "<p>This can be viewed with colours at:</p>"
-    r"<p>\\ares\Hydrology\Hydrology Regions\Missing Record Reporting</p>",
-    "manual missing record report",
-)
+if __name__ == "__main__":
+    main(["manual"])
@@ -0,0 +1,11 @@
+CREATE TABLE Missing_record_history(
+	site VARCHAR(255) NOT NULL
+	,bucket VARCHAR(255) NOT NULL
+	,region VARCHAR(255)
+	,window_start DATETIME NOT NULL
+	,window_end DATETIME NOT NULL
+	,missing_seconds BIGINT
+	,total_seconds BIGINT
+	,recorded_at DATETIME NOT NULL
+	,PRIMARY KEY (site, bucket, window_start, window_end)
+);
@@ -0,0 +1,5 @@
+DELETE FROM Missing_record_history
+  WHERE site = :site
+    AND bucket = :bucket
+    AND window_start = :window_start
+    AND window_end = :window_end
@@ -0,0 +1,21 @@
+INSERT INTO Missing_record_history(
+	site
+	,bucket
+	,region
+	,window_start
+	,window_end
+	,missing_seconds
+	,total_seconds
+	,recorded_at
+)
+VALUES
+(
+	:site
+	,:bucket
+	,:region
+	,:window_start
+	,:window_end
+	,:missing_seconds
+	,:total_seconds
+	,:recorded_at
+);
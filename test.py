@@ -1,5 +1,5 @@
-import missing_record.generate_missing_data_csvs as gcsv
-import missing_record.generate_html as ghtml
+from missing_record.cli import main
 
-gcsv.generate("config_files/script_config.yaml", debug=False)
-ghtml.generate("config_files/script_config.yaml")
+if __name__ == "__main__":
+    main(["fetch"])
+    main(["render"])
@@ -0,0 +1,73 @@
+"""A local SMTP stand-in that keeps what it's sent."""
+
+import socketserver
+import threading
+
+
+class SMTPSink(socketserver.StreamRequestHandler):
+    """Just enough of an SMTP server to accept every message."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.server.connected()
+        self.reply("220 sink")
+        recipients = []
+        while line := self.rfile.readline():
+            verb = line[:4].upper()
+            if verb == b"RCPT":
+                recipients.append(line.split(b":", 1)[1].strip(b" <>\r\n").decode())
+                self.reply("250 ok")
+            elif verb == b"DATA":
+                self.reply("354 go on")
+                data = []
+                while (data_line := self.rfile.readline()) not in (b".\r\n", b""):
+                    data.append(data_line)
+                self.server.received(recipients, b"".join(data))
+                recipients = []
+                self.reply("250 kept")
+            elif verb == b"QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+
+class SMTPSinkServer(socketserver.ThreadingTCPServer):
+    """Serves SMTPSink, counting connections and keeping every message.
+
+    Attributes
+    ----------
+    connections : int
+        Number of sessions that were opened.
+    messages : list of (list of str, bytes)
+        The recipients and data of each message, in the order they came in.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPSink)
+        self.connections = 0
+        self.messages = []
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def connected(self):
+        with self._lock:
+            self.connections += 1
+
+    def received(self, recipients, data):
+        with self._lock:
+            self.messages.append((recipients, data))
+
+
+def start_sink():
+    """An SMTPSinkServer serving in the background, stopped with shutdown()."""
+    server = SMTPSinkServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,88 @@
+"""Resuming from a CheckpointJournal."""
+
+from concurrent.futures import Future
+
+import pytest
+
+from missing_record.checkpoint import CheckpointJournal
+
+
+def finished_future(result=None, error=None):
+    future = Future()
+    if error is None:
+        future.set_result(result)
+    else:
+        future.set_exception(error)
+    return future
+
+
+def test_results_are_replayed(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = CheckpointJournal(path)
+    journal.record_future("Site", "Flow", finished_future(((3600, 86400), None)))
+    journal.close()
+
+    resumed = CheckpointJournal(path)
+    assert resumed.finished("Site", "Flow").result() == ((3600, 86400), None)
+    assert resumed.finished("Site", "Stage") is None
+    resumed.close()
+
+
+def test_errors_are_replayed(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = CheckpointJournal(path)
+    journal.record_future(
+        "Site", "Flow", finished_future(error=ValueError("Unknown measurement"))
+    )
+    # Anything else is tried again next time
+    journal.record_future("Site", "Stage", finished_future(error=OSError("timeout")))
+    journal.close()
+
+    resumed = CheckpointJournal(path)
+    with pytest.raises(ValueError, match="Unknown measurement"):
+        resumed.finished("Site", "Flow").result()
+    assert resumed.finished("Site", "Stage") is None
+    resumed.close()
+
+
+def test_torn_last_line_is_ignored(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = CheckpointJournal(path)
+    journal.record_future("Site", "Flow", finished_future(((0, 86400),)))
+    journal.close()
+    with open(path, "a") as f:
+        f.write('{"site": "Site", "measurement": "Sta')
+
+    resumed = CheckpointJournal(path)
+    assert list(resumed.done) == [("Site", "Flow")]
+    resumed.close()
+
+
+def test_editing_overrides_starts_a_fresh_journal(tmp_path):
+    overrides = tmp_path / "MR_Sites_Open.csv"
+    overrides.write_text("Site,Measurement,Datetime\n")
+    config = {
+        "checkpoint_dir": str(tmp_path / "checkpoints"),
+        "base_url": "http://hilltop/",
+        "hts": "boo.hts",
+    }
+    windows = {"month": ("2025-03-01 00:00", "2025-03-31 23:59:59")}
+
+    def open_journal():
+        return CheckpointJournal.from_config(
+            config, windows, override_files=[str(overrides)]
+        )
+
+    journal = open_journal()
+    journal.record_future("Site", "Flow", finished_future(((3600, 86400),)))
+    journal.close()
+    resumed = open_journal()
+    assert resumed.path == journal.path
+    assert resumed.finished("Site", "Flow") is not None
+    resumed.close()
+
+    overrides.write_text("Site,Measurement,Datetime\nSite,Flow,15/03/2025 00:00\n")
+    edited = open_journal()
+    assert edited.path != journal.path
+    assert edited.finished("Site", "Flow") is None
+    edited.close()
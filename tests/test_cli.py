@@ -0,0 +1,38 @@
+"""Cold start of the python -m missing_record commands."""
+
+import json
+import subprocess
+import sys
+
+from benchmarks import cold_start
+
+
+def loaded_modules(code):
+    """The heavy libraries a fresh interpreter has loaded after running code."""
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"{code}\nimport json, sys\n"
+            f"print(json.dumps([m for m in {cold_start.HEAVY!r} if m in sys.modules]))",
+        ],
+        cwd=cold_start.REPO_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def test_cli_import_is_light():
+    assert loaded_modules("import missing_record.cli") == []
+
+
+def test_entry_points_only_run_as_main():
+    # e.g. when a spawned html_processes worker imports them again
+    assert loaded_modules("import missing_record.__main__, run_file, test") == []
+
+
+def test_light_commands_start_within_budget(capsys):
+    # --help, copy and send, each in a fresh interpreter
+    assert cold_start.main(["--repeat", "3"]) == 0, capsys.readouterr().out
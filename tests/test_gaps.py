@@ -0,0 +1,110 @@
+"""missing_record.gaps against the pandas path it replaced."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import missing_record.gaps as gaps
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+def pandas_missing_seconds(timestamps, start, end, step):
+    """The floor/drop duplicates/reindex count report_missing_record used to do."""
+    freq = pd.to_timedelta(step, unit="s")
+    series = pd.Series(
+        np.ones(len(timestamps)), index=pd.to_datetime(timestamps, unit="s")
+    )
+    series.index = series.index.floor(freq)
+    series = series[~series.index.duplicated(keep="first")]
+    series = series.reindex(
+        pd.date_range(
+            pd.to_datetime(start, unit="s"), pd.to_datetime(end, unit="s"), freq=freq
+        )
+    )
+    missing_points = series.asfreq(freq).isna().sum()
+    return int((missing_points * freq).total_seconds())
+
+
+def random_series(rng, start, end):
+    """Unsorted samples with duplicates and some outside the window."""
+    n = rng.integers(1, 300)
+    timestamps = rng.integers(start - 2 * DAY, end + 2 * DAY, n)
+    duplicates = rng.choice(timestamps, rng.integers(0, n + 1))
+    return rng.permutation(np.concatenate([timestamps, duplicates]))
+
+
+WINDOWS = [
+    # Aligned to both steps
+    ("2024-03-01 00:00", "2024-03-08 00:00"),
+    # Ends in the middle of a bucket
+    ("2024-03-01 00:00", "2024-03-08 23:59:59"),
+    # Starts in the middle of an hour, so nothing lines up
+    ("2024-03-01 00:30", "2024-03-03 12:00"),
+    # Starts on an hour but not a day
+    ("2024-03-01 05:00", "2024-03-09 05:00"),
+    # A single bucket
+    ("2024-03-01 00:00", "2024-03-01 00:00"),
+]
+
+
+@pytest.mark.parametrize("step", [HOUR, DAY])
+@pytest.mark.parametrize("window", WINDOWS)
+def test_missing_seconds_matches_pandas(window, step):
+    rng = np.random.default_rng(step)
+    start, end = (int(pd.Timestamp(t).timestamp()) for t in window)
+    for _ in range(25):
+        timestamps = random_series(rng, start, end)
+        assert gaps.missing_seconds(
+            timestamps, start, end, step
+        ) == pandas_missing_seconds(timestamps, start, end, step)
+
+
+@pytest.mark.parametrize("step", [HOUR, DAY])
+@pytest.mark.parametrize("window", WINDOWS)
+def test_empty_series_is_all_missing(window, step):
+    start, end = (int(pd.Timestamp(t).timestamp()) for t in window)
+    empty = np.array([], dtype=np.int64)
+    assert gaps.missing_seconds(empty, start, end, step) == pandas_missing_seconds(
+        empty, start, end, step
+    )
+
+
+def test_batch_matches_pandas():
+    rng = np.random.default_rng(0)
+    timestamps_list, starts, ends, steps = [], [], [], []
+    for i in range(200):
+        start, end = (
+            int(pd.Timestamp(t).timestamp()) for t in WINDOWS[i % len(WINDOWS)]
+        )
+        step = [HOUR, DAY][i % 2]
+        # Every tenth series is empty
+        if i % 10 == 0:
+            timestamps = np.array([], dtype=np.int64)
+        else:
+            timestamps = random_series(rng, start, end)
+        timestamps_list.append(timestamps)
+        starts.append(start)
+        ends.append(end)
+        steps.append(step)
+
+    expected = [
+        pandas_missing_seconds(*args)
+        for args in zip(timestamps_list, starts, ends, steps)
+    ]
+    batch = gaps.missing_seconds_batch(timestamps_list, starts, ends, steps)
+    assert batch.dtype == np.int64
+    assert batch.tolist() == expected
+
+
+def test_batch_of_empty_series():
+    start, end = (int(pd.Timestamp(t).timestamp()) for t in WINDOWS[0])
+    empty = np.array([], dtype=np.int64)
+    batch = gaps.missing_seconds_batch(
+        [empty, empty], [start] * 2, [end] * 2, [HOUR, DAY]
+    )
+    assert batch.tolist() == [
+        pandas_missing_seconds(empty, start, end, HOUR),
+        pandas_missing_seconds(empty, start, end, DAY),
+    ]
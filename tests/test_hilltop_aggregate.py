@@ -0,0 +1,115 @@
+"""Raw and server aggregated fetches against the synthetic Hilltop server."""
+
+import argparse
+import os
+import queue
+import threading
+
+import pandas as pd
+import pytest
+import yaml
+
+import missing_record.generate_missing_data_csvs as generate_missing_data_csvs
+from benchmarks.run_benchmark import active_measurements, write_workdir
+from benchmarks.synthetic_hilltop import serve
+
+BUCKETS = ["Rainfall", "Water Level", "Air Temperature"]
+
+
+@pytest.fixture(scope="module")
+def hilltop():
+    """Base URL and measurements of a synthetic Hilltop serving in a thread."""
+    measurements = active_measurements(BUCKETS)
+    settings = {
+        "sampling_seconds": [300, 900, 5400],
+        "gap_density": 0.1,
+        "empty_fraction": 0.3,
+        "latency_ms": 0,
+    }
+    port_queue = queue.Queue()
+    threading.Thread(
+        target=serve,
+        args=(settings, [m[0] for m in measurements], port_queue),
+        daemon=True,
+    ).start()
+    return f"http://127.0.0.1:{port_queue.get(timeout=30)}/", measurements
+
+
+def run(hilltop, workdir, cache_dir, **settings):
+    """Run generate in workdir, returning its results and the 15min view's."""
+    base_url, measurements = hilltop
+    args = argparse.Namespace(
+        sites=8,
+        days=4,
+        end="2025-03-31 23:59:59",
+        set=[],
+    )
+    os.makedirs(workdir)
+    config_path = write_workdir(workdir, args, base_url, measurements)
+    with open(config_path) as f:
+        config = yaml.safe_load(f)
+    config.update(
+        {
+            "cache_dir": cache_dir,
+            "coverage_store_dir": None,
+            "checkpoint_dir": None,
+            "site_list_cache_dir": None,
+            "override_cache_dir": None,
+            "record_history": False,
+            "csv_export": False,
+            "coverage_views": [],
+            "aggregate_method": None,
+            **settings,
+        }
+    )
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f)
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        results = generate_missing_data_csvs.generate(config_path)
+        view = None
+        if "15min" in config["coverage_views"]:
+            view = pd.read_parquet("output_csv/results_15min.parquet")
+    finally:
+        os.chdir(cwd)
+    return results, view
+
+
+def test_aggregated_matches_raw(hilltop, tmp_path):
+    raw, _ = run(hilltop, tmp_path / "raw", None)
+    aggregated, _ = run(
+        hilltop, tmp_path / "aggregated", None, aggregate_method="Count"
+    )
+    assert raw["missing_seconds"].notna().any()
+    pd.testing.assert_frame_equal(raw, aggregated)
+
+
+def test_aggregated_matches_raw_through_the_cache(hilltop, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    raw, _ = run(hilltop, tmp_path / "raw", None)
+    # Once to fill the cache and once from it
+    for i in range(2):
+        aggregated, _ = run(
+            hilltop, tmp_path / f"aggregated_{i}", cache_dir, aggregate_method="Count"
+        )
+        pd.testing.assert_frame_equal(raw, aggregated)
+
+
+def test_aggregated_cache_isnt_read_as_samples(hilltop, tmp_path):
+    """A finer view after an aggregated run on the same cache needs the samples."""
+    fresh, fresh_view = run(
+        hilltop,
+        tmp_path / "fresh",
+        str(tmp_path / "fresh_cache"),
+        coverage_views=["15min"],
+    )
+    shared_cache = str(tmp_path / "shared_cache")
+    run(hilltop, tmp_path / "aggregated", shared_cache, aggregate_method="Count")
+    shared, shared_view = run(
+        hilltop, tmp_path / "shared", shared_cache, coverage_views=["15min"]
+    )
+    assert fresh_view["missing_seconds"].notna().any()
+    pd.testing.assert_frame_equal(fresh, shared)
+    pd.testing.assert_frame_equal(fresh_view, shared_view)
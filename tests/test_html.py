@@ -0,0 +1,75 @@
+"""Size and contents of the compact html tables the emails are made of."""
+
+import csv
+import html.parser
+import os
+
+import numpy as np
+import pandas as pd
+
+import missing_record.generate_html as generate_html
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Most bytes the compact table of a 300 site report can be
+COMPACT_BUDGET = 120 * 1024
+
+
+class TableCells(html.parser.HTMLParser):
+    """The text of every header and data cell of a table, checking its tags match."""
+
+    def __init__(self):
+        super().__init__()
+        self.open = []
+        self.cells = []
+        self.errors = 0
+
+    def handle_starttag(self, tag, attrs):
+        self.open.append(tag)
+        if tag in ("th", "td"):
+            self.cells.append("")
+
+    def handle_endtag(self, tag):
+        if not self.open or self.open.pop() != tag:
+            self.errors += 1
+
+    def handle_data(self, data):
+        if self.open and self.open[-1] in ("th", "td"):
+            self.cells[-1] += data.strip()
+
+
+def synthetic_report(sites, empty_fraction, seed=0):
+    """Missing hours of every bucket in Active_Measurements.csv at each site."""
+    with open(
+        os.path.join(REPO_DIR, "config_files", "Active_Measurements.csv"), newline=""
+    ) as f:
+        buckets = list(dict.fromkeys(row[1] for row in csv.reader(f) if row))
+    rng = np.random.default_rng(seed)
+    hours = rng.exponential(40, (sites, len(buckets)))
+    hours[rng.random(hours.shape) < 0.2] = 0
+    hours[rng.random(hours.shape) < empty_fraction] = np.nan
+    return pd.DataFrame(
+        hours, index=[f"Site {i:03d}" for i in range(sites)], columns=buckets
+    )
+
+
+def cells(table):
+    parser = TableCells()
+    parser.feed(table)
+    parser.close()
+    assert parser.errors == 0
+    assert parser.open == []
+    return parser.cells
+
+
+def test_compact_table_is_within_budget():
+    report = synthetic_report(300, 0.5)
+    assert len(generate_html.render_compact_table(report)) <= COMPACT_BUDGET
+
+
+def test_compact_table_has_the_same_cells():
+    report = synthetic_report(300, 0.5)
+    compact = cells(generate_html.render_compact_table(report))
+    assert compact == cells(generate_html.render_table(report))
+    assert "-" in compact
+    assert "0.00h" in compact
@@ -0,0 +1,49 @@
+"""Building the measurement catalog when some sites' requests fail."""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+import missing_record.measurement_catalog as measurement_catalog
+from missing_record.run_metrics import RunMetrics
+
+CATALOG = {"Flow [Flow]": ("2020-01-01", "2025-03-31")}
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        ValueError("No such site"),
+        requests.exceptions.ConnectionError("The server is probably down"),
+        requests.exceptions.Timeout("Read timed out"),
+        ConnectionResetError("Connection reset by peer"),
+    ],
+)
+def test_failed_site_tries_everything(monkeypatch, error):
+    def get_site_catalog(base_url, hts, site):
+        if site == "Broken":
+            raise error
+        return CATALOG
+
+    monkeypatch.setattr(measurement_catalog, "get_site_catalog", get_site_catalog)
+    metrics = RunMetrics(progress=None)
+    with ThreadPoolExecutor(2) as executor:
+        catalog = measurement_catalog.build_catalog(
+            executor,
+            "http://hilltop/",
+            "boo.hts",
+            ["Good", "Broken", "Also good"],
+            metrics,
+        )
+    assert catalog == {"Good": CATALOG, "Broken": None, "Also good": CATALOG}
+    assert metrics.failure_counts() == {("catalog", type(error).__name__): 1}
+
+
+def test_other_errors_are_raised(monkeypatch):
+    def get_site_catalog(base_url, hts, site):
+        raise KeyError(site)
+
+    monkeypatch.setattr(measurement_catalog, "get_site_catalog", get_site_catalog)
+    with ThreadPoolExecutor(2) as executor, pytest.raises(KeyError):
+        measurement_catalog.build_catalog(executor, "http://hilltop/", "boo.hts", ["A"])
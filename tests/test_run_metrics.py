@@ -0,0 +1,48 @@
+"""Failures and the console summary of RunMetrics."""
+
+from missing_record.run_metrics import RunMetrics, _prometheus_text
+
+
+def test_failures_are_counted_by_stage_and_type():
+    metrics = RunMetrics(progress=None)
+    with metrics.pair("Site A", "Flow") as record:
+        record["outcome"] = "data"
+    metrics.failed("pairs", "Site B", "Flow", ValueError("Unknown measurement"))
+    metrics.failed("pairs", "Site C", "Flow", ValueError("Unknown site"))
+    metrics.failed("catalog", "Site D", None, ConnectionError("timed out"))
+    metrics.increment("cache_day_hits", 12)
+
+    assert metrics.failure_counts() == {
+        ("pairs", "ValueError"): 2,
+        ("catalog", "ConnectionError"): 1,
+    }
+    report = metrics.report()
+    assert report["failures"][0] == {
+        "stage": "pairs",
+        "site": "Site B",
+        "measurement": "Flow",
+        "error": "ValueError",
+        "message": "Unknown measurement",
+    }
+    text = _prometheus_text(report)
+    assert 'missing_record_failures{stage="pairs",error="ValueError"} 2.0' in text
+    assert (
+        'missing_record_failures{stage="catalog",error="ConnectionError"} 1.0' in text
+    )
+
+    summary = metrics.summary()
+    assert "\n" not in summary
+    assert summary.startswith("1 pairs in ")
+    assert "1 data" in summary
+    assert "1 catalog ConnectionError, 2 pairs ValueError" in summary
+    assert "cache_day_hits 12" in summary
+
+
+def test_progress_goes_to_the_hook():
+    messages = []
+    metrics = RunMetrics(progress=messages.append)
+    metrics.site_done("Site A", 1.5)
+    metrics.progress(metrics.summary())
+    assert len(messages) == 2
+    assert messages[0] == "Site A 1.50s"
+    assert messages[1].startswith("0 pairs in ")
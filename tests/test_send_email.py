@@ -0,0 +1,124 @@
+"""Sending the reports through the SMTP pool, against a local sink."""
+
+import email
+import os
+
+import pytest
+import yaml
+
+import missing_record.send_email as send_email
+from tests.smtp_sink import start_sink
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONNECTIONS = 3
+
+
+@pytest.fixture
+def recipients():
+    with open(os.path.join(REPO_DIR, "config_files", "recipients.yaml")) as file:
+        return yaml.safe_load(file)
+
+
+@pytest.fixture
+def sink(monkeypatch, tmp_path, recipients):
+    """A sink with the email settings pointing at it, and every report in tmp_path."""
+    server = start_sink()
+    monkeypatch.chdir(REPO_DIR)
+    monkeypatch.delenv("EMAIL_SERVER_CONFIG_PATH", raising=False)
+    for name, value in {
+        "EMAIL_SERVER": "127.0.0.1",
+        "EMAIL_PORT": str(server.port),
+        "EMAIL_STARTTLS": "false",
+        "EMAIL_PASSWORD": "",
+        "EMAIL_ADDRESS": "reports@example.com",
+        "EMAIL_RATE_PER_MINUTE": "1000000",
+        "EMAIL_BURST": "1000",
+        "EMAIL_CONNECTIONS": str(CONNECTIONS),
+    }.items():
+        monkeypatch.setenv(name, value)
+    for recipient in recipients:
+        monkeypatch.setenv(
+            recipient,
+            ", ".join(f"{recipient.lower()}.{i}@example.com" for i in range(4)),
+        )
+        for suffix in recipients[recipient]["file_suffix"]:
+            (tmp_path / f"output{suffix}.html").write_text(f"<table>{suffix}</table>")
+    send_email.email_settings.cache_clear()
+    yield server
+    send_email.email_settings.cache_clear()
+    server.shutdown()
+    server.server_close()
+
+
+def test_every_address_gets_one_message(sink, recipients, tmp_path):
+    send_email.send("<p>Report</p>", "March", html_dir=str(tmp_path))
+
+    addresses = [address for to, _ in sink.messages for address in to]
+    assert len(addresses) == 4 * len(recipients)
+    assert sorted(addresses) == sorted(
+        f"{recipient.lower()}.{i}@example.com"
+        for recipient in recipients
+        for i in range(4)
+    )
+    for to, data in sink.messages:
+        message = email.message_from_bytes(data)
+        assert message["To"] == to[0]
+        recipient = to[0].split(".")[0].upper()
+        assert message["Subject"] == recipients[recipient]["title_prefix"] + "March"
+        html = message.get_payload()[0].get_payload(decode=True).decode()
+        for suffix in recipients[recipient]["file_suffix"]:
+            assert f"<table>{suffix}</table>" in html
+
+
+def test_sessions_are_reused(sink, tmp_path):
+    send_email.send(title="March", html_dir=str(tmp_path))
+    assert 1 <= sink.connections <= CONNECTIONS
+
+
+def test_body_is_built_once_per_group(sink, recipients, tmp_path, monkeypatch):
+    built = []
+    mime_text = send_email.MIMEText
+
+    def counting_mime_text(*args, **kwargs):
+        built.append(args)
+        return mime_text(*args, **kwargs)
+
+    monkeypatch.setattr(send_email, "MIMEText", counting_mime_text)
+    send_email.send(title="March", html_dir=str(tmp_path))
+    assert len(built) == len(recipients)
+    assert len(sink.messages) == 4 * len(recipients)
+
+
+class FakeClock:
+    """monotonic() and sleep() for a clock that only moves when slept on."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.mark.parametrize("burst", [1, 3])
+def test_token_bucket_spaces_sends(monkeypatch, burst):
+    clock = FakeClock()
+    monkeypatch.setattr(send_email.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(send_email.time, "sleep", clock.sleep)
+    # Two a second
+    limiter = send_email.TokenBucket(2, burst)
+
+    sent = []
+    for _ in range(burst + 4):
+        limiter.acquire()
+        sent.append(clock.now - 1000)
+    assert sent == [0.0] * burst + [0.5, 1.0, 1.5, 2.0]
+
+    # An idle spell saves up no more than the burst
+    clock.sleep(60)
+    start = clock.now - 1000
+    for _ in range(burst + 1):
+        limiter.acquire()
+    assert clock.now - 1000 == start + 0.5
@@ -0,0 +1,134 @@
+"""site_list_merge against an in-memory SQLite database."""
+
+import os
+
+import pandas as pd
+import pytest
+import sqlalchemy as db
+
+import missing_record.site_list_merge as site_list_merge
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WINDOW = ("2025-03-01 00:00", "2025-03-31 23:59:59")
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    """A pooled engine on an empty in-memory database with the history table."""
+    # The queries are read relative to the repository root
+    monkeypatch.chdir(REPO_DIR)
+    engine = site_list_merge.get_engine("sqlite://")
+    with open("sql_queries/create_history.sql") as f, engine.begin() as conn:
+        conn.execute(db.text(f.read()))
+    yield engine
+    site_list_merge.dispose_engines()
+
+
+def results(n_sites, missing, bucket="Flow"):
+    return pd.DataFrame(
+        {
+            "site": [f"Site {i}" for i in range(n_sites)],
+            "bucket": bucket,
+            "region": "Manawatu",
+            "missing_seconds": missing,
+            "total_seconds": 86400,
+        }
+    )
+
+
+def history(engine):
+    return pd.read_sql(
+        "SELECT site, bucket, missing_seconds FROM Missing_record_history"
+        " ORDER BY site, bucket",
+        engine,
+    )
+
+
+def test_rerun_replaces_the_window(engine):
+    site_list_merge.insert_history(results(5, 3600), *WINDOW, engine)
+    site_list_merge.insert_history(results(5, 7200), *WINDOW, engine)
+    rows = history(engine)
+    assert len(rows) == 5
+    assert not rows.duplicated(["site", "bucket"]).any()
+    assert (rows["missing_seconds"] == 7200).all()
+
+
+def test_other_windows_are_kept(engine):
+    site_list_merge.insert_history(results(3, 3600), *WINDOW, engine)
+    site_list_merge.insert_history(
+        results(3, 7200), "2025-04-01 00:00", "2025-04-30 23:59:59", engine
+    )
+    assert len(history(engine)) == 6
+
+
+def test_no_result_is_null(engine):
+    site_list_merge.insert_history(results(2, float("nan")), *WINDOW, engine)
+    assert history(engine)["missing_seconds"].isna().all()
+
+
+def test_batches_are_one_transaction(engine):
+    commits = []
+    db.event.listen(engine, "commit", lambda conn: commits.append(conn))
+    site_list_merge.insert_history(results(25, 3600), *WINDOW, engine, batch_size=10)
+    assert len(commits) == 1
+    assert len(history(engine)) == 25
+
+    # A batch that fails after others have gone through leaves no trace of any
+    rerun = results(25, 7200)
+    rerun.loc[24, "site"] = rerun.loc[23, "site"]
+    with pytest.raises(db.exc.IntegrityError):
+        site_list_merge.insert_history(rerun, *WINDOW, engine, batch_size=10)
+    rows = history(engine)
+    assert len(rows) == 25
+    assert (rows["missing_seconds"] == 3600).all()
+
+
+def test_engine_is_shared_per_url(engine):
+    assert site_list_merge.get_engine("sqlite://") is engine
+    other = site_list_merge.get_engine(db.engine.make_url("sqlite:///other.db"))
+    assert other is not engine
+    assert site_list_merge.get_engine("sqlite:///other.db") is other
+
+
+def test_query_result_is_cached(engine, tmp_path):
+    site_list_merge.insert_history(results(3, 3600), *WINDOW, engine)
+    query_file = str(tmp_path / "get_history.sql")
+    with open(query_file, "w") as f:
+        f.write(
+            "SELECT site, missing_seconds FROM Missing_record_history ORDER BY site"
+        )
+    # pandas looks the query up as a table name first, so count only the query
+    queries = []
+    db.event.listen(
+        engine,
+        "before_cursor_execute",
+        lambda *args: args[2].startswith("SELECT") and queries.append(args[2]),
+    )
+    cache_dir = str(tmp_path / "cache")
+
+    first = site_list_merge.read_sql_cached(query_file, engine, cache_dir, 1)
+    assert len(queries) == 1
+    assert list(first["site"]) == ["Site 0", "Site 1", "Site 2"]
+    (cached,) = os.listdir(cache_dir)
+    assert cached.endswith(".parquet")
+
+    # Inside the ttl the copy is read, even though the table has changed
+    site_list_merge.insert_history(results(4, 3600), *WINDOW, engine)
+    queries.clear()
+    pd.testing.assert_frame_equal(
+        site_list_merge.read_sql_cached(query_file, engine, cache_dir, 1), first
+    )
+    assert queries == []
+
+    # Once it's expired the query is run again
+    path = os.path.join(cache_dir, cached)
+    expired = os.path.getmtime(path) - 2 * 3600
+    os.utime(path, (expired, expired))
+    refreshed = site_list_merge.read_sql_cached(query_file, engine, cache_dir, 1)
+    assert len(queries) == 1
+    assert len(refreshed) == 4
+
+    # And a ttl of 0 always queries
+    queries.clear()
+    site_list_merge.read_sql_cached(query_file, engine, cache_dir, 0)
+    assert len(queries) == 1
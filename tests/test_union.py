@@ -0,0 +1,103 @@
+"""Union buckets against a brute force OR of each sensor's presence."""
+
+import numpy as np
+import pytest
+
+import missing_record.gaps as gaps
+from missing_record.results import ResultMatrix
+
+HOUR = 3600
+DAY = 24 * HOUR
+START = 1738368000  # 2025-02-01 00:00
+
+
+def random_sensor(rng, step):
+    """A sensor's window (sometimes cut short, as by a site override) and samples."""
+    start = START + step * int(rng.integers(0, 5)) * (rng.random() < 0.3)
+    end = START + 14 * DAY - 1 - step * int(rng.integers(0, 5)) * (rng.random() < 0.3)
+    sampling = int(rng.choice([300, 900, 5400]))
+    timestamps = np.arange(start - DAY, end + DAY, sampling)
+    # Knock out random runs of hours
+    hours = timestamps // HOUR
+    down = rng.random(hours.max() - hours.min() + 1) < rng.uniform(0, 0.8)
+    return start, end, timestamps[~down[hours - hours.min()]]
+
+
+def coverage(start, end, step, timestamps):
+    """(start, end, step, gaps) of a sensor, as generate works it out."""
+    present = gaps.presence(timestamps, start, end, step)
+    gap_starts, gap_ends = gaps.gap_intervals(present, start, step)
+    return (start, end, step, tuple(zip(gap_starts.tolist(), gap_ends.tolist())))
+
+
+def brute_force(sensors, step):
+    """Missing and total seconds, checking every bucket of every sensor."""
+    present = {}
+    windows = []
+    for start, end, timestamps in sensors:
+        windows.append((start, end))
+        for k, has_data in enumerate(gaps.presence(timestamps, start, end, step)):
+            bucket = start + k * step
+            present[bucket] = present.get(bucket, False) or bool(has_data)
+    missing = sum(step for has_data in present.values() if not has_data)
+
+    total = 0
+    reach = None
+    for start, end in sorted(windows):
+        if reach is None or start > reach:
+            total += end - start
+            reach = end
+        elif end > reach:
+            total += end - reach
+            reach = end
+    return missing, total
+
+
+@pytest.mark.parametrize("step", [HOUR, DAY])
+def test_union_matches_brute_force(step):
+    rng = np.random.default_rng(step)
+    n_sites = 40
+    # Three sensors in the union bucket and one in a summed bucket
+    columns = ["A", "B", "C", "Flow"]
+    column_buckets = ["Union", "Union", "Union", "Flow"]
+    result = ResultMatrix.empty([f"Site {i}" for i in range(n_sites)], columns)
+    site_sensors = {}
+    cell_coverage = {}
+    for i in range(n_sites):
+        site_sensors[i] = []
+        for j in range(3):
+            # Some sites have fewer sensors, or none at all
+            if rng.random() < 0.25:
+                continue
+            start, end, timestamps = random_sensor(rng, step)
+            site_sensors[i].append((start, end, timestamps))
+            cell_coverage[(i, j)] = coverage(start, end, step, timestamps)
+            result.missing[i, j] = gaps.missing_seconds(timestamps, start, end, step)
+            result.total[i, j] = end - start
+            result.valid[i, j] = True
+        result.missing[i, 3] = HOUR
+        result.total[i, 3] = DAY
+        result.valid[i, 3] = True
+
+    buckets = result.by_bucket(
+        column_buckets, ["Union", "Flow"], {"Union": "union"}, cell_coverage
+    )
+    for i in range(n_sites):
+        if site_sensors[i]:
+            assert buckets.valid[i, 0]
+            assert (buckets.missing[i, 0], buckets.total[i, 0]) == brute_force(
+                site_sensors[i], step
+            )
+        else:
+            assert not buckets.valid[i, 0]
+            assert buckets.total[i, 0] == 0
+    assert (buckets.missing[:, 1] == HOUR).all()
+    assert (buckets.total[:, 1] == DAY).all()
+
+
+def test_union_missing_of_one_group():
+    rng = np.random.default_rng(1)
+    sensors = [random_sensor(rng, HOUR) for _ in range(4)]
+    assert gaps.union_missing(
+        [coverage(start, end, HOUR, t) for (start, end, t) in sensors]
+    ) == brute_force(sensors, HOUR)
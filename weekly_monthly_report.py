@@ -0,0 +1,4 @@
+from missing_record.cli import main
+
+if __name__ == "__main__":
+    main(["weekly-monthly"])